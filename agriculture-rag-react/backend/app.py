@@ -1,17 +1,27 @@
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, Response, g, request, jsonify, send_from_directory, send_file, stream_with_context
 from flask_cors import CORS
+import logging
 import os
+import tempfile
+import threading
+import time
+import uuid
 from werkzeug.utils import secure_filename
 from config import Config
 from src.document_processor.pdf_processor import PDFProcessor
 from src.embeddings.text_embeddings import TextEmbedder
 from src.embeddings.image_embeddings import ImageEmbedder
+from src.embeddings.embedding_cache import EmbeddingCache
 from src.retrieval.vector_store import VectorStore
 from src.retrieval.rag_pipeline import RAGPipeline
-from src.utils.helpers import save_uploaded_file, is_pdf, extract_first_page_as_image
-from src.utils.logger import get_logger
+from src.retrieval.response_cache import ResponseCache
+from src.ingestion import IngestionPipeline, JobQueue, JobQueueFullError, DocumentRegistry
+from src.utils.helpers import compute_file_hash
+from src.utils.logger import get_logger, push_context, pop_context, stage_durations, valid_request_id
+from src.utils import metrics
+from src.utils.startup import WarmUp, startup_timings
+import json
 import warnings
-from PIL import Image
 
 # Suppress warnings
 warnings.filterwarnings("ignore")
@@ -23,27 +33,168 @@ CORS(app, resources={
     r"/static/*": {"origins": "*"}
 }, supports_credentials=True)
 
+_import_started = time.perf_counter()
+
 # Initialize configuration and logging
 config = Config()
 config.setup()
 logger = get_logger(__name__)
 
-# Initialize components
-text_embedder = TextEmbedder()
-image_embedder = ImageEmbedder()
+# Initialize components. Constructing them is cheap: models, the LLM client and
+# the vector store load on first use, or up front through warm_up()
+embedding_cache = None
+if config.EMBEDDING_CACHE_ENABLED:
+    embedding_cache = EmbeddingCache(config.EMBEDDING_CACHE_PATH, max_bytes=config.EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+
+text_embedder = TextEmbedder(
+    model_name=config.TEXT_EMBEDDING_MODEL,
+    revision=config.TEXT_EMBEDDING_REVISION,
+    cache=embedding_cache,
+    query_cache_size=config.QUERY_EMBEDDING_CACHE_SIZE
+)
+image_embedder = ImageEmbedder(
+    model_name=config.IMAGE_EMBEDDING_MODEL,
+    revision=config.IMAGE_EMBEDDING_REVISION,
+    cache=embedding_cache,
+    query_cache_size=config.QUERY_EMBEDDING_CACHE_SIZE
+)
 vector_store = VectorStore()
 
-# Handle vector store loading
-if not vector_store.load(config.VECTOR_STORE_PATH):
-    logger.warning("Could not load vector store, initializing empty")
-    vector_store.initialize_indexes()
+def _load_vector_store():
+    if not vector_store.load(config.VECTOR_STORE_PATH):
+        logger.warning("Could not load vector store, initializing empty")
+        vector_store.initialize_indexes()
 
 pdf_processor = PDFProcessor()
+response_cache = None
+if config.RESPONSE_CACHE_ENABLED:
+    response_cache = ResponseCache(
+        max_entries=config.RESPONSE_CACHE_MAX_ENTRIES,
+        ttl_seconds=config.RESPONSE_CACHE_TTL,
+        similarity_threshold=config.RESPONSE_CACHE_SIMILARITY
+    )
 rag_pipeline = RAGPipeline(
     vector_store=vector_store,
-    text_embedder=text_embedder
+    text_embedder=text_embedder,
+    response_cache=response_cache,
+    image_embedder=image_embedder
 )
 
+document_registry = DocumentRegistry(config.DOCUMENT_REGISTRY_PATH)
+ingestion_pipeline = IngestionPipeline(
+    pdf_processor=pdf_processor,
+    text_embedder=text_embedder,
+    image_embedder=image_embedder,
+    vector_store=vector_store,
+    vector_store_path=config.VECTOR_STORE_PATH,
+    registry=document_registry
+)
+ingestion_queue = JobQueue(
+    handler=ingestion_pipeline.ingest,
+    num_workers=config.INGEST_WORKERS,
+    max_queue_size=config.INGEST_QUEUE_SIZE,
+    history_size=config.INGEST_JOB_HISTORY,
+    state_dir=config.INGEST_JOB_STATE_DIR
+)
+
+warmup = WarmUp()
+warmup.register("vector_store", _load_vector_store)
+warmup.register("text_embedder", text_embedder.load)
+warmup.register("llm", rag_pipeline.load)
+warmup.register("image_embedder", image_embedder.load)
+warmup.register("captioner", pdf_processor.image_processor.load)
+
+def warm_up() -> bool:
+    """Load the components in WARMUP_COMPONENTS now (gunicorn.conf.py does this before fork)"""
+    started = time.perf_counter()
+    ok = warmup.warm_up(config.WARMUP_COMPONENTS)
+    logger.info(f"Warm-up of {', '.join(config.WARMUP_COMPONENTS)} finished in {time.perf_counter() - started:.2f}s")
+    return ok
+
+# Request metrics; pipeline stages record themselves into metrics.STAGE_SECONDS
+HTTP_REQUESTS = metrics.REGISTRY.counter("http_requests_total", "HTTP requests served", ["endpoint", "method", "status"])
+HTTP_SECONDS = metrics.REGISTRY.histogram("http_request_duration_seconds", "HTTP request latency, including streamed bodies",
+                                          ["endpoint"])
+HTTP_IN_FLIGHT = metrics.REGISTRY.gauge("http_requests_in_flight", "HTTP requests being served")
+STORE_VECTORS = metrics.REGISTRY.gauge("vector_store_vectors", "Vectors in the vector store", ["kind"])
+STORE_SEGMENTS = metrics.REGISTRY.gauge("vector_store_journal_segments", "Journal segments not yet compacted")
+STORE_GENERATION = metrics.REGISTRY.gauge("vector_store_snapshot_generation", "Base snapshot generation loaded")
+INGEST_QUEUE = metrics.REGISTRY.gauge("ingest_queue_jobs", "Ingestion jobs in this process's queue", ["state"])
+CACHE_ENTRIES = metrics.REGISTRY.gauge("cache_size", "Entries or bytes held by the caches", ["cache", "unit"])
+
+def _collect_metrics():
+    """Sample component stats into gauges at scrape time"""
+    stats = vector_store.get_stats()
+    STORE_VECTORS.set(stats["text_documents"], kind="text")
+    STORE_VECTORS.set(stats["images"], kind="image")
+    STORE_SEGMENTS.set(stats["journal_segments"])
+    STORE_GENERATION.set(stats["snapshot_generation"])
+    queue_stats = ingestion_queue.stats()
+    INGEST_QUEUE.set(queue_stats["queued"], state="queued")
+    INGEST_QUEUE.set(queue_stats["running"], state="running")
+    if response_cache is not None:
+        CACHE_ENTRIES.set(response_cache.stats()["entries"], cache="response", unit="entries")
+    if embedding_cache is not None:
+        CACHE_ENTRIES.set(embedding_cache.stats()["bytes"], cache="embedding", unit="bytes")
+
+metrics.REGISTRY.add_collector(_collect_metrics)
+
+def after_fork():
+    """Reset per-process state in a worker forked from a preloaded app (see gunicorn.conf.py).
+    
+    Models and the memory-mapped indexes stay shared with the parent; locks,
+    threads and database connections do not survive the fork and are recreated.
+    """
+    vector_store.after_fork()
+    metrics.REGISTRY.reset()
+    if embedding_cache is not None:
+        embedding_cache.reopen()
+    logger.info(f"Worker {os.getpid()} ready")
+
+# Probes and static files are logged at DEBUG so they do not drown the access log
+_QUIET_ENDPOINTS = ('health', 'readiness', 'prometheus_metrics', 'serve')
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.request_id = valid_request_id(request.headers.get('X-Request-ID')) or uuid.uuid4().hex
+    # Every log line of this request (including the RAG event loop's) carries its ID
+    g.log_context = push_context(request_id=g.request_id)
+    HTTP_IN_FLIGHT.inc()
+
+@app.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    # Runs once the body is sent, so streamed chat answers are timed in full
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    HTTP_IN_FLIGHT.dec()
+    endpoint = request.endpoint or 'unmatched'  # Unknown paths share one label
+    HTTP_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+    status = 500 if error is not None else g.pop('response_status', 500)
+    HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=status)
+    duration_ms = round((time.perf_counter() - started) * 1000, 2)
+    logger.log(logging.DEBUG if endpoint in _QUIET_ENDPOINTS else logging.INFO,
+               f"{request.method} {request.path} {status} in {duration_ms}ms",
+               extra={"fields": {"endpoint": endpoint, "status": status, "duration_ms": duration_ms,
+                                 "stages_ms": stage_durations()}})
+    pop_context(g.pop('log_context'))
+
+@app.before_request
+def refresh_vector_store():
+    if request.endpoint in ('health', 'readiness', 'prometheus_metrics'):
+        return
+    # Loads the store on the first request unless warm-up already did
+    warmup.run("vector_store")
+    # Pick up documents other worker processes ingested; a background thread checks and catches up
+    vector_store.refresh(config.VECTOR_STORE_PATH)
+
 # Configure upload folder
 app.config['UPLOAD_FOLDER'] = Config().UPLOAD_DIR
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -51,6 +202,8 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 frontend_build = os.path.join('..', 'frontend', 'build')
 app.static_folder = frontend_build
 
+logger.info(f"App initialized in {time.perf_counter() - _import_started:.2f}s")
+
 # Serve React frontend in production
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -60,6 +213,25 @@ def serve(path):
     else:
         return send_from_directory(app.static_folder, 'index.html')
 
+@app.route('/api/health', methods=['GET'])
+def health():
+    return jsonify({'status': 'ok'})
+
+@app.route('/api/ready', methods=['GET'])
+def readiness():
+    ready = warmup.ready(config.WARMUP_COMPONENTS)
+    return jsonify({
+        'ready': ready,
+        'components': warmup.status(),
+        'timings': startup_timings()
+    }), 200 if ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    if not config.METRICS_ENABLED:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 # API Routes
 @app.route('/api/upload', methods=['POST'])
 def upload_document():
@@ -70,60 +242,60 @@ def upload_document():
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
     
+    filename = secure_filename(file.filename)
+    if not filename:
+        return jsonify({'error': 'Invalid file name'}), 400
+    
+    # Saved under a private name first: the stored name depends on the content, and
+    # nothing another upload or a running ingestion job uses may be overwritten
+    fd, tmp_path = tempfile.mkstemp(dir=app.config['UPLOAD_FOLDER'], suffix='.part')
+    os.close(fd)
     try:
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
+        file.save(tmp_path)
+        content_hash = compute_file_hash(tmp_path)
         
-        if is_pdf(file_path):
-            # Process PDF
-            text_chunks, images = pdf_processor.process_pdf(file_path)
-            text_chunks = text_embedder.embed_documents(text_chunks)
-            images = image_embedder.embed_images(images)
-            
-            vector_store.add_texts(text_chunks)
-            vector_store.add_images(images)
-            vector_store.save(Config().VECTOR_STORE_PATH)
-            
-            # Extract preview image
-            preview_image = extract_first_page_as_image(file_path)
-            preview_path = None
-            if preview_image:
-                preview_path = os.path.join(app.config['UPLOAD_FOLDER'], f"preview_{filename}.jpg")
-                preview_image.save(preview_path)
-            
-            return jsonify({
-                'success': True,
-                'message': 'PDF processed successfully',
-                'preview': preview_path.split('/')[-1] if preview_path else None
-            })
-        else:
-            # Process image
-            image = Image.open(file_path)
-            image_data = {
-                "image": image,
-                "caption": "Uploaded image",
-                "metadata": {
-                    "page_num": 0,
-                    "img_index": 0,
-                    "source": "upload",
-                    "type": "image"
-                }
-            }
-            
-            image_data = image_embedder.embed_images([image_data])[0]
-            vector_store.add_images([image_data])
-            vector_store.save(Config().VECTOR_STORE_PATH)
-            
-            return jsonify({
-                'success': True,
-                'message': 'Image processed successfully',
-                'preview': filename
-            })
+        # Identical bytes were already ingested: answer without touching any model
+        known = document_registry.find_by_hash(content_hash)
+        if known is not None:
+            return jsonify({'success': True, **ingestion_pipeline.duplicate_result(known)})
+        
+        # Stored under its content hash, so two documents never share a path; a file already
+        # at this path has the same bytes, so replacing it is safe even while a job reads it
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], content_hash + os.path.splitext(filename)[1].lower())
+        os.replace(tmp_path, file_path)
+        
+        # Parsing, captioning, embedding and indexing run on the background workers
+        job = ingestion_queue.submit(file_path, filename, content_hash=content_hash, filename=filename)
+        return jsonify({
+            'success': True,
+            'message': 'Document queued for processing',
+            'job_id': job.id,
+            'status': job.status
+        }), 202
     
+    except JobQueueFullError as e:
+        logger.warning(f"Rejected upload: {str(e)}")
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         logger.error(f"Error processing document: {str(e)}")
         return jsonify({'error': str(e)}), 500
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify({
+        'jobs': [job.to_dict() for job in ingestion_queue.list_jobs()],
+        'queue': ingestion_queue.stats()
+    })
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = ingestion_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
 
 # API Routes
 @app.route('/api/chat', methods=['POST', 'OPTIONS'])
@@ -135,18 +307,148 @@ def chat():
     if not data or 'message' not in data:
         return jsonify({'error': 'No message provided'}), 400
     
-    response = rag_pipeline.generate_response(data['message'])
-    return _corsify_response(jsonify({
+    include_images = data.get('include_images', config.CHAT_INCLUDE_IMAGES)
+    if not isinstance(include_images, bool):
+        # Strings such as "false" would otherwise count as true
+        return jsonify({'error': 'include_images must be true or false'}), 400
+    response = rag_pipeline.generate_response(data['message'], include_images=include_images)
+    result = {
         'answer': response['answer'],
-        'sources': [
-            {
-                'page_num': doc.metadata['page_num'] + 1,
-                'content': doc.page_content[:300] + ("..." if len(doc.page_content) > 300 else ""),
-                'type': doc.metadata.get('type', 'text')
-            }
-            for doc in response['source_documents']
-        ]
-    }))
+        'cached': response.get('cached', False),
+        'sources': [_format_source(doc) for doc in response['source_documents']]
+    }
+    if include_images:
+        result['images'] = [_format_image_hit(hit) for hit in response.get('images', [])]
+    return _corsify_response(jsonify(result))
+
+@app.route('/api/chat/stream', methods=['POST', 'OPTIONS'])
+def chat_stream():
+    """Server-sent events: sources first, then answer tokens as the LLM produces them"""
+    if request.method == 'OPTIONS':
+        return _build_cors_preflight_response()
+    
+    data = request.get_json()
+    if not data or 'message' not in data:
+        return jsonify({'error': 'No message provided'}), 400
+    
+    def generate():
+        for event in rag_pipeline.stream_response(data['message']):
+            name = event.pop('event')
+            if name == 'sources':
+                event = {'sources': [_format_source(doc) for doc in event['source_documents']]}
+            yield f"event: {name}\ndata: {json.dumps(event)}\n\n"
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return _corsify_response(response)
+
+def _format_source(doc):
+    return {
+        'page_num': doc.metadata['page_num'] + 1,
+        'content': doc.page_content[:300] + ("..." if len(doc.page_content) > 300 else ""),
+        'type': doc.metadata.get('type', 'text')
+    }
+
+@app.route('/api/search/batch', methods=['POST'])
+def search_batch():
+    data = request.get_json()
+    if not data or not isinstance(data.get('queries'), list) or not data['queries']:
+        return jsonify({'error': 'No queries provided'}), 400
+    
+    queries = [str(query) for query in data['queries']]
+    if len(queries) > config.SEARCH_BATCH_MAX_QUERIES:
+        return jsonify({'error': f'At most {config.SEARCH_BATCH_MAX_QUERIES} queries per request'}), 400
+    try:
+        k = min(int(data.get('k', 5)), config.SEARCH_MAX_K)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'k must be an integer'}), 400
+    mode = data.get('mode', 'hybrid' if config.HYBRID_SEARCH_ENABLED else 'dense')
+    if mode not in ('hybrid', 'dense'):
+        return jsonify({'error': "mode must be 'hybrid' or 'dense'"}), 400
+    
+    try:
+        # One encode call and one FAISS call for the whole batch
+        query_embeddings = text_embedder.embed_queries(queries)
+        if mode == 'hybrid':
+            results = vector_store.search_texts_hybrid_batch(queries, query_embeddings, k=k)
+        else:
+            results = vector_store.search_texts_batch(query_embeddings, k=k)
+        return jsonify({
+            'results': [
+                {
+                    'query': query,
+                    'hits': [_format_search_hit(hit) for hit in hits]
+                }
+                for query, hits in zip(queries, results)
+            ]
+        })
+    except Exception as e:
+        logger.error(f"Error in batch search: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/search/images', methods=['POST'])
+def search_images():
+    """Cross-modal search: text queries against the CLIP image index"""
+    data = request.get_json()
+    if not data or not isinstance(data.get('queries'), list) or not data['queries']:
+        return jsonify({'error': 'No queries provided'}), 400
+    
+    queries = [str(query) for query in data['queries']]
+    if len(queries) > config.SEARCH_BATCH_MAX_QUERIES:
+        return jsonify({'error': f'At most {config.SEARCH_BATCH_MAX_QUERIES} queries per request'}), 400
+    try:
+        k = min(int(data.get('k', 5)), config.SEARCH_MAX_K)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'k must be an integer'}), 400
+    
+    try:
+        query_embeddings = image_embedder.embed_texts(queries)
+        results = vector_store.search_images_batch(query_embeddings, k=k)
+        return jsonify({
+            'results': [
+                {
+                    'query': query,
+                    'hits': [_format_image_hit(hit) for hit in hits]
+                }
+                for query, hits in zip(queries, results)
+            ]
+        })
+    except Exception as e:
+        logger.error(f"Error in image search: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/images/<filename>', methods=['GET'])
+def get_image(filename):
+    """Serve a stored figure or an uploaded image referenced by a search hit"""
+    safe_filename = secure_filename(filename)
+    for directory in (config.IMAGE_STORE_DIR, app.config['UPLOAD_FOLDER']):
+        if os.path.exists(os.path.join(directory, safe_filename)):
+            return send_from_directory(os.path.abspath(directory), safe_filename)
+    return jsonify({'error': 'File not found'}), 404
+
+def _format_image_hit(hit):
+    image = hit['image']
+    metadata = image['metadata']
+    image_path = image.get('image_path')
+    return {
+        'page_num': metadata['page_num'] + 1,
+        'filename': metadata.get('filename'),
+        'caption': image.get('caption', ''),
+        'url': f"/api/images/{os.path.basename(image_path)}" if image_path else None,
+        'score': hit['score']
+    }
+
+def _format_search_hit(hit):
+    document = hit['document']
+    metadata = document['metadata']
+    return {
+        'page_num': metadata['page_num'] + 1,
+        'filename': metadata.get('filename'),
+        'content': document['text'],
+        'type': metadata.get('type', 'text'),
+        'score': hit['score']
+    }
 
 @app.route('/api/preview/<filename>', methods=['GET'])
 def get_preview(filename):
@@ -179,4 +481,8 @@ if __name__ == '__main__':
         logger.error(f"React build not found at {app.static_folder}")
         logger.info("Run: cd frontend && npm run build")
     
+    # With the debug reloader, only the child process that serves requests warms up
+    if config.WARMUP_ON_START and os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
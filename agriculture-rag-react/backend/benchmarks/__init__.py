@@ -0,0 +1,12 @@
+"""Offline micro-benchmarks for the ingestion and retrieval hot paths.
+
+Run from the backend directory:
+    
+    python -m benchmarks.run                        # 1k and 100k synthetic vectors, sample PDFs
+    python -m benchmarks.run --sizes 1k,100k,1m --output results.json
+    python -m benchmarks.run --baseline results.json   # exit 1 on regressions
+
+Every case runs in its own subprocess so peak RSS is per case. Cases that
+need a model or PyMuPDF are reported as skipped when those are not available;
+models are only loaded from the local Hugging Face cache.
+"""
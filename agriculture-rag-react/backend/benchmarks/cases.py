@@ -0,0 +1,235 @@
+"""Benchmark cases for the ingestion and retrieval hot paths.
+
+A case takes its parameters and returns a list of result records (see
+harness.result); raising CaseSkipped reports it as skipped instead.
+"""
+import os
+import shutil
+import tempfile
+import time
+from typing import Callable, Dict, List
+import numpy as np
+from benchmarks import corpus
+from benchmarks.harness import format_size, result, time_calls
+
+class CaseSkipped(Exception):
+    """Raised when a case cannot run here, e.g. a model is not in the local cache"""
+
+CASES: Dict[str, Callable[..., List[Dict]]] = {}
+SIZED_CASES = set()  # Cases run once per synthetic corpus size
+
+def case(name: str, sized: bool = False):
+    def register(fn):
+        CASES[name] = fn
+        if sized:
+            SIZED_CASES.add(name)
+        return fn
+    return register
+
+def _require(module: str, what: str):
+    try:
+        __import__(module)
+    except ImportError:
+        raise CaseSkipped(f"{module} is not installed ({what})")
+
+def _load_model(component):
+    """Load a model or skip; runs are offline, so a model missing from the cache is not an error"""
+    try:
+        return component.load()
+    except Exception as e:
+        raise CaseSkipped(f"could not load {type(component).__name__}: {str(e).splitlines()[0] if str(e) else e}")
+
+def _pdf_page_texts() -> List[str]:
+    import fitz
+    texts = []
+    for path in corpus.sample_pdfs():
+        with fitz.open(path) as doc:
+            texts.extend(page.get_text() for page in doc)
+    return texts
+
+@case("chunk_text")
+def chunk_text(params: Dict) -> List[Dict]:
+    """TextProcessor.chunk_text over every page of the sample PDFs, or synthetic pages without PyMuPDF"""
+    _require("langchain", "text splitter")
+    from src.document_processor.text_processor import TextProcessor
+    try:
+        pages, source = _pdf_page_texts(), "pdfs"
+    except ImportError:
+        pages, source = [], None
+    if not pages:
+        pages, source = corpus.synthetic_pages(500), "synthetic"
+    
+    processor = TextProcessor()
+    chunk_counts = []
+    latencies, seconds = time_calls(
+        lambda item: chunk_counts.append(len(processor.chunk_text(item[1], item[0]))),
+        list(enumerate(pages)), warmup=5
+    )
+    n_chunks = sum(chunk_counts[-len(pages):])
+    return [result("chunk_text", {"source": source}, len(pages), "pages", seconds, latencies,
+                   pages=len(pages), chunks=n_chunks, chunks_per_s=round(n_chunks / seconds, 2))]
+
+@case("embed_documents")
+def embed_documents(params: Dict) -> List[Dict]:
+    """TextEmbedder.embed_documents on synthetic chunks, in ingestion-sized calls, without the embedding cache"""
+    _require("sentence_transformers", "text embedding model")
+    from config import Config
+    from src.embeddings.text_embeddings import TextEmbedder
+    embedder = _load_model(TextEmbedder(Config.TEXT_EMBEDDING_MODEL, revision=Config.TEXT_EMBEDDING_REVISION))
+    
+    batch_size = 64
+    documents = corpus.synthetic_documents(corpus.synthetic_texts(2048, seed=1), 0)
+    batches = [documents[i:i + batch_size] for i in range(0, len(documents), batch_size)]
+    latencies, seconds = time_calls(embedder.embed_documents, batches, warmup=1)
+    return [result("embed_documents", {"backend": embedder.backend, "batch": batch_size},
+                   len(documents), "chunks", seconds, latencies)]
+
+@case("embed_images")
+def embed_images(params: Dict) -> List[Dict]:
+    """ImageEmbedder.embed_images on synthetic images of mixed sizes, without the embedding cache"""
+    _require("transformers", "CLIP")
+    from config import Config
+    from src.embeddings.image_embeddings import ImageEmbedder
+    embedder = _load_model(ImageEmbedder(Config.IMAGE_EMBEDDING_MODEL, revision=Config.IMAGE_EMBEDDING_REVISION))
+    
+    batch_size = 32
+    images = corpus.synthetic_images(256, seed=2)
+    batches = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+    latencies, seconds = time_calls(embedder.embed_images, batches, warmup=1)
+    return [result("embed_images", {"backend": embedder.backend, "batch": batch_size},
+                   len(images), "images", seconds, latencies)]
+
+@case("vector_store", sized=True)
+def vector_store(params: Dict) -> List[Dict]:
+    """VectorStore add_texts, search_texts (single, batch, hybrid), save and load on a synthetic corpus"""
+    from src.retrieval.vector_store import VectorStore
+    n, dim, index_type = params["size"], params.get("dim", 384), params.get("index_type")
+    batch_size, n_queries, k = 1000, 1000, 5
+    store = VectorStore(text_dim=dim, index_type=index_type)
+    index_type = store.index_type
+    label = {"size": format_size(n), "index_type": index_type}
+    results = []
+    
+    # Ingestion-sized add_texts calls; a background rebuild may start part way through
+    add_latencies = []
+    texts = corpus.synthetic_texts(batch_size, seed=3)  # Reused per batch: tokenizing is measured, generating is not
+    start = time.perf_counter()
+    for offset, vectors in zip(range(0, n, batch_size), corpus.synthetic_vectors(n, dim, seed=3, batch=batch_size)):
+        documents = corpus.synthetic_documents(texts[:len(vectors)], offset)
+        call_start = time.perf_counter()
+        store.add_texts(documents, vectors)
+        add_latencies.append(time.perf_counter() - call_start)
+    seconds = time.perf_counter() - start
+    results.append(result("vector_store.add_texts", dict(label, batch=batch_size), n, "chunks", seconds,
+                          add_latencies))
+    
+    # Searches run against the final index layout
+    start = time.perf_counter()
+    store.wait_for_background()
+    results[-1]["rebuild_wait_seconds"] = round(time.perf_counter() - start, 4)
+    stats = store.get_stats()
+    
+    rng = np.random.default_rng(4)
+    queries = next(corpus.synthetic_vectors(n_queries, dim, seed=4))
+    queries += 0.05 * rng.standard_normal(queries.shape).astype('float32')
+    query_texts = corpus.synthetic_texts(n_queries, seed=4, words=(4, 12))
+    
+    latencies, seconds = time_calls(lambda q: store.search_texts(q, k), list(queries), warmup=20)
+    results.append(result("vector_store.search_texts", dict(label, k=k), n_queries, "queries", seconds,
+                          latencies, index=stats["text_index_type"]))
+    
+    query_batch = 64
+    batches = [queries[i:i + query_batch] for i in range(0, n_queries, query_batch)]
+    latencies, seconds = time_calls(lambda q: store.search_texts_batch(q, k), batches, warmup=1)
+    results.append(result("vector_store.search_texts_batch", dict(label, k=k, batch=query_batch), n_queries,
+                          "queries", seconds, latencies, index=stats["text_index_type"]))
+    
+    pairs = list(zip(query_texts, queries))
+    latencies, seconds = time_calls(lambda pair: store.search_texts_hybrid(pair[0], pair[1], k), pairs, warmup=20)
+    results.append(result("vector_store.search_texts_hybrid", dict(label, k=k), n_queries, "queries", seconds,
+                          latencies, index=stats["text_index_type"]))
+    
+    # Full snapshot writes, then cold loads into new stores; repeated since one run is noisy
+    repeats = 3
+    directory = tempfile.mkdtemp(prefix="bench-vector-store-")
+    try:
+        base_paths = [os.path.join(directory, str(i), "store") for i in range(repeats)]
+        latencies, seconds = time_calls(store.save, base_paths)
+        snapshot_dir = os.path.dirname(base_paths[0])
+        size_mb = sum(os.path.getsize(os.path.join(snapshot_dir, name)) for name in os.listdir(snapshot_dir)
+                      if os.path.isfile(os.path.join(snapshot_dir, name))) / (1024 * 1024)
+        results.append(result("vector_store.save", label, n * repeats, "chunks", seconds, latencies,
+                              snapshot_mb=round(size_mb, 2)))
+        
+        loaded = []
+        
+        def load(path: str):
+            loaded.append(VectorStore(text_dim=dim, index_type=index_type))
+            loaded[-1].load(path)
+        
+        latencies, seconds = time_calls(load, base_paths)
+        # With memory-mapped snapshots the first query pays for faulting pages in
+        first_query = time.perf_counter()
+        loaded[-1].search_texts(queries[0], k)
+        results.append(result("vector_store.load", label, n * repeats, "chunks", seconds, latencies,
+                              first_query_ms=round((time.perf_counter() - first_query) * 1000, 4)))
+        for other in loaded:
+            other.wait_for_background()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+def _pdf_sample() -> List[str]:
+    _require("fitz", "PDF parsing")
+    pdfs = corpus.sample_pdfs()
+    if not pdfs:
+        raise CaseSkipped("no sample PDFs in the upload directory")
+    return pdfs
+
+def _page_count(path: str) -> int:
+    import fitz
+    with fitz.open(path) as doc:
+        return len(doc)
+
+@case("extract_pages")
+def extract_pages(params: Dict) -> List[Dict]:
+    """PDFProcessor.extract_pages over the sample PDFs: parsing, chunking and image decoding, no models"""
+    pdfs = _pdf_sample()
+    _require("langchain", "text splitter")
+    from src.document_processor.pdf_processor import PDFProcessor
+    processor = PDFProcessor()
+    chunks = []
+    try:
+        latencies, seconds = time_calls(
+            lambda path: chunks.extend(c for page in processor.extract_pages(path) for c in page["text_chunks"]),
+            pdfs
+        )
+    finally:
+        processor.shutdown()
+    pages = sum(_page_count(path) for path in pdfs)
+    return [result("extract_pages", {"pdfs": len(pdfs), "workers": processor.workers}, pages, "pages", seconds,
+                   latencies, chunks=len(chunks), chunks_per_s=round(len(chunks) / seconds, 2))]
+
+@case("process_pdf")
+def process_pdf(params: Dict) -> List[Dict]:
+    """PDFProcessor.process_pdf over the sample PDFs, including image captioning"""
+    pdfs = _pdf_sample()
+    _require("langchain", "text splitter")
+    _require("transformers", "BLIP captioning")
+    from src.document_processor.pdf_processor import PDFProcessor
+    processor = PDFProcessor()
+    _load_model(processor.image_processor)
+    counts = {"chunks": 0, "images": 0}
+    
+    def run(path: str):
+        text_chunks, images = processor.process_pdf(path)
+        counts["chunks"] += len(text_chunks)
+        counts["images"] += len(images)
+    
+    try:
+        latencies, seconds = time_calls(run, pdfs)
+    finally:
+        processor.shutdown()
+    pages = sum(_page_count(path) for path in pdfs)
+    return [result("process_pdf", {"pdfs": len(pdfs), "workers": processor.workers}, pages, "pages", seconds,
+                   latencies, chunks_per_s=round(counts["chunks"] / seconds, 2), **counts)]
@@ -0,0 +1,72 @@
+"""Deterministic synthetic corpora and the sample PDFs"""
+import glob
+import os
+from typing import Dict, Iterator, List, Tuple
+import numpy as np
+from config import Config
+
+# Word pool for synthetic chunks; realistic enough for BM25 postings to have
+# a skewed, agronomy-like term distribution
+_VOCABULARY = """
+rice paddy wheat maize sugarcane cotton groundnut pulses millet sorghum banana tomato onion chilli
+irrigation drip sprinkler furrow canal borewell rainfall monsoon kharif rabi zaid season sowing
+harvest yield hectare tonnes quintal fertilizer urea potash phosphate npk compost manure vermicompost
+soil ph salinity nitrogen organic carbon micronutrient zinc boron pest disease blast blight wilt rust
+aphid bollworm stem borer fungicide insecticide spray dose litre variety hybrid co-51 adt-45 tnau
+seed rate spacing transplanting weeding mulching market price msp procurement credit insurance kisan
+scheme subsidy farmer cooperative extension training storage warehouse export productivity growth
+""".split()
+
+def synthetic_vectors(n: int, dim: int, seed: int = 0, batch: int = 10000) -> Iterator[np.ndarray]:
+    """Unit-norm float32 vectors in batches, clustered like real embeddings.
+    
+    Vectors are drawn around a few hundred centroids; uniform noise would make
+    IVF and HNSW look unrealistically bad.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((256, dim)).astype('float32')
+    for start in range(0, n, batch):
+        count = min(batch, n - start)
+        vectors = centroids[rng.integers(0, len(centroids), count)]
+        vectors = vectors + 0.6 * rng.standard_normal((count, dim)).astype('float32')
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        yield vectors
+
+def synthetic_texts(n: int, seed: int = 0, words: Tuple[int, int] = (80, 180)) -> List[str]:
+    rng = np.random.default_rng(seed)
+    # Zipf-like word frequencies
+    weights = 1.0 / np.arange(1, len(_VOCABULARY) + 1)
+    weights /= weights.sum()
+    lengths = rng.integers(words[0], words[1], n)
+    return [" ".join(rng.choice(_VOCABULARY, size=length, p=weights)) for length in lengths]
+
+def synthetic_documents(texts: List[str], start: int, chunks_per_doc: int = 50) -> List[Dict]:
+    """Chunks shaped like TextProcessor output, grouped into documents"""
+    return [{
+        "text": text,
+        "metadata": {
+            "doc_id": f"doc-{(start + i) // chunks_per_doc}",
+            "page_num": (start + i) % chunks_per_doc // 5,
+            "chunk_num": (start + i) % 5,
+            "source": "pdf",
+            "type": "text"
+        }
+    } for i, text in enumerate(texts)]
+
+def synthetic_pages(n: int, seed: int = 0) -> List[str]:
+    """Page-sized texts with PDF-style line breaks and spacing"""
+    return [text.replace(" ", "  ", 20).replace(" ", "\n", 40)
+            for text in synthetic_texts(n, seed, words=(350, 600))]
+
+def synthetic_images(n: int, seed: int = 0) -> List[Dict]:
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    images = []
+    for i in range(n):
+        width, height = (int(v) for v in rng.integers(120, 640, 2))
+        pixels = rng.integers(0, 255, (height, width, 3), dtype='uint8')
+        images.append({"image": Image.fromarray(pixels), "metadata": {"page_num": i, "img_index": 0}})
+    return images
+
+def sample_pdfs() -> List[str]:
+    return sorted(glob.glob(os.path.join(Config.UPLOAD_DIR, "*.pdf")))
@@ -0,0 +1,161 @@
+"""Timing, memory and baseline comparison helpers shared by the benchmark cases"""
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+SIZE_SUFFIXES = {"k": 1000, "m": 1000000}
+
+def parse_size(text: str) -> int:
+    """'1k' -> 1000, '1m' -> 1000000, '2500' -> 2500"""
+    text = text.strip().lower()
+    if text and text[-1] in SIZE_SUFFIXES:
+        return int(float(text[:-1]) * SIZE_SUFFIXES[text[-1]])
+    return int(text)
+
+def format_size(n: int) -> str:
+    for suffix, factor in sorted(SIZE_SUFFIXES.items(), key=lambda item: -item[1]):
+        if n >= factor and n % factor == 0:
+            return f"{n // factor}{suffix}"
+    return str(n)
+
+def peak_rss_mb() -> float:
+    """High-water mark of this process's resident set"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def latency_summary(seconds: Iterable[float]) -> Dict[str, float]:
+    """p50/p99/mean of per-call latencies, in milliseconds"""
+    ms = np.asarray(list(seconds), dtype='float64') * 1000.0
+    if len(ms) == 0:
+        return {}
+    return {
+        "p50": round(float(np.percentile(ms, 50)), 4),
+        "p99": round(float(np.percentile(ms, 99)), 4),
+        "mean": round(float(ms.mean()), 4)
+    }
+
+def time_calls(fn: Callable, inputs: List, warmup: int = 0) -> Tuple[List[float], float]:
+    """Per-call latencies of fn(item) over inputs, and the total wall time"""
+    for item in inputs[:warmup]:
+        fn(item)
+    latencies = []
+    start = time.perf_counter()
+    for item in inputs:
+        call_start = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - call_start)
+    return latencies, time.perf_counter() - start
+
+def result(name: str, params: Dict, items: float, unit: str, seconds: float,
+           latencies: Optional[List[float]] = None, **extra) -> Dict:
+    """One measurement: throughput as items/second in the given unit, plus latency percentiles"""
+    record = {
+        "name": name,
+        "params": params,
+        "status": "ok",
+        "seconds": round(seconds, 4),
+        "throughput": {"value": round(items / seconds, 2) if seconds > 0 else None, "unit": f"{unit}/s"},
+        "latency_ms": latency_summary(latencies or [])
+    }
+    record.update(extra)
+    return record
+
+def skipped(name: str, params: Dict, reason: str) -> Dict:
+    return {"name": name, "params": params, "status": "skipped", "reason": reason}
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def environment() -> Dict:
+    """Where and on what the results were measured"""
+    import faiss
+    from config import Config
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "faiss": getattr(faiss, "__version__", None),
+        "config": {
+            "VECTOR_INDEX_TYPE": Config.VECTOR_INDEX_TYPE,
+            "VECTOR_INDEX_PROMOTE_THRESHOLD": Config.VECTOR_INDEX_PROMOTE_THRESHOLD,
+            "VECTOR_METRIC": Config.VECTOR_METRIC,
+            "VECTOR_STORAGE": Config.VECTOR_STORAGE,
+            "VECTOR_STORE_MMAP": Config.VECTOR_STORE_MMAP,
+            "IVF_NPROBE": Config.IVF_NPROBE,
+            "HNSW_EF_SEARCH": Config.HNSW_EF_SEARCH,
+            "TEXT_EMBEDDING_BACKEND": Config.TEXT_EMBEDDING_BACKEND,
+            "IMAGE_EMBEDDING_BACKEND": Config.IMAGE_EMBEDDING_BACKEND,
+            "CAPTION_BACKEND": Config.CAPTION_BACKEND,
+            "PDF_EXTRACT_WORKERS": Config.PDF_EXTRACT_WORKERS
+        }
+    }
+
+def result_key(record: Dict) -> Tuple:
+    return (record["name"],) + tuple(sorted((k, str(v)) for k, v in record.get("params", {}).items()))
+
+def compare(current: List[Dict], baseline: List[Dict], tolerance: float) -> List[Dict]:
+    """Per matching result and metric: baseline, current, relative change and whether it regressed.
+    
+    Lower throughput or higher latency/RSS than the baseline by more than
+    tolerance (a fraction) counts as a regression.
+    """
+    baseline_by_key = {result_key(record): record for record in baseline if record.get("status") == "ok"}
+    rows = []
+    for record in current:
+        base = baseline_by_key.get(result_key(record))
+        if record.get("status") != "ok" or base is None:
+            continue
+        metrics = [("throughput", record["throughput"]["value"], base["throughput"]["value"], True)]
+        for quantile in ("p50", "p99"):
+            metrics.append((f"latency_{quantile}_ms", record["latency_ms"].get(quantile),
+                            base.get("latency_ms", {}).get(quantile), False))
+        metrics.append(("peak_rss_mb", record.get("peak_rss_mb"), base.get("peak_rss_mb"), False))
+        for metric, value, base_value, higher_is_better in metrics:
+            if value is None or not base_value:
+                continue
+            change = (value - base_value) / base_value
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            rows.append({
+                "name": record["name"], "params": record["params"], "metric": metric,
+                "baseline": base_value, "current": value, "change": round(change, 4), "regressed": regressed
+            })
+    return rows
+
+def format_params(params: Dict) -> str:
+    return ",".join(f"{k}={v}" for k, v in params.items())
+
+def print_results(results: List[Dict], out=sys.stdout):
+    out.write(f"{'benchmark':<32} {'params':<44} {'throughput':>18} {'p50 ms':>10} {'p99 ms':>10} {'rss MB':>9}\n")
+    for record in results:
+        params = format_params(record.get("params", {}))
+        if record.get("status") != "ok":
+            out.write(f"{record['name']:<32} {params:<44} {record.get('status')}: {record.get('reason', '')}\n")
+            continue
+        throughput = record["throughput"]
+        rate = f"{throughput['value']:,.1f} {throughput['unit']}" if throughput["value"] is not None else "-"
+        latency = record["latency_ms"]
+        out.write(f"{record['name']:<32} {params:<44} {rate:>18} {latency.get('p50', '-'):>10} "
+                  f"{latency.get('p99', '-'):>10} {record.get('peak_rss_mb', '-'):>9}\n")
+
+def print_comparison(rows: List[Dict], out=sys.stdout):
+    out.write(f"{'benchmark':<32} {'params':<44} {'metric':<16} {'baseline':>12} {'current':>12} {'change':>8}\n")
+    for row in rows:
+        flag = "  REGRESSION" if row["regressed"] else ""
+        out.write(f"{row['name']:<32} {format_params(row['params']):<44} {row['metric']:<16} "
+                  f"{row['baseline']:>12,.2f} {row['current']:>12,.2f} {row['change']:>+8.1%}{flag}\n")
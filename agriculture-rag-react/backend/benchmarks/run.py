@@ -0,0 +1,126 @@
+"""Run the benchmark suite: python -m benchmarks.run --help"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import traceback
+from typing import Dict, List
+
+# Benchmarks never download models; anything not in the local cache is skipped
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+from benchmarks import harness  # noqa: E402
+
+DEFAULT_SIZES = "1k,100k"
+
+def run_case(name: str, params: Dict) -> List[Dict]:
+    """Run one case in this process and attach its peak RSS"""
+    from benchmarks.cases import CASES, CaseSkipped
+    try:
+        results = CASES[name](params)
+    except CaseSkipped as e:
+        return [harness.skipped(name, params, str(e))]
+    except Exception as e:
+        traceback.print_exc()
+        return [{"name": name, "params": params, "status": "error", "reason": str(e)}]
+    peak = round(harness.peak_rss_mb(), 1)
+    for record in results:
+        record["peak_rss_mb"] = peak
+    return results
+
+def run_isolated(name: str, params: Dict) -> List[Dict]:
+    """Run one case in a fresh interpreter so its peak RSS is its own"""
+    fd, result_file = tempfile.mkstemp(prefix="bench-", suffix=".json")
+    os.close(fd)
+    try:
+        command = [sys.executable, "-m", "benchmarks.run", "--child", name,
+                   "--params", json.dumps(params), "--result-file", result_file]
+        completed = subprocess.run(command)
+        with open(result_file, "r", encoding="utf-8") as f:
+            content = f.read()
+        if completed.returncode != 0 or not content:
+            return [{"name": name, "params": params, "status": "error",
+                     "reason": f"benchmark process exited with {completed.returncode}"}]
+        return json.loads(content)
+    finally:
+        os.remove(result_file)
+
+def plan(args) -> List[tuple]:
+    from benchmarks.cases import CASES, SIZED_CASES
+    names = [name.strip() for name in args.cases.split(",")] if args.cases else list(CASES)
+    unknown = [name for name in names if name not in CASES]
+    if unknown:
+        raise SystemExit(f"Unknown benchmark case(s): {', '.join(unknown)}; available: {', '.join(CASES)}")
+    sizes = [harness.parse_size(size) for size in args.sizes.split(",") if size.strip()]
+    runs = []
+    for name in names:
+        if name in SIZED_CASES:
+            runs.extend((name, {"size": size, "index_type": args.index_type}) for size in sizes)
+        else:
+            runs.append((name, {}))
+    return runs
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Retrieval and ingestion micro-benchmarks")
+    parser.add_argument("--cases", help="Comma-separated cases to run (default: all)")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help=f"Synthetic corpus sizes for vector store cases, e.g. 1k,100k,1m (default: {DEFAULT_SIZES})")
+    parser.add_argument("--index-type", help="Vector index type once promoted (default: VECTOR_INDEX_TYPE)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against a results file written by --output")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Relative slowdown allowed before a metric counts as a regression (default: 0.1)")
+    parser.add_argument("--in-process", action="store_true",
+                        help="Run all cases in this process; faster, but peak RSS becomes cumulative")
+    parser.add_argument("--list", action="store_true", help="List the cases and exit")
+    # Internal: run a single case for the parent process
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--params", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    
+    if args.child:
+        results = run_case(args.child, json.loads(args.params or "{}"))
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(results, f)
+        return 0
+    
+    if args.list:
+        from benchmarks.cases import CASES, SIZED_CASES
+        for name, fn in CASES.items():
+            sized = " (per size)" if name in SIZED_CASES else ""
+            print(f"{name:<18} {(fn.__doc__ or '').strip()}{sized}")
+        return 0
+    
+    results = []
+    for name, params in plan(args):
+        print(f"Running {name} {harness.format_params(params)}", file=sys.stderr, flush=True)
+        results.extend(run_case(name, params) if args.in_process else run_isolated(name, params))
+    
+    report = {"meta": harness.environment(), "results": results}
+    print()
+    harness.print_results(results)
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+    
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = harness.compare(results, baseline["results"], args.tolerance)
+        print(f"\nAgainst {args.baseline} (commit {baseline['meta'].get('git_commit')}, "
+              f"tolerance {args.tolerance:.0%}):")
+        harness.print_comparison(rows)
+        regressions = [row for row in rows if row["regressed"]]
+        if regressions:
+            print(f"\n{len(regressions)} regression(s)")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,37 +14,123 @@ class Config:
     FLASK_ENV = os.getenv("FLASK_ENV", "development")
     SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret-key-123")
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB upload limit
+    
+    # Startup: models load on first use; these are loaded up front and gate /api/ready.
+    # Steps: vector_store, text_embedder, llm, image_embedder (CLIP), captioner (BLIP)
+    WARMUP_COMPONENTS = [name.strip() for name in os.getenv("WARMUP_COMPONENTS", "vector_store,text_embedder,llm").split(",")
+                         if name.strip()]
+    WARMUP_ON_START = os.getenv("WARMUP_ON_START", "true").lower() == "true"  # Warm up in the background when the app starts
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"  # Prometheus text format at /metrics
 
     # LLM Configuration
     LLM_MODEL = "gpt-3.5-turbo"
     LLM_TEMPERATURE = 1.0
     LLM_BASE_URL = os.getenv("LLM_BASE_URL")
     LLM_API_KEY = os.getenv("LLM_API_KEY")
-    LLM_TIMEOUT = 30  # seconds
+    LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 30))  # seconds
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 32))      # In-flight LLM requests per process
+    LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 64))      # HTTP connection pool size
+    LLM_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_KEEPALIVE_CONNECTIONS", 32))  # Idle connections kept open
+    LLM_KEEPALIVE_EXPIRY = 60  # seconds an idle connection is kept
+    
+    # Retrieval API
+    SEARCH_BATCH_MAX_QUERIES = int(os.getenv("SEARCH_BATCH_MAX_QUERIES", 1000))  # Queries per /api/search/batch call
+    SEARCH_MAX_K = 50
+    HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "true").lower() == "true"  # BM25 + dense for chat retrieval
+    HYBRID_CANDIDATES = 20   # Hits taken from each retriever before fusion
+    RRF_K = 60               # Reciprocal rank fusion constant
+    BM25_K1 = 1.2
+    BM25_B = 0.75
+    CHAT_INCLUDE_IMAGES = os.getenv("CHAT_INCLUDE_IMAGES", "false").lower() == "true"  # Default when a chat request doesn't say
+    CHAT_IMAGE_K = 3
+    IMAGE_MATCH_MIN_SCORE = float(os.getenv("IMAGE_MATCH_MIN_SCORE", 0.2))  # CLIP text-image cosine below which figures are dropped
+    
+    # Chat Response Cache
+    RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 2000))
+    RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 6 * 3600))                  # seconds
+    RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", 0.95))    # Cosine threshold for near-duplicates
+    QUERY_EMBEDDING_CACHE_SIZE = 1024  # Recent query embeddings kept in memory
 
     # Embedding Models
     TEXT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+    TEXT_EMBEDDING_REVISION = os.getenv("TEXT_EMBEDDING_REVISION")    # Pin a model revision; part of cache keys
     IMAGE_EMBEDDING_MODEL = "openai/clip-vit-base-patch32"
+    IMAGE_EMBEDDING_REVISION = os.getenv("IMAGE_EMBEDDING_REVISION")
+    IMAGE_EMBED_BATCH_SIZE = int(os.getenv("IMAGE_EMBED_BATCH_SIZE", 16))  # Images per CLIP forward pass
+    CLIP_TEXT_BATCH_SIZE = int(os.getenv("CLIP_TEXT_BATCH_SIZE", 64))      # Queries per CLIP text-tower pass
     
     # Vector Store
     VECTOR_STORE_PATH = os.path.join("data", "vector_store")
+    VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "ivf_flat")  # flat | ivf_flat | ivf_pq | hnsw, used once promoted
+    VECTOR_METRIC = os.getenv("VECTOR_METRIC", "ip")            # ip (cosine over normalized vectors) | l2
+    VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "float32")     # float32 | fp16 | sq8 | pq, applied once promoted
+    RECALL_CHECK_QUERIES = 200                                   # Queries used to log recall after a rebuild (0 = off)
+    VECTOR_INDEX_PROMOTE_THRESHOLD = int(os.getenv("VECTOR_INDEX_PROMOTE_THRESHOLD", 50000))  # Vectors before leaving flat
+    VECTOR_INDEX_TRAIN_SAMPLE = 100000   # Max vectors used to train IVF/PQ
+    IVF_NLIST = int(os.getenv("IVF_NLIST", 0))     # 0 = derive from index size
+    IVF_NPROBE = int(os.getenv("IVF_NPROBE", 16))  # Lists scanned per query
+    PQ_M = 16                                     # PQ sub-quantizers (reduced until it divides the dimension)
+    HNSW_M = 32
+    HNSW_EF_CONSTRUCTION = 80
+    HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 64))  # Candidates explored per query
+    VECTOR_STORE_COMPACT_SEGMENTS = int(os.getenv("VECTOR_STORE_COMPACT_SEGMENTS", 8))  # Journal segments before compaction
+    VECTOR_STORE_MMAP = os.getenv("VECTOR_STORE_MMAP", "true").lower() == "true"  # Share snapshot pages between worker processes
+    VECTOR_STORE_REFRESH_INTERVAL = float(os.getenv("VECTOR_STORE_REFRESH_INTERVAL", 2.0))  # Seconds between checks for changes by other workers
+    DOCUMENT_REGISTRY_PATH = os.path.join("data", "document_registry.json")  # Content hashes of ingested files
     
     # Document Processing
     CHUNK_SIZE = 1000
     CHUNK_OVERLAP = 200
-    MAX_PAGES = 50 
+    MAX_PAGES = int(os.getenv("MAX_PAGES", 500))  # Longer PDFs are rejected before extraction; 0 = no limit
     MAX_PAGE_LENGTH = 1000  # Characters per chunk
     OVERLAP = 200          # Overlap between chunks
     MAX_IMAGE_SIZE = 512   # Max dimension for image processing
+    PDF_IMAGE_MIN_SIDE = int(os.getenv("PDF_IMAGE_MIN_SIDE", 32))      # Narrower PDF images (rules, bullets, icons) are skipped
+    PDF_IMAGE_MIN_AREA = int(os.getenv("PDF_IMAGE_MIN_AREA", 64 * 64))  # Smaller PDF images are skipped, in source pixels
+    PDF_IMAGE_DUPLICATE_DISTANCE = int(os.getenv("PDF_IMAGE_DUPLICATE_DISTANCE", 4))  # Max differing dHash bits to count as a repeat; -1 = off
+    PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", min(4, os.cpu_count() or 1)))  # 1 = serial
+    PDF_EXTRACT_START_METHOD = os.getenv("PDF_EXTRACT_START_METHOD", "forkserver")  # Never "fork": the pool starts in a threaded process
+    PDF_PARALLEL_MIN_PAGES = 16  # Smaller documents are extracted serially
+    PDF_PAGES_PER_SHARD = 8      # Pages handed to a worker at a time
+    PDF_WINDOW_PAGES = int(os.getenv("PDF_WINDOW_PAGES", 32))  # Pages extracted, captioned and embedded at a time; bounds decoded-image memory
+    CAPTION_BATCH_SIZE = int(os.getenv("CAPTION_BATCH_SIZE", 8))          # Images per BLIP generate call
+    CAPTION_MAX_NEW_TOKENS = int(os.getenv("CAPTION_MAX_NEW_TOKENS", 30))  # Caption length cap
+    
+    # Background Ingestion
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 1))        # Concurrent ingestion jobs
+    INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 16))  # Jobs allowed to wait
+    INGEST_JOB_HISTORY = 200                                     # Finished jobs kept for status queries
+    INGEST_JOB_STATE_DIR = os.path.join("data", "jobs")          # Job status shared between worker processes
     
     # File Storage
     UPLOAD_DIR = os.path.join("data", "uploads")
+    IMAGE_STORE_DIR = os.path.join("data", "images")  # Extracted images, referenced from vector store metadata
     ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
     
     # Cache and Storage
     CACHE_DIR = ".cache"
+    EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.sqlite")
+    EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", 1024))
+    
+    # Inference backends: torch (eager fp32), onnx (ONNX Runtime fp32) or int8 (dynamically quantized)
+    INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+    TEXT_EMBEDDING_BACKEND = os.getenv("TEXT_EMBEDDING_BACKEND", INFERENCE_BACKEND)
+    IMAGE_EMBEDDING_BACKEND = os.getenv("IMAGE_EMBEDDING_BACKEND", INFERENCE_BACKEND)
+    CAPTION_BACKEND = os.getenv("CAPTION_BACKEND", INFERENCE_BACKEND)  # BLIP: torch or int8 (onnx runs as torch)
+    ONNX_CACHE_DIR = os.path.join(CACHE_DIR, "onnx")  # Exported and quantized models
+    ONNX_PARITY_MIN_COSINE = float(os.getenv("ONNX_PARITY_MIN_COSINE", 0.98))  # Against torch; below it the export is not used
+    ONNX_THREADS = int(os.getenv("ONNX_THREADS", 0))  # Intra-op threads per session, 0 = ONNX Runtime default
     LOG_DIR = "logs"
 
+    # Logging: one queue-fed writer thread per process
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_LEVELS = os.getenv("LOG_LEVELS", "httpx=WARNING,urllib3=WARNING")  # Per-logger overrides, e.g. "src.retrieval=DEBUG"
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text or json (one object per line)
+    LOG_FILE_PREFIX = os.getenv("LOG_FILE_PREFIX", "app")  # logs/<prefix>_YYYYMMDD.log
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # Records beyond this are dropped, never waited on
+
     @property
     def VECTOR_STORE_PATH(self):
         """Get the full path to the vector store"""
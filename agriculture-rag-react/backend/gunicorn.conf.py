@@ -0,0 +1,40 @@
+"""Multi-worker serving: gunicorn -c gunicorn.conf.py app:app
+
+The app is imported once in the master and the components in
+WARMUP_COMPONENTS are loaded there before fork, so their weights are shared
+copy-on-write by all workers. Add image_embedder and captioner if workers
+ingest uploads; anything a worker loads on first use is its own copy.
+
+Vector store snapshots are opened through read-only memory maps
+(VECTOR_STORE_MMAP), so their pages sit in the page cache once however many
+workers map them. Uploads are written by whichever worker runs the job, under
+the store's file lock; the others notice the new journal segment or snapshot
+generation on their next request (VECTOR_STORE_REFRESH_INTERVAL).
+
+Metrics are per process: each scrape of /metrics is answered by one worker
+(see agridoc_process_info), and a forked worker starts from zero.
+"""
+import gc
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+# Threads keep SSE streams and slow LLM calls from tying up a whole worker
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", 8))
+timeout = int(os.getenv("WEB_TIMEOUT", 180))
+preload_app = True
+
+def when_ready(server):
+    from config import Config
+    if Config.WARMUP_ON_START:
+        from app import warm_up
+        warm_up()
+
+def pre_fork(server, worker):
+    # Keep the collector from touching (and so copying) the preloaded objects in every worker
+    gc.freeze()
+
+def post_fork(server, worker):
+    from app import after_fork
+    after_fork()
@@ -1,17 +1,20 @@
 # Initialize src package
-from .document_processor import pdf_processor, image_processor, text_processor
-from .embeddings import text_embeddings, image_embeddings
-from .retrieval import vector_store, rag_pipeline
-from .utils import helpers, logger
+from src.utils.lazy import lazy_exports
 
-__all__ = [
-    'pdf_processor',
-    'image_processor',
-    'text_processor',
-    'text_embeddings',
-    'image_embeddings',
-    'vector_store',
-    'rag_pipeline',
-    'helpers',
-    'logger'
-]
\ No newline at end of file
+# Submodules load on first attribute access (PEP 562); importing src alone must
+# not pull in torch, transformers or langchain
+_SUBMODULES = {
+    'pdf_processor': '.document_processor.pdf_processor',
+    'image_processor': '.document_processor.image_processor',
+    'text_processor': '.document_processor.text_processor',
+    'text_embeddings': '.embeddings.text_embeddings',
+    'image_embeddings': '.embeddings.image_embeddings',
+    'vector_store': '.retrieval.vector_store',
+    'rag_pipeline': '.retrieval.rag_pipeline',
+    'helpers': '.utils.helpers',
+    'logger': '.utils.logger'
+}
+
+__all__ = list(_SUBMODULES)
+
+__getattr__, __dir__ = lazy_exports(__name__, _SUBMODULES, modules=True)
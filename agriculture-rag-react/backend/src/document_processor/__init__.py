@@ -1,5 +1,13 @@
-from .pdf_processor import PDFProcessor
-from .image_processor import ImageProcessor
-from .text_processor import TextProcessor
+from src.utils.lazy import lazy_exports
 
-__all__ = ['PDFProcessor', 'ImageProcessor', 'TextProcessor']
\ No newline at end of file
+# Imported on first use (PEP 562): ImageProcessor needs transformers and torch,
+# which nothing outside ingestion should pay for
+_EXPORTS = {
+    'PDFProcessor': '.pdf_processor',
+    'ImageProcessor': '.image_processor',
+    'TextProcessor': '.text_processor'
+}
+
+__all__ = list(_EXPORTS)
+
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS)
@@ -1,49 +1,173 @@
+import io
 from PIL import Image
 import numpy as np
-from typing import Dict
+import os
+from typing import Dict, List, Optional
+from config import Config
+from src.embeddings.onnx_backend import cache_dir_for, cosine_parity, parity_images, read_meta, write_meta
 from src.utils.logger import get_logger
-from transformers import BlipProcessor, BlipForConditionalGeneration
-import torch
+from src.utils.metrics import MODEL_INPUTS, stage
+from src.utils.startup import timed
+import threading
 
 logger = get_logger(__name__)
 
 class ImageProcessor:
-    def __init__(self):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.info(f"Initializing BLIP model on {self.device}")
-        self.processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-        self.model = BlipForConditionalGeneration.from_pretrained(
-            "Salesforce/blip-image-captioning-base"
-        ).to(self.device)
+    MODEL_NAME = "Salesforce/blip-image-captioning-base"
+    
+    def __init__(self, batch_size: Optional[int] = None, max_new_tokens: Optional[int] = None,
+                 backend: Optional[str] = None):
+        self.backend = backend or Config.CAPTION_BACKEND  # torch or int8
+        self.device = None
+        self._model = None  # BLIP is loaded on first caption or by load()
+        self._processor = None
+        self._load_lock = threading.Lock()
+        self.batch_size = batch_size or Config.CAPTION_BATCH_SIZE
+        self.max_new_tokens = max_new_tokens or Config.CAPTION_MAX_NEW_TOKENS
+    
+    @property
+    def model(self):
+        if self._model is None:
+            self.load()
+        return self._model
+    
+    @property
+    def processor(self):
+        if self._processor is None:
+            self.load()
+        return self._processor
+    
+    def load(self) -> "ImageProcessor":
+        """Load BLIP now instead of on first use"""
+        with self._load_lock:
+            if self._model is None:
+                with timed(f"Loaded captioning model {self.MODEL_NAME} ({self.backend})"):
+                    import torch
+                    from transformers import BlipProcessor, BlipForConditionalGeneration
+                    self._processor = BlipProcessor.from_pretrained(self.MODEL_NAME)
+                    if self.backend == "onnx":
+                        # Autoregressive generation is not exported; int8 is the fast CPU path
+                        logger.warning("BLIP has no ONNX backend, captioning with torch")
+                        self.backend = "torch"
+                    device = "cpu" if self.backend == "int8" or not torch.cuda.is_available() else "cuda"
+                    model = BlipForConditionalGeneration.from_pretrained(self.MODEL_NAME).to(device)
+                    model.eval()
+                    self.device = device
+                    if self.backend == "int8":
+                        model = self._quantized(model)
+                    self._model = model
+        return self
+    
+    def _quantized(self, model):
+        """BLIP with int8 dynamically quantized Linear layers, if its vision features keep parity with fp32"""
+        import torch
+        quantized = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        cache_dir = cache_dir_for("caption", self.MODEL_NAME, None)
+        meta = read_meta(cache_dir)
+        report = meta.get("parity", {}).get("int8")
+        if report is None:
+            pixels = self._processor(images=parity_images(), return_tensors="pt")["pixel_values"]
+            with torch.no_grad():
+                reference = model.vision_model(pixel_values=pixels).pooler_output.numpy()
+                candidate = quantized.vision_model(pixel_values=pixels).pooler_output.numpy()
+            report = cosine_parity(reference, candidate)
+            meta.setdefault("parity", {})["int8"] = report
+            os.makedirs(cache_dir, exist_ok=True)
+            write_meta(cache_dir, meta)
+        if report["min_cosine"] < Config.ONNX_PARITY_MIN_COSINE:
+            logger.error(f"int8 BLIP reaches min cosine {report['min_cosine']:.4f} against fp32, "
+                         f"below {Config.ONNX_PARITY_MIN_COSINE}; captioning with fp32")
+            self.backend = "torch"
+            return model
+        return quantized
     
     def process_image(self, image: Image.Image, page_num: int, img_index: int) -> Dict:
         """Process image and generate caption with metadata"""
         try:
             # Generate caption
-            inputs = self.processor(image, return_tensors="pt").to(self.device)
-            out = self.model.generate(**inputs)
-            caption = self.processor.decode(out[0], skip_special_tokens=True)
-            
-            return {
-                "image": image,
-                "caption": caption,
-                "metadata": {
-                    "page_num": page_num,
-                    "img_index": img_index,
-                    "source": "pdf",
-                    "type": "image"
-                }
-            }
+            caption = self._generate_captions([image], self.max_new_tokens)[0]
+            return self.build_image_data(image, caption, page_num, img_index)
             
         except Exception as e:
             logger.error(f"Error processing image: {str(e)}")
             raise
     
-    def resize_image(self, image: Image.Image, max_size: int = 512) -> Image.Image:
+    def caption_images(self, images: List[Image.Image], batch_size: Optional[int] = None,
+                       max_new_tokens: Optional[int] = None) -> List[str]:
+        """Caption images in padded batches, returning one caption per input image"""
+        if not images:
+            return []
+        
+        batch_size = batch_size or self.batch_size
+        max_new_tokens = max_new_tokens or self.max_new_tokens
+        captions = [""] * len(images)
+        
+        for start in range(0, len(images), batch_size):
+            batch = images[start:start + batch_size]
+            try:
+                captions[start:start + len(batch)] = self._generate_captions(batch, max_new_tokens)
+            except Exception as e:
+                # Fall back to one image at a time so a bad image only loses its own caption
+                logger.warning(f"Batch captioning failed, retrying images individually: {str(e)}")
+                for offset, image in enumerate(batch):
+                    try:
+                        captions[start + offset] = self._generate_captions([image], max_new_tokens)[0]
+                    except Exception as img_error:
+                        logger.error(f"Error captioning image {start + offset}: {str(img_error)}")
+        
+        logger.info(f"Captioned {len(images)} images in batches of {batch_size}")
+        return captions
+    
+    def _generate_captions(self, images: List[Image.Image], max_new_tokens: int) -> List[str]:
+        """Run a single generate call over a batch of images"""
+        images = [img if img.mode == "RGB" else img.convert("RGB") for img in images]
+        import torch
+        model, processor = self.model, self.processor
+        with stage("captioner", "generate"):
+            inputs = processor(images=images, return_tensors="pt", padding=True).to(self.device)
+            with torch.no_grad():
+                out = model.generate(**inputs, max_new_tokens=max_new_tokens)
+        MODEL_INPUTS.inc(len(images), model="blip")
+        return [caption.strip() for caption in processor.batch_decode(out, skip_special_tokens=True)]
+    
+    def build_image_data(self, image: Image.Image, caption: str, page_num: int, img_index: int) -> Dict:
+        """Assemble the image record consumed by the embedders and vector store"""
+        return {
+            "image": image,
+            "caption": caption,
+            "metadata": {
+                "page_num": page_num,
+                "img_index": img_index,
+                "source": "pdf",
+                "type": "image"
+            }
+        }
+    
+    @staticmethod
+    def decode_image(data: bytes, max_size: int = 512) -> Image.Image:
+        """Decode image bytes with neither side above max_size
+        
+        JPEGs are decoded at reduced resolution (DCT scaling) rather than in
+        full and then shrunk, which is most of the cost for large scans.
+        """
+        image = Image.open(io.BytesIO(data))
+        if image.format == "JPEG":
+            image.draft(image.mode, (max_size, max_size))  # Picks the smallest scale still >= max_size
+        image.load()
+        return ImageProcessor.resize_image(image, max_size)
+    
+    @staticmethod
+    def perceptual_hash(image: Image.Image) -> int:
+        """64-bit difference hash (dHash); near-identical images differ in only a few bits"""
+        pixels = np.asarray(image.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+        return int.from_bytes(np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes(), "big")
+    
+    @staticmethod
+    def resize_image(image: Image.Image, max_size: int = 512) -> Image.Image:
         """Resize image while maintaining aspect ratio"""
         width, height = image.size
         if max(width, height) > max_size:
             ratio = max_size / max(width, height)
             new_size = (int(width * ratio), int(height * ratio))
             return image.resize(new_size, Image.LANCZOS)
-        return image
\ No newline at end of file
+        return image
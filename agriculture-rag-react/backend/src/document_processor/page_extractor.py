@@ -0,0 +1,71 @@
+"""Per-page PDF extraction that can run inside worker processes.
+
+Kept free of model imports so pool workers start quickly (ImageProcessor only
+loads BLIP on first caption); each worker opens the document itself and
+returns plain, picklable page records.
+"""
+from typing import List, Dict, Optional, Set
+import fitz  # PyMuPDF
+from config import Config
+from src.document_processor.image_processor import ImageProcessor
+from src.document_processor.text_processor import TextProcessor
+
+_text_processor = None
+
+def _get_text_processor() -> TextProcessor:
+    """One text splitter per process"""
+    global _text_processor
+    if _text_processor is None:
+        _text_processor = TextProcessor()
+    return _text_processor
+
+def extract_page(doc: fitz.Document, page_num: int, text_processor: TextProcessor,
+                 seen_xrefs: Optional[Set[int]] = None) -> Dict:
+    """Extract text chunks and decoded images from one page
+    
+    Images smaller than Config.PDF_IMAGE_MIN_SIDE / PDF_IMAGE_MIN_AREA and
+    xrefs already in seen_xrefs (a logo placed on every page) are skipped
+    before decoding; the rest are decoded at most Config.MAX_IMAGE_SIZE per side.
+    """
+    page = doc.load_page(page_num)
+    
+    # Extract text
+    text = page.get_text()
+    text_chunks = text_processor.chunk_text(text, page_num) if text.strip() else []
+    
+    # Extract images
+    images = []
+    skipped = {"repeated": 0, "duplicate": 0, "too_small": 0}
+    for img_index, img in enumerate(page.get_images(full=True)):
+        xref, width, height = img[0], img[2], img[3]
+        if seen_xrefs is not None:
+            if xref in seen_xrefs:
+                skipped["repeated"] += 1
+                continue
+            seen_xrefs.add(xref)
+        if min(width, height) < Config.PDF_IMAGE_MIN_SIDE or width * height < Config.PDF_IMAGE_MIN_AREA:
+            skipped["too_small"] += 1
+            continue
+        base_image = doc.extract_image(xref)
+        # Decode here rather than in the parent
+        image = ImageProcessor.decode_image(base_image["image"], Config.MAX_IMAGE_SIZE)
+        images.append({
+            "image": image,
+            "img_index": img_index,
+            "xref": xref,
+            "dhash": ImageProcessor.perceptual_hash(image)
+        })
+    
+    return {
+        "page_num": page_num,
+        "text_chunks": text_chunks,
+        "images": images,
+        "skipped_images": skipped
+    }
+
+def extract_page_range(file_path: str, start: int, end: int) -> List[Dict]:
+    """Extract pages [start, end) of a PDF, opening the document in this process"""
+    text_processor = _get_text_processor()
+    seen_xrefs = set()  # Repeats across shards are dropped by the parent
+    with fitz.open(file_path) as doc:
+        return [extract_page(doc, page_num, text_processor, seen_xrefs) for page_num in range(start, end)]
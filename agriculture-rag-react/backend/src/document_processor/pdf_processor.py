@@ -1,55 +1,183 @@
 import fitz  # PyMuPDF
 from PIL import Image
-import io
-import os
-from typing import List, Dict, Tuple
-import numpy as np
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Iterator, List, Dict, Set, Tuple, Optional, Callable
+from config import Config
 from src.utils.logger import get_logger
+from src.utils.metrics import REGISTRY, stage
 from src.document_processor.text_processor import TextProcessor  # Added import
 from src.document_processor.image_processor import ImageProcessor  # Explicit import
+from src.document_processor.page_extractor import extract_page, extract_page_range
 
 logger = get_logger(__name__)
 
+PAGES_EXTRACTED = REGISTRY.counter("pdf_pages_extracted_total", "PDF pages parsed into text chunks and images")
+IMAGES_SKIPPED = REGISTRY.counter(
+    "pdf_images_skipped_total", "PDF images not captioned or indexed: repeated xref, near-duplicate pixels or too small",
+    ["reason"]
+)
+
 class PDFProcessor:
-    def __init__(self):
+    def __init__(self, workers: Optional[int] = None):
         self.text_processor = TextProcessor()
         self.image_processor = ImageProcessor()
+        self.workers = Config.PDF_EXTRACT_WORKERS if workers is None else workers
+        self._executor = None
+
+    def process_pdf(self, file_path: str,
+                    progress_callback: Optional[Callable[[int, int], None]] = None) -> Tuple[List[Dict], List[Dict]]:
+        """Process PDF and extract text chunks and images with metadata
+        
+        progress_callback, if given, is called as (pages_done, pages_total) as pages are extracted.
+        Holds every decoded image at once; ingestion uses process_pdf_windows instead.
+        """
+        text_chunks, images = [], []
+        for window_chunks, window_images in self.process_pdf_windows(file_path, progress_callback=progress_callback):
+            text_chunks.extend(window_chunks)
+            images.extend(window_images)
+        return text_chunks, images
 
-    def process_pdf(self, file_path: str) -> Tuple[List[Dict], List[Dict]]:
-        """Process PDF and extract text chunks and images with metadata"""
-        text_chunks = []
-        images = []
+    def process_pdf_windows(self, file_path: str,
+                            progress_callback: Optional[Callable[[int, int], None]] = None,
+                            window_pages: Optional[int] = None) -> Iterator[Tuple[List[Dict], List[Dict]]]:
+        """Yield (text_chunks, captioned images) one window of pages at a time, in page order
         
+        Only the current window's decoded images are alive while the caller
+        embeds them, so memory does not grow with the length of the document.
+        """
         try:
-            doc = fitz.open(file_path)
-            
-            for page_num in range(len(doc)):
-                page = doc.load_page(page_num)
-                
-                # Extract text
-                text = page.get_text()
-                if text.strip():
-                    chunks = self.text_processor.chunk_text(text, page_num)
-                    text_chunks.extend(chunks)
+            text_count = image_count = 0
+            windows = self.iter_page_windows(file_path, window_pages, progress_callback)
+            while True:
+                with stage("upload", "extract"):
+                    pages = next(windows, None)
+                if pages is None:
+                    break
+                PAGES_EXTRACTED.inc(len(pages))
                 
-                # Extract images
-                image_list = page.get_images(full=True)
-                for img_index, img in enumerate(image_list):
-                    xref = img[0]
-                    base_image = doc.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    
-                    image = Image.open(io.BytesIO(image_bytes))
-                    image_data = self.image_processor.process_image(image, page_num, img_index)
-                    images.append(image_data)
+                text_chunks = [chunk for page in pages for chunk in page["text_chunks"]]
+                with stage("upload", "caption"):
+                    images = self.caption_pages(pages)
+                del pages
+                text_count += len(text_chunks)
+                image_count += len(images)
+                yield text_chunks, images
             
-            logger.info(f"Processed PDF: {file_path} - {len(text_chunks)} text chunks, {len(images)} images")
-            return text_chunks, images
+            logger.info(f"Processed PDF: {file_path} - {text_count} text chunks, {image_count} images")
         
         except Exception as e:
             logger.error(f"Error processing PDF {file_path}: {str(e)}")
             raise
 
+    def extract_pages(self, file_path: str,
+                      progress_callback: Optional[Callable[[int, int], None]] = None) -> List[Dict]:
+        """Extract text chunks and decoded images for every page, in page order"""
+        return [page for window in self.iter_page_windows(file_path, progress_callback=progress_callback)
+                for page in window]
+
+    def iter_page_windows(self, file_path: str, window_pages: Optional[int] = None,
+                          progress_callback: Optional[Callable[[int, int], None]] = None) -> Iterator[List[Dict]]:
+        """Extract pages window_pages at a time (Config.PDF_WINDOW_PAGES by default)
+        
+        Raises ValueError before any extraction if the PDF has more than Config.MAX_PAGES pages.
+        """
+        window_pages = max(1, window_pages or Config.PDF_WINDOW_PAGES)
+        with fitz.open(file_path) as doc:
+            total_pages = len(doc)
+            if Config.MAX_PAGES and total_pages > Config.MAX_PAGES:
+                raise ValueError(f"PDF has {total_pages} pages; at most {Config.MAX_PAGES} are allowed")
+            parallel = self.workers > 1 and total_pages >= Config.PDF_PARALLEL_MIN_PAGES
+            # Document-wide, so a logo on every page is decoded and captioned once
+            seen_xrefs, kept_xrefs, kept_hashes = set(), set(), []
+            
+            for start in range(0, total_pages, window_pages):
+                end = min(start + window_pages, total_pages)
+                if parallel:
+                    pages = self._extract_pages_parallel(file_path, start, end, total_pages, progress_callback)
+                else:
+                    pages = []
+                    for page_num in range(start, end):
+                        pages.append(extract_page(doc, page_num, self.text_processor, seen_xrefs))
+                        if progress_callback:
+                            progress_callback(page_num + 1, total_pages)
+                self._drop_repeated_images(pages, kept_xrefs, kept_hashes)
+                yield pages
+
+    @staticmethod
+    def _drop_repeated_images(pages: List[Dict], kept_xrefs: Set[int], kept_hashes: List[int]):
+        """Remove images already kept from an earlier page (same xref or near-identical pixels)
+        
+        Serial extraction skips repeated xrefs before decoding; pool workers
+        only see their own shard, so repeats across shards are caught here.
+        """
+        max_distance = Config.PDF_IMAGE_DUPLICATE_DISTANCE
+        for page in pages:
+            kept = []
+            for img in page["images"]:
+                if img["xref"] in kept_xrefs:
+                    page["skipped_images"]["repeated"] += 1
+                elif max_distance >= 0 and any((img["dhash"] ^ seen).bit_count() <= max_distance
+                                               for seen in kept_hashes):
+                    page["skipped_images"]["duplicate"] += 1
+                else:
+                    kept.append(img)
+                    kept_xrefs.add(img["xref"])
+                    kept_hashes.append(img["dhash"])
+            page["images"] = kept
+            for reason, count in page["skipped_images"].items():
+                if count:
+                    IMAGES_SKIPPED.inc(count, reason=reason)
+
+    def _extract_pages_parallel(self, file_path: str, start: int, end: int, total_pages: int,
+                                progress_callback: Optional[Callable[[int, int], None]]) -> List[Dict]:
+        """Shard pages [start, end) across the process pool and merge results in page order"""
+        shard_size = Config.PDF_PAGES_PER_SHARD
+        starts = list(range(start, end, shard_size))
+        ends = [min(shard_start + shard_size, end) for shard_start in starts]
+        
+        pages = []
+        # map() yields shards in submission order, so page_num/chunk_num stay deterministic
+        for shard in self._get_executor().map(extract_page_range, repeat(file_path), starts, ends):
+            pages.extend(shard)
+            if progress_callback:
+                progress_callback(start + len(pages), total_pages)
+        
+        logger.debug(f"Extracted pages {start}-{end - 1} of {file_path} across {len(starts)} shards")
+        return pages
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Create the extraction pool on first use and keep it for later documents"""
+        if self._executor is None:
+            # This process is multithreaded by now (server threads, logging, BLAS pools), so the
+            # workers must not be forked from it: a lock held by another thread would never be released
+            method = Config.PDF_EXTRACT_START_METHOD
+            if method not in multiprocessing.get_all_start_methods():
+                method = "spawn"
+            context = multiprocessing.get_context(method)
+            if method == "forkserver":
+                # Imported once in the fork server, so each worker starts without re-importing PyMuPDF
+                context.set_forkserver_preload(["src.document_processor.page_extractor"])
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            logger.info(f"Started PDF extraction pool with {self.workers} workers ({method})")
+        return self._executor
+
+    def caption_pages(self, pages: List[Dict]) -> List[Dict]:
+        """Caption every extracted image in one batched pass and attach metadata"""
+        pending_images = [(img["image"], page["page_num"], img["img_index"]) for page in pages for img in page["images"]]
+        captions = self.image_processor.caption_images([item[0] for item in pending_images])
+        return [
+            self.image_processor.build_image_data(image, caption, page_num, img_index)
+            for (image, page_num, img_index), caption in zip(pending_images, captions)
+        ]
+
+    def shutdown(self):
+        """Stop the extraction pool"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
     def extract_page_as_image(self, pdf_path: str, page_num: int = 0) -> Image.Image:
         """Extract specific page as PIL Image"""
         try:
@@ -60,4 +188,4 @@ class PDFProcessor:
             return img
         except Exception as e:
             logger.error(f"Error extracting page {page_num} from {pdf_path}: {str(e)}")
-            raise
\ No newline at end of file
+            raise
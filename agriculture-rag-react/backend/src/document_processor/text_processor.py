@@ -1,5 +1,4 @@
 from typing import List, Dict
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from src.utils.logger import get_logger
 import re
 
@@ -7,12 +6,19 @@ logger = get_logger(__name__)
 
 class TextProcessor:
     def __init__(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-            is_separator_regex=False,
-        )
+        self._text_splitter = None  # Built on first use; importing langchain is slow
+    
+    @property
+    def text_splitter(self):
+        if self._text_splitter is None:
+            from langchain.text_splitter import RecursiveCharacterTextSplitter
+            self._text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=1000,
+                chunk_overlap=200,
+                length_function=len,
+                is_separator_regex=False,
+            )
+        return self._text_splitter
     
     def clean_text(self, text: str) -> str:
         """Clean and normalize text"""
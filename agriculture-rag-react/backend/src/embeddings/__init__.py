@@ -1,4 +1,12 @@
-from .text_embeddings import TextEmbedder
-from .image_embeddings import ImageEmbedder
+from src.utils.lazy import lazy_exports
 
-__all__ = ['TextEmbedder', 'ImageEmbedder']
\ No newline at end of file
+# Imported on first use (PEP 562) so the SQLite cache does not drag in torch
+_EXPORTS = {
+    'TextEmbedder': '.text_embeddings',
+    'ImageEmbedder': '.image_embeddings',
+    'EmbeddingCache': '.embedding_cache'
+}
+
+__all__ = list(_EXPORTS)
+
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS)
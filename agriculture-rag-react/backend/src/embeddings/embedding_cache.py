@@ -0,0 +1,153 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Iterable
+import numpy as np
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+class EmbeddingCache:
+    # SQLite caps the number of bound parameters per statement
+    _QUERY_BATCH = 500
+    
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 * 1024):
+        """
+        Content-addressed embedding cache in a single SQLite file
+        
+        Args:
+            path: Database file, usually under Config.CACHE_DIR
+            max_bytes: Size cap for stored vectors; least recently used entries are evicted past it
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._path = path
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        self._total_bytes = self._count_bytes()
+        self.hits = 0
+        self.misses = 0
+        logger.info(f"Opened embedding cache {path} ({self._total_bytes / 1e6:.1f} MB)")
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    def reopen(self):
+        """Open a fresh connection in a forked worker; SQLite connections must not cross a fork"""
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+        self._total_bytes = self._count_bytes()
+    
+    def _count_bytes(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+    
+    @staticmethod
+    def make_key(namespace: str, content: bytes) -> str:
+        """Key for content under a model namespace such as 'model@revision'"""
+        digest = hashlib.sha256(namespace.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(content)
+        return digest.hexdigest()
+    
+    def get_many(self, keys: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Return cached vectors for the keys that are present and mark them recently used"""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        try:
+            with self._lock:
+                for start in range(0, len(keys), self._QUERY_BATCH):
+                    batch = keys[start:start + self._QUERY_BATCH]
+                    placeholders = ",".join("?" * len(batch))
+                    rows = self._conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                    ).fetchall()
+                    for key, blob in rows:
+                        found[key] = np.frombuffer(blob, dtype='float32')
+                if found:
+                    now = time.time()
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                        [(now, key) for key in found]
+                    )
+                    self._conn.commit()
+        except Exception as e:
+            logger.error(f"Error reading embedding cache: {str(e)}")
+            return {}
+        
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+    
+    def put_many(self, items: Dict[str, np.ndarray]):
+        """Store vectors, evicting least recently used entries past the size cap"""
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        for key, vector in items.items():
+            blob = np.ascontiguousarray(vector, dtype='float32').tobytes()
+            rows.append((key, blob, len(blob), now))
+        try:
+            with self._lock:
+                replaced = self._stored_size(list(items))
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, size, last_access) VALUES (?, ?, ?, ?)", rows
+                )
+                self._conn.commit()
+                # Rows overwritten by INSERT OR REPLACE no longer count
+                self._total_bytes += sum(row[2] for row in rows) - replaced
+                if self._total_bytes > self._max_bytes:
+                    self._evict()
+        except Exception as e:
+            logger.error(f"Error writing embedding cache: {str(e)}")
+    
+    def _stored_size(self, keys: List[str]) -> int:
+        """Bytes currently held by those of keys that are already cached"""
+        total = 0
+        for start in range(0, len(keys), self._QUERY_BATCH):
+            batch = keys[start:start + self._QUERY_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            total += self._conn.execute(
+                f"SELECT COALESCE(SUM(size), 0) FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchone()[0]
+        return total
+    
+    def _evict(self):
+        """Drop least recently used entries until the cache is back under 90% of its cap"""
+        target = int(self._max_bytes * 0.9)
+        # Other worker processes write the same file; recount before deciding what to drop
+        self._total_bytes = self._count_bytes()
+        doomed = []
+        for key, size in self._conn.execute("SELECT key, size FROM embeddings ORDER BY last_access ASC"):
+            if self._total_bytes <= target:
+                break
+            doomed.append((key,))
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", doomed)
+        self._conn.commit()
+        logger.info(f"Evicted {len(doomed)} entries from embedding cache")
+    
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        return {
+            "path": self._path,
+            "bytes": self._total_bytes,
+            "max_bytes": self._max_bytes,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,47 +1,295 @@
-from transformers import CLIPProcessor, CLIPModel
-from typing import List, Dict
-import torch
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+import os
+import threading
 import numpy as np
 from PIL import Image
+from config import Config
+from src.embeddings.onnx_backend import (
+    PARITY_TEXTS, cache_dir_for, cosine_parity, export, load_sessions, parity_images, resolve_backend
+)
 from src.utils.logger import get_logger
+from src.utils.metrics import MODEL_INPUTS, stage
+from src.utils.startup import timed
 
 logger = get_logger(__name__)
 
 class ImageEmbedder:
-    def __init__(self, model_name: str = "openai/clip-vit-base-patch32"):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.info(f"Loading image embedding model: {model_name} on {self.device}")
-        self.model = CLIPModel.from_pretrained(model_name).to(self.device)
-        self.processor = CLIPProcessor.from_pretrained(model_name)
-        self.dimension = self.model.config.projection_dim
+    def __init__(self, model_name: str = "openai/clip-vit-base-patch32", batch_size: Optional[int] = None,
+                 revision: Optional[str] = None, cache=None, text_batch_size: Optional[int] = None,
+                 query_cache_size: int = 1024, backend: Optional[str] = None):
+        self.model_name = model_name
+        self.revision = revision
+        self.backend = backend or Config.IMAGE_EMBEDDING_BACKEND  # torch, onnx or int8
+        self.device = None
+        self._model = None  # CLIP is loaded on first use or by load()
+        self._onnx = None   # ({"vision": session, "text": session}, export metadata) on ONNX Runtime
+        self._processor = None
+        self._load_lock = threading.Lock()
+        self.batch_size = batch_size or Config.IMAGE_EMBED_BATCH_SIZE
+        self.cache = cache
+        self._cache_namespace = f"image:{model_name}@{revision or 'default'}" + (
+            "" if self.backend == "torch" else f":{self.backend}"
+        )
+        # Text tower, used to query the image index in CLIP's shared space
+        self.text_batch_size = text_batch_size or Config.CLIP_TEXT_BATCH_SIZE
+        self._query_cache = OrderedDict()
+        self._query_cache_size = query_cache_size
+        self._query_cache_lock = threading.Lock()
+    
+    @property
+    def model(self):
+        """The torch CLIP model, loaded even if another backend serves embedding calls"""
+        if self._model is None:
+            self.load()
+            with self._load_lock:
+                self._load_torch()
+        return self._model
+    
+    @property
+    def processor(self):
+        if self._processor is None:
+            self.load()
+        return self._processor
+    
+    @property
+    def dimension(self) -> int:
+        self._ensure_loaded()
+        if self._onnx is not None:
+            return self._onnx[1]["dimension"]
+        return self._model.config.projection_dim
+    
+    def load(self) -> "ImageEmbedder":
+        """Load CLIP now instead of on first use"""
+        with self._load_lock:
+            if self._model is None and self._onnx is None:
+                with timed(f"Loaded image embedding model {self.model_name} ({self.backend})"):
+                    from transformers import CLIPProcessor
+                    self._processor = CLIPProcessor.from_pretrained(self.model_name, revision=self.revision)
+                    backend = resolve_backend(self.backend)
+                    if backend != "torch":
+                        try:
+                            self._load_onnx(backend)
+                        except Exception as e:
+                            logger.error(f"Cannot run {self.model_name} on {backend}, falling back to torch: {str(e)}")
+                            backend = "torch"
+                    if backend == "torch":
+                        self._load_torch()
+                    self.backend = backend
+        return self
+    
+    def _ensure_loaded(self):
+        if self._model is None and self._onnx is None:
+            self.load()
+    
+    def _load_torch(self):
+        """Load the torch CLIP model (caller holds the load lock)"""
+        if self._model is None:
+            import torch
+            from transformers import CLIPModel
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            model = CLIPModel.from_pretrained(self.model_name, revision=self.revision).to(device)
+            model.eval()
+            self.device = device
+            self._model = model
+        return self._model
+    
+    def _load_onnx(self, backend: str):
+        """Serve both towers from the cached export, exporting and checking it first if needed"""
+        cache_dir = cache_dir_for("image", self.model_name, self.revision)
+        self._onnx = load_sessions(cache_dir, ["vision", "text"], backend, self._export_onnx, self._check_parity)
+        self.device = "cpu"
+        self._model = None  # The torch weights were only needed for export and the parity check
+    
+    def _export_onnx(self, cache_dir: str) -> Dict:
+        """Export get_image_features and get_text_features as two graphs"""
+        model = self._load_torch()
+        pixels = self._processor(images=parity_images()[:2], return_tensors="pt")["pixel_values"].to(self.device)
+        export(model, {"pixel_values": pixels}, "image_embeds",
+               {"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+               os.path.join(cache_dir, "vision.onnx"), method="get_image_features")
+        tokens = self._processor(text=PARITY_TEXTS[:2], return_tensors="pt", padding=True, truncation=True)
+        sample = {name: tokens[name].to(self.device) for name in ("input_ids", "attention_mask")}
+        export(model, sample, "text_embeds",
+               {"input_ids": {0: "batch", 1: "sequence"}, "attention_mask": {0: "batch", 1: "sequence"},
+                "text_embeds": {0: "batch"}},
+               os.path.join(cache_dir, "text.onnx"), method="get_text_features")
+        return {"dimension": model.config.projection_dim}
+    
+    def _check_parity(self, sessions: Dict) -> Dict[str, float]:
+        """Compare both towers with torch over the fixed sample images and texts"""
+        self._load_torch()
+        images = parity_images()
+        reference = np.vstack([self._torch_image_features(images), self._torch_text_features(PARITY_TEXTS)])
+        candidate = np.vstack([self._onnx_image_features(sessions["vision"], images),
+                               self._onnx_text_features(sessions["text"], PARITY_TEXTS)])
+        return cosine_parity(reference, candidate)
     
     def embed_image(self, image: Image.Image) -> np.ndarray:
         """Embed single image"""
         try:
-            inputs = self.processor(images=image, return_tensors="pt").to(self.device)
-            with torch.no_grad():
-                features = self.model.get_image_features(**inputs)
-            return features.cpu().numpy().flatten()
+            return self._embed_batch([image])[0]
         except Exception as e:
             logger.error(f"Error embedding image: {str(e)}")
             raise
     
+    def _embed_batch(self, images: List[Image.Image]) -> np.ndarray:
+        """Run one CLIP forward pass over a batch of images"""
+        self._ensure_loaded()
+        images = [img if img.mode == "RGB" else img.convert("RGB") for img in images]
+        with stage("image_embedder", "encode_images"):
+            if self._onnx is not None:
+                features = self._onnx_image_features(self._onnx[0]["vision"], images)
+            else:
+                features = self._torch_image_features(images)
+        MODEL_INPUTS.inc(len(images), model="clip_vision")
+        return features
+    
+    def _torch_image_features(self, images: List[Image.Image]) -> np.ndarray:
+        import torch
+        inputs = self._processor(images=images, return_tensors="pt").to(self.device)
+        with torch.no_grad():
+            features = self._model.get_image_features(**inputs)
+        return features.cpu().numpy().astype('float32', copy=False)
+    
+    def _onnx_image_features(self, session, images: List[Image.Image]) -> np.ndarray:
+        inputs = self._processor(images=images, return_tensors="np")
+        return session.run(pixel_values=inputs["pixel_values"]).astype('float32', copy=False)
+    
+    def embed_images_batched(self, images: List[Dict], batch_size: Optional[int] = None) -> Tuple[List[Dict], np.ndarray]:
+        """Embed images in size-sorted mini-batches.
+        
+        Returns the images that were embedded successfully together with a
+        float32 matrix whose rows line up with them. Each image's "embedding"
+        is a row view into that matrix, so VectorStore.add_images can take the
+        matrix as-is.
+        """
+        if not images:
+            return [], np.empty((0, self.dimension), dtype='float32')
+        
+        batch_size = batch_size or self.batch_size
+        embeddings = np.zeros((len(images), self.dimension), dtype='float32')
+        ok = np.ones(len(images), dtype=bool)
+        
+        # Only cache misses go to the model
+        pending = list(range(len(images)))
+        keys = None
+        if self.cache is not None:
+            keys = [self._cache_key(img_data["image"]) for img_data in images]
+            cached = self.cache.get_many(keys)
+            for i, key in enumerate(keys):
+                if key in cached:
+                    embeddings[i] = cached[key]
+            pending = [i for i, key in enumerate(keys) if key not in cached]
+        
+        # Group images of similar size so each batch resizes/pads alike
+        order = sorted(pending, key=lambda i: images[i]["image"].size[0] * images[i]["image"].size[1])
+        
+        for start in range(0, len(order), batch_size):
+            batch_ids = order[start:start + batch_size]
+            try:
+                embeddings[batch_ids] = self._embed_batch([images[i]["image"] for i in batch_ids])
+            except Exception as e:
+                # Retry one at a time so a single bad image does not sink the batch
+                logger.warning(f"Batch embedding failed, retrying images individually: {str(e)}")
+                for i in batch_ids:
+                    try:
+                        embeddings[i] = self._embed_batch([images[i]["image"]])[0]
+                    except Exception as img_error:
+                        logger.error(f"Error embedding image {images[i].get('metadata', {})}: {str(img_error)}")
+                        ok[i] = False
+        
+        if keys is not None:
+            self.cache.put_many({keys[i]: embeddings[i] for i in pending if ok[i]})
+        
+        if not ok.all():
+            embeddings = embeddings[ok]
+            images = [img for img, keep in zip(images, ok) if keep]
+        
+        for img_data, embedding in zip(images, embeddings):
+            img_data["embedding"] = embedding
+        
+        logger.info(f"Embedded {len(images)} images in batches of {batch_size}")
+        return images, embeddings
+    
+    def _cache_key(self, image: Image.Image) -> str:
+        """Content hash of the decoded pixels under this model's namespace"""
+        header = f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode("utf-8")
+        return self.cache.make_key(self._cache_namespace, header + image.tobytes())
+    
     def embed_images(self, images: List[Dict]) -> List[Dict]:
         """Embed list of images"""
         if not images:
             return []
             
         try:
-            for img_data in images:
-                embedding = self.embed_image(img_data["image"])
-                img_data["embedding"] = embedding
-            
-            logger.info(f"Embedded {len(images)} images")
+            images, _ = self.embed_images_batched(images)
             return images
         except Exception as e:
             logger.error(f"Error embedding images: {str(e)}")
             raise
     
+    def embed_text(self, text: str) -> np.ndarray:
+        """Embed a text query with CLIP's text tower, comparable to image embeddings"""
+        return self.embed_texts([text])[0]
+    
+    def embed_texts(self, texts: List[str], batch_size: Optional[int] = None) -> np.ndarray:
+        """Embed text queries in batches, returning an (n, d) float32 matrix.
+        
+        Recent queries are served from an in-memory LRU; returned rows are read-only.
+        """
+        embeddings = np.empty((len(texts), self.dimension), dtype='float32')
+        missing = {}
+        with self._query_cache_lock:
+            for i, text in enumerate(texts):
+                embedding = self._query_cache.get(text)
+                if embedding is None:
+                    missing.setdefault(text, []).append(i)
+                else:
+                    self._query_cache.move_to_end(text)
+                    embeddings[i] = embedding
+        
+        if missing:
+            batch_size = batch_size or self.text_batch_size
+            unique = list(missing)
+            try:
+                for start in range(0, len(unique), batch_size):
+                    batch = unique[start:start + batch_size]
+                    features = self._embed_text_batch(batch)
+                    with self._query_cache_lock:
+                        for text, embedding in zip(batch, features):
+                            embedding.flags.writeable = False
+                            embeddings[missing[text]] = embedding
+                            self._query_cache[text] = embedding
+                            if len(self._query_cache) > self._query_cache_size:
+                                self._query_cache.popitem(last=False)
+            except Exception as e:
+                logger.error(f"Error embedding text queries: {str(e)}")
+                raise
+        return embeddings
+    
+    def _embed_text_batch(self, texts: List[str]) -> np.ndarray:
+        """Run one CLIP text-tower pass; inputs beyond CLIP's 77 tokens are truncated"""
+        self._ensure_loaded()
+        with stage("image_embedder", "encode_texts"):
+            if self._onnx is not None:
+                features = self._onnx_text_features(self._onnx[0]["text"], texts)
+            else:
+                features = self._torch_text_features(texts)
+        MODEL_INPUTS.inc(len(texts), model="clip_text")
+        return features
+    
+    def _torch_text_features(self, texts: List[str]) -> np.ndarray:
+        import torch
+        inputs = self._processor(text=texts, return_tensors="pt", padding=True, truncation=True).to(self.device)
+        with torch.no_grad():
+            features = self._model.get_text_features(**inputs)
+        return np.array(features.cpu().numpy(), dtype='float32')
+    
+    def _onnx_text_features(self, session, texts: List[str]) -> np.ndarray:
+        inputs = self._processor(text=texts, return_tensors="np", padding=True, truncation=True)
+        return np.array(session.run(**inputs), dtype='float32')
+    
     def get_dimension(self) -> int:
         """Get embedding dimension"""
-        return self.dimension
\ No newline at end of file
+        return self.dimension
@@ -0,0 +1,191 @@
+"""ONNX Runtime inference for the embedding models.
+
+Each model is exported once per (model, revision) into its own directory under
+Config.ONNX_CACHE_DIR:
+
+* ``{part}.onnx`` - fp32 export of one network (e.g. CLIP's vision tower),
+* ``{part}.int8.onnx`` - dynamically quantized copy, written on first int8 use,
+* ``meta.json`` - what the caller needs to run the export without torch
+  (dimension, sequence length, ...) plus parity results per backend.
+
+An export is only used once its outputs have matched eager PyTorch on a fixed
+sample (lowest cosine similarity >= Config.ONNX_PARITY_MIN_COSINE); callers
+fall back to torch otherwise. onnx and onnxruntime are optional: without them
+every backend resolves to torch.
+"""
+import json
+import os
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from config import Config
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+BACKENDS = ("torch", "onnx", "int8")
+
+# Fixed inputs for parity checks; close to what the models see in production
+PARITY_TEXTS = [
+    "Rice blast is controlled with tricyclazole 75 WP at 0.6 g per litre.",
+    "Drip irrigation saves 40-60% water in sugarcane compared to furrow irrigation.",
+    "Soil pH between 6.0 and 7.5 suits most vegetable crops.",
+    "Apply 120:60:40 kg NPK per hectare for hybrid maize.",
+    "Which pulse varieties tolerate drought in Tamil Nadu?",
+    "Co-51 is a short duration paddy variety released by TNAU.",
+    "PM-KISAN provides income support of Rs. 6000 per year to farmers.",
+    "Integrated pest management combines biological, cultural and chemical control."
+]
+
+def parity_images() -> List:
+    """Deterministic synthetic images (gradients, stripes and noise) of assorted sizes"""
+    from PIL import Image
+    rng = np.random.default_rng(0)
+    images = []
+    for width, height in [(224, 224), (320, 180), (150, 400), (640, 480)]:
+        y, x = np.mgrid[0:height, 0:width]
+        gradient = np.stack([x * 255 // width, y * 255 // height, (x + y) * 127 // (width + height)], axis=-1)
+        images.append(Image.fromarray(gradient.astype('uint8')))
+        stripes = ((x // 16 + y // 24) % 2 * 200)[..., None].repeat(3, axis=-1) + rng.integers(0, 55, (height, width, 3))
+        images.append(Image.fromarray(stripes.astype('uint8')))
+    return images
+
+class OnnxParityError(Exception):
+    """Raised when an exported model's outputs drift too far from eager PyTorch"""
+
+def resolve_backend(name: Optional[str]) -> str:
+    """Validated backend name; ONNX backends degrade to torch when onnxruntime is missing"""
+    name = (name or "torch").lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {name!r}, expected one of {', '.join(BACKENDS)}")
+    if name != "torch":
+        try:
+            import onnxruntime  # noqa: F401
+        except ImportError:
+            logger.warning(f"onnxruntime is not installed, using torch instead of {name}")
+            return "torch"
+    return name
+
+def cache_dir_for(kind: str, model_name: str, revision: Optional[str]) -> str:
+    """Export directory of one model revision"""
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", f"{kind}-{model_name}@{revision or 'default'}")
+    return os.path.join(Config.ONNX_CACHE_DIR, slug)
+
+def model_path(cache_dir: str, part: str, backend: str) -> str:
+    return os.path.join(cache_dir, f"{part}.int8.onnx" if backend == "int8" else f"{part}.onnx")
+
+def read_meta(cache_dir: str) -> Dict:
+    path = os.path.join(cache_dir, "meta.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def write_meta(cache_dir: str, meta: Dict):
+    path = os.path.join(cache_dir, "meta.json")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, path)
+
+def export(module, sample_inputs: Dict, output_name: str, dynamic_axes: Dict[str, Dict[int, str]], path: str,
+           method: Optional[str] = None):
+    """Export module(**inputs), or module.method(**inputs), to ONNX via a temp file and rename.
+    
+    sample_inputs is an ordered name -> tensor mapping; dynamic_axes covers
+    both inputs and the output by name. Only the first output is kept.
+    """
+    import torch
+    
+    class _Positional(torch.nn.Module):
+        # torch.onnx.export passes inputs positionally
+        def __init__(self):
+            super().__init__()
+            self.module = module
+        
+        def forward(self, *inputs):
+            call = getattr(self.module, method) if method else self.module
+            output = call(**dict(zip(sample_inputs, inputs)))
+            return output if isinstance(output, torch.Tensor) else output[0]
+    
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            _Positional().eval(), tuple(sample_inputs.values()), tmp_path,
+            input_names=list(sample_inputs), output_names=[output_name],
+            dynamic_axes=dynamic_axes, opset_version=17, do_constant_folding=True
+        )
+    os.replace(tmp_path, path)
+    logger.info(f"Exported ONNX model {path}")
+
+def quantize(fp32_path: str, int8_path: str):
+    """Dynamically quantize weights to int8; activations stay float and are quantized per batch"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    tmp_path = f"{int8_path}.{os.getpid()}.tmp"
+    quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+    os.replace(tmp_path, int8_path)
+    logger.info(f"Quantized {fp32_path} to int8")
+
+def cosine_parity(reference: np.ndarray, candidate: np.ndarray) -> Dict[str, float]:
+    """Row-wise cosine similarity between two embedding matrices"""
+    reference = reference / np.maximum(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12)
+    candidate = candidate / np.maximum(np.linalg.norm(candidate, axis=1, keepdims=True), 1e-12)
+    cosines = np.sum(reference * candidate, axis=1)
+    return {"min_cosine": float(cosines.min()), "mean_cosine": float(cosines.mean())}
+
+class OnnxSession:
+    """CPU ONNX Runtime session fed by keyword arguments"""
+    def __init__(self, path: str):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if Config.ONNX_THREADS:
+            options.intra_op_num_threads = Config.ONNX_THREADS
+        self.path = path
+        self._session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self._input_names = [node.name for node in self._session.get_inputs()]
+    
+    def run(self, **inputs) -> np.ndarray:
+        """First output for the inputs the graph takes; extra tokenizer outputs are ignored"""
+        feeds = {name: np.asarray(inputs[name]) for name in self._input_names}
+        return self._session.run(None, feeds)[0]
+
+def load_sessions(cache_dir: str, parts: List[str], backend: str, export_fn: Callable[[str], Dict],
+                  parity_fn: Callable[[Dict[str, OnnxSession]], Dict[str, float]]
+                  ) -> Tuple[Dict[str, OnnxSession], Dict]:
+    """Sessions for the named parts and the export metadata, exporting, quantizing
+    and parity-checking on first use.
+    
+    export_fn(cache_dir) writes the fp32 part files and returns metadata to keep;
+    parity_fn(sessions) compares them with eager PyTorch. Both only run when
+    the cache has no passing parity result for this backend, so a warm cache
+    needs neither torch nor the original weights.
+    """
+    meta = read_meta(cache_dir)
+    if "exported" not in meta or not all(os.path.exists(model_path(cache_dir, part, "onnx")) for part in parts):
+        for part in parts:
+            # Quantized copies of an earlier export are stale now
+            if os.path.exists(model_path(cache_dir, part, "int8")):
+                os.remove(model_path(cache_dir, part, "int8"))
+        meta = {"exported": export_fn(cache_dir), "parity": {}}
+        write_meta(cache_dir, meta)
+    if backend == "int8":
+        for part in parts:
+            if not os.path.exists(model_path(cache_dir, part, "int8")):
+                quantize(model_path(cache_dir, part, "onnx"), model_path(cache_dir, part, "int8"))
+    
+    sessions = {part: OnnxSession(model_path(cache_dir, part, backend)) for part in parts}
+    report = meta.get("parity", {}).get(backend)
+    if report is None:
+        report = parity_fn(sessions)
+        meta.setdefault("parity", {})[backend] = report
+        write_meta(cache_dir, meta)
+        logger.info(f"ONNX {backend} parity for {cache_dir}: min cosine {report['min_cosine']:.4f}, "
+                    f"mean {report['mean_cosine']:.4f}")
+    if report["min_cosine"] < Config.ONNX_PARITY_MIN_COSINE:
+        raise OnnxParityError(
+            f"{backend} export in {cache_dir} reaches min cosine {report['min_cosine']:.4f} "
+            f"against torch, below {Config.ONNX_PARITY_MIN_COSINE}"
+        )
+    return sessions, meta["exported"]
@@ -1,33 +1,180 @@
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict
+from collections import OrderedDict
+from typing import List, Dict, Optional
+import os
+import threading
 import numpy as np
+from config import Config
+from src.embeddings.onnx_backend import (
+    PARITY_TEXTS, cache_dir_for, cosine_parity, export, load_sessions, read_meta, resolve_backend
+)
 from src.utils.logger import get_logger
+from src.utils.metrics import MODEL_INPUTS, stage
+from src.utils.startup import timed
 
 logger = get_logger(__name__)
 
 class TextEmbedder:
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
-        logger.info(f"Loading text embedding model: {model_name}")
-        self.model = SentenceTransformer(model_name)
-        self.dimension = self.model.get_sentence_embedding_dimension()
+    ONNX_BATCH_SIZE = 32
+    
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", revision: Optional[str] = None, cache=None,
+                 query_cache_size: int = 1024, backend: Optional[str] = None):
+        self.model_name = model_name
+        self.revision = revision
+        self.backend = backend or Config.TEXT_EMBEDDING_BACKEND  # torch, onnx or int8
+        self._model = None  # sentence-transformers model, loaded on first use or by load()
+        self._onnx = None   # (session, tokenizer, export metadata) when ONNX Runtime serves encode calls
+        self._load_lock = threading.Lock()
+        self.cache = cache
+        # Backends agree closely but not bit for bit, so each caches under its own namespace
+        self._cache_namespace = f"text:{model_name}@{revision or 'default'}:normalized" + (
+            "" if self.backend == "torch" else f":{self.backend}"
+        )
+        # Small in-memory LRU for query strings, which repeat far more than document chunks
+        self._query_cache = OrderedDict()
+        self._query_cache_size = query_cache_size
+        self._query_cache_lock = threading.Lock()
+    
+    @property
+    def model(self):
+        """The sentence-transformers model, loaded even if another backend serves encode calls"""
+        if self._model is None:
+            with self._load_lock:
+                self._load_torch()
+        return self._model
+    
+    @property
+    def dimension(self) -> int:
+        self._ensure_loaded()
+        if self._onnx is not None:
+            return self._onnx[2]["dimension"]
+        return self._model.get_sentence_embedding_dimension()
+    
+    def load(self) -> "TextEmbedder":
+        """Load the model now instead of on first use"""
+        with self._load_lock:
+            if self._model is None and self._onnx is None:
+                with timed(f"Loaded text embedding model {self.model_name} ({self.backend})"):
+                    backend = resolve_backend(self.backend)
+                    if backend != "torch":
+                        try:
+                            self._load_onnx(backend)
+                        except Exception as e:
+                            logger.error(f"Cannot run {self.model_name} on {backend}, falling back to torch: {str(e)}")
+                            backend = "torch"
+                    if backend == "torch":
+                        self._load_torch()
+                    self.backend = backend
+        return self
+    
+    def _ensure_loaded(self):
+        if self._model is None and self._onnx is None:
+            self.load()
+    
+    def _load_torch(self):
+        """Load the sentence-transformers model (caller holds the load lock)"""
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name, revision=self.revision)
+        return self._model
+    
+    def _load_onnx(self, backend: str):
+        """Serve encode calls from the cached export, exporting and checking it first if needed"""
+        from transformers import AutoTokenizer
+        cache_dir = cache_dir_for("text", self.model_name, self.revision)
+        sessions, meta = load_sessions(cache_dir, ["encoder"], backend, self._export_onnx,
+                                       lambda sessions: self._check_parity(sessions["encoder"], cache_dir))
+        self._onnx = (sessions["encoder"], AutoTokenizer.from_pretrained(cache_dir), meta)
+        self._model = None  # The torch weights were only needed for export and the parity check
+    
+    def _export_onnx(self, cache_dir: str) -> Dict:
+        """Export the transformer; tokenization, mean pooling and normalization run in numpy"""
+        model = self._load_torch()
+        transformer, pooling = model[0], model[1]
+        if pooling.get_pooling_mode_str() != "mean":
+            raise ValueError(f"Only mean pooling is supported, {self.model_name} uses {pooling.get_pooling_mode_str()}")
+        sample = dict(model.tokenizer(PARITY_TEXTS[:2], padding=True, return_tensors="pt"))
+        axes = {name: {0: "batch", 1: "sequence"} for name in [*sample, "last_hidden_state"]}
+        export(transformer.auto_model, sample, "last_hidden_state", axes, os.path.join(cache_dir, "encoder.onnx"))
+        model.tokenizer.save_pretrained(cache_dir)
+        return {
+            "dimension": model.get_sentence_embedding_dimension(),
+            "max_seq_length": model.max_seq_length
+        }
+    
+    def _check_parity(self, session, cache_dir: str) -> Dict[str, float]:
+        from transformers import AutoTokenizer
+        reference = self._load_torch().encode(PARITY_TEXTS, normalize_embeddings=True)
+        candidate = self._mean_pooled(session, AutoTokenizer.from_pretrained(cache_dir),
+                                      read_meta(cache_dir)["exported"]["max_seq_length"], PARITY_TEXTS)
+        return cosine_parity(reference, candidate)
+    
+    def _mean_pooled(self, session, tokenizer, max_length: int, texts: List[str]) -> np.ndarray:
+        """Normalized mean-pooled embeddings, as sentence-transformers computes them"""
+        # Longest first, like SentenceTransformer.encode, so each batch pads little
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        embeddings = None
+        for start in range(0, len(order), self.ONNX_BATCH_SIZE):
+            batch_ids = order[start:start + self.ONNX_BATCH_SIZE]
+            inputs = tokenizer([texts[i] for i in batch_ids], padding=True, truncation=True,
+                               max_length=max_length, return_tensors="np")
+            hidden = session.run(**inputs)
+            mask = inputs["attention_mask"][..., None].astype('float32')
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+            if embeddings is None:
+                embeddings = np.empty((len(texts), pooled.shape[1]), dtype='float32')
+            embeddings[batch_ids] = pooled
+        return embeddings
+    
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """(n, d) float32 normalized embeddings from whichever backend is loaded"""
+        self._ensure_loaded()
+        with stage("text_embedder", "encode"):
+            if self._onnx is not None:
+                session, tokenizer, meta = self._onnx
+                embeddings = self._mean_pooled(session, tokenizer, meta["max_seq_length"], texts)
+            else:
+                embeddings = self._model.encode(texts, normalize_embeddings=True).astype('float32', copy=False)
+        MODEL_INPUTS.inc(len(texts), model="text_embedder")
+        return embeddings
     
     def embed_text(self, text: str) -> np.ndarray:
         """Embed single text string"""
+        with self._query_cache_lock:
+            embedding = self._query_cache.get(text)
+            if embedding is not None:
+                self._query_cache.move_to_end(text)
+                return embedding
         try:
-            embedding = self.model.encode(text, normalize_embeddings=True)
+            embedding = self._encode([text])[0]
+            embedding.flags.writeable = False
+            with self._query_cache_lock:
+                self._query_cache[text] = embedding
+                if len(self._query_cache) > self._query_cache_size:
+                    self._query_cache.popitem(last=False)
             return embedding
         except Exception as e:
             logger.error(f"Error embedding text: {str(e)}")
             raise
     
+    def embed_queries(self, texts: List[str]) -> np.ndarray:
+        """Embed many query strings in one encode call, returning an (n, d) float32 matrix"""
+        if not texts:
+            return np.empty((0, self.dimension), dtype='float32')
+        try:
+            return self._encode(texts)
+        except Exception as e:
+            logger.error(f"Error embedding queries: {str(e)}")
+            raise
+    
     def embed_documents(self, documents: List[Dict]) -> List[Dict]:
-        """Embed list of document chunks"""
+        """Embed list of document chunks, sending only cache misses to the model"""
         if not documents:
             return []
             
         texts = [doc["text"] for doc in documents]
         try:
-            embeddings = self.model.encode(texts, normalize_embeddings=True)
+            embeddings = self._encode_cached(texts)
             
             for i, doc in enumerate(documents):
                 doc["embedding"] = embeddings[i]
@@ -38,6 +185,28 @@ class TextEmbedder:
             logger.error(f"Error embedding documents: {str(e)}")
             raise
     
+    def _encode_cached(self, texts: List[str]) -> np.ndarray:
+        """Encode texts into a float32 matrix, reusing cached embeddings where possible"""
+        if self.cache is None:
+            return self._encode(texts)
+        
+        keys = [self.cache.make_key(self._cache_namespace, text.encode("utf-8")) for text in texts]
+        cached = self.cache.get_many(keys)
+        embeddings = np.empty((len(texts), self.dimension), dtype='float32')
+        
+        miss_ids = [i for i, key in enumerate(keys) if key not in cached]
+        for i, key in enumerate(keys):
+            if key in cached:
+                embeddings[i] = cached[key]
+        
+        if miss_ids:
+            encoded = self._encode([texts[i] for i in miss_ids])
+            embeddings[miss_ids] = encoded
+            self.cache.put_many({keys[i]: embeddings[i] for i in miss_ids})
+        
+        logger.debug(f"Embedding cache: {len(texts) - len(miss_ids)} hits, {len(miss_ids)} misses")
+        return embeddings
+    
     def get_dimension(self) -> int:
         """Get embedding dimension"""
-        return self.dimension
\ No newline at end of file
+        return self.dimension
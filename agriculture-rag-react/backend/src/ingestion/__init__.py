@@ -0,0 +1,14 @@
+from src.utils.lazy import lazy_exports
+
+# Imported on first use (PEP 562), like the other src packages
+_EXPORTS = {
+    'IngestionPipeline': '.pipeline',
+    'JobQueue': '.job_queue',
+    'IngestionJob': '.job_queue',
+    'JobQueueFullError': '.job_queue',
+    'DocumentRegistry': '.document_registry'
+}
+
+__all__ = list(_EXPORTS)
+
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS)
@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+class DocumentRegistry:
+    def __init__(self, path: str):
+        """
+        Persistent record of ingested documents keyed by filename
+        
+        Args:
+            path: JSON file the registry is stored in
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._documents = self._load()
+    
+    def _load(self) -> Dict[str, Dict]:
+        """Read the registry file, starting empty if it is missing or unreadable"""
+        self._mtime = self._file_mtime()
+        if self._mtime is None:
+            return {}
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading document registry {self._path}: {str(e)}")
+            return {}
+    
+    def _save(self):
+        """Write the registry atomically so a crash never leaves a truncated file"""
+        os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._documents, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path)
+        self._mtime = self._file_mtime()
+    
+    def _file_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self._path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+    
+    def reload(self) -> bool:
+        """Re-read the file if another process changed it since this one last read or wrote it"""
+        with self._lock:
+            if self._file_mtime() == self._mtime:
+                return False
+            self._documents = self._load()
+            return True
+    
+    def get(self, filename: str) -> Optional[Dict]:
+        """Entry for a filename, if it was ingested before"""
+        with self._lock:
+            return self._documents.get(filename)
+    
+    def find_by_hash(self, content_hash: str) -> Optional[Dict]:
+        """Entry whose content hash matches, regardless of filename"""
+        with self._lock:
+            for filename, entry in self._documents.items():
+                if entry["sha256"] == content_hash:
+                    return {"filename": filename, **entry}
+        return None
+    
+    def register(self, filename: str, content_hash: str, summary: Optional[Dict] = None):
+        """Record a successfully ingested document, replacing any entry with the same name"""
+        with self._lock:
+            self._documents[filename] = {
+                "sha256": content_hash,
+                "ingested_at": time.time(),
+                **(summary or {})
+            }
+            self._save()
+        logger.info(f"Registered document {filename} ({content_hash[:12]})")
+    
+    def remove(self, filename: str) -> Optional[Dict]:
+        """Forget a document"""
+        with self._lock:
+            entry = self._documents.pop(filename, None)
+            if entry is not None:
+                self._save()
+            return entry
+    
+    def __len__(self) -> int:
+        return len(self._documents)
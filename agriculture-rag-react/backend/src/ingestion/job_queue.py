@@ -0,0 +1,231 @@
+import json
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Callable
+from src.utils.logger import get_logger, current_fields, log_context, stage_durations
+from src.utils.metrics import REGISTRY, observe_stage
+
+logger = get_logger(__name__)
+
+JOBS_FINISHED = REGISTRY.counter("ingest_jobs_total", "Ingestion jobs run to completion or failure", ["status"])
+
+_JOB_ID_RE = re.compile(r"[0-9a-f]{32}")  # uuid4().hex; anything else never names a state file
+
+class JobQueueFullError(Exception):
+    """Raised when the ingestion queue has no room for another job"""
+
+class IngestionJob:
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    
+    def __init__(self, file_path: str, filename: str, options: Optional[Dict] = None):
+        self.id = uuid.uuid4().hex
+        self.file_path = file_path
+        self.filename = filename
+        self.options = options or {}
+        self.status = self.QUEUED
+        self.pages_done = 0
+        self.pages_total = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.log_fields = current_fields()  # e.g. the submitting request's ID, for the worker's log lines
+    
+    def set_progress(self, pages_done: int, pages_total: int):
+        """Progress callback handed to the ingestion pipeline"""
+        self.pages_done = pages_done
+        self.pages_total = pages_total
+    
+    @property
+    def finished(self) -> bool:
+        return self.status in (self.COMPLETED, self.FAILED)
+    
+    def to_dict(self) -> Dict:
+        """Serialize job state for the status endpoints"""
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "progress": {
+                "pages_done": self.pages_done,
+                "pages_total": self.pages_total
+            },
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "IngestionJob":
+        """Rebuild a job from its to_dict() form, e.g. one written by another worker process"""
+        job = cls(None, data["filename"])
+        job.id = data["job_id"]
+        job.status = data["status"]
+        job.pages_done = data["progress"]["pages_done"]
+        job.pages_total = data["progress"]["pages_total"]
+        for key in ("result", "error", "created_at", "started_at", "finished_at"):
+            setattr(job, key, data[key])
+        return job
+
+class JobQueue:
+    def __init__(self, handler: Callable, num_workers: int = 1, max_queue_size: int = 16, history_size: int = 200,
+                 state_dir: Optional[str] = None):
+        """
+        Bounded queue of ingestion jobs served by a fixed pool of worker threads
+        
+        Args:
+            handler: Callable(file_path, progress_callback=..., **options) returning a result dict
+            num_workers: Number of background worker threads
+            max_queue_size: Jobs that may wait before submit is rejected
+            history_size: Finished jobs kept around for status queries
+            state_dir: Optional directory where job state is mirrored as JSON, so any
+                worker process can answer status queries for jobs another one runs
+        """
+        self._handler = handler
+        self._num_workers = max(1, num_workers)
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._history_size = history_size
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._state_dir = state_dir
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+    
+    def _ensure_workers(self):
+        """Start worker threads on first use (threads do not survive a fork)"""
+        if self._workers:
+            return
+        for i in range(self._num_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"ingest-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f"Started {self._num_workers} ingestion workers")
+    
+    def submit(self, file_path: str, filename: str, **options) -> IngestionJob:
+        """Queue a file for ingestion, raising JobQueueFullError if the queue is full"""
+        job = IngestionJob(file_path, filename, options)
+        with self._lock:
+            self._ensure_workers()
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise JobQueueFullError(f"Ingestion queue is full ({self._queue.maxsize} jobs waiting)")
+            self._jobs[job.id] = job
+            self._prune_history()
+        self._write_state(job)
+        logger.info(f"Queued ingestion job {job.id} for {filename}")
+        return job
+    
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        """Look up a job by ID"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self._state_dir and _JOB_ID_RE.fullmatch(job_id):
+            job = self._read_state(os.path.join(self._state_dir, f"{job_id}.json"))
+        return job
+    
+    def list_jobs(self) -> List[IngestionJob]:
+        """Return known jobs, oldest first, including those of other processes sharing state_dir"""
+        with self._lock:
+            jobs = dict(self._jobs)
+        if self._state_dir:
+            for name in os.listdir(self._state_dir):
+                job_id, ext = os.path.splitext(name)
+                if ext == ".json" and job_id not in jobs:
+                    job = self._read_state(os.path.join(self._state_dir, name))
+                    if job is not None:
+                        jobs[job_id] = job
+        return sorted(jobs.values(), key=lambda job: job.created_at)
+    
+    def stats(self) -> Dict:
+        """Queue depth and worker counts"""
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job.status == IngestionJob.RUNNING)
+        return {
+            "queued": self._queue.qsize(),
+            "running": running,
+            "workers": self._num_workers,
+            "max_queue_size": self._queue.maxsize
+        }
+    
+    def _prune_history(self):
+        """Drop the oldest finished jobs beyond the history limit"""
+        excess = len(self._jobs) - self._history_size
+        if excess <= 0:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished][:excess]:
+            del self._jobs[job_id]
+            if self._state_dir:
+                try:
+                    os.remove(os.path.join(self._state_dir, f"{job_id}.json"))
+                except FileNotFoundError:
+                    pass
+    
+    def _write_state(self, job: IngestionJob):
+        """Mirror a job's state to state_dir (replace, so readers never see a partial file)"""
+        if not self._state_dir:
+            return
+        path = os.path.join(self._state_dir, f"{job.id}.json")
+        try:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(job.to_dict(), f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"Error writing state of ingestion job {job.id}: {str(e)}")
+    
+    @staticmethod
+    def _read_state(path: str) -> Optional[IngestionJob]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return IngestionJob.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Error reading ingestion job state {path}: {str(e)}")
+            return None
+    
+    def _report_progress(self, job: IngestionJob) -> Callable[[int, int], None]:
+        def report(pages_done: int, pages_total: int):
+            job.set_progress(pages_done, pages_total)
+            self._write_state(job)
+        return report
+    
+    def _worker_loop(self):
+        while True:
+            job = self._queue.get()
+            with log_context(**job.log_fields, job_id=job.id):
+                self._run(job)
+    
+    def _run(self, job: IngestionJob):
+        job.status = IngestionJob.RUNNING
+        job.started_at = time.time()
+        observe_stage("upload", "queue_wait", job.started_at - job.created_at)
+        self._write_state(job)
+        try:
+            job.result = self._handler(job.file_path, progress_callback=self._report_progress(job), **job.options)
+            job.status = IngestionJob.COMPLETED
+        except Exception as e:
+            job.error = str(e)
+            job.status = IngestionJob.FAILED
+            logger.error(f"Ingestion job {job.id} failed: {str(e)}")
+        finally:
+            job.finished_at = time.time()
+            observe_stage("upload", "job", job.finished_at - job.started_at)
+            JOBS_FINISHED.inc(status=job.status)
+            self._write_state(job)
+            if job.status == IngestionJob.COMPLETED:
+                logger.info(f"Ingestion job {job.id} completed", extra={"fields": {"stages_ms": stage_durations()}})
+            self._queue.task_done()
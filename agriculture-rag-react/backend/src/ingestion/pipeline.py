@@ -0,0 +1,204 @@
+import glob
+import os
+import threading
+from contextlib import ExitStack
+from typing import Dict, List, Optional, Callable
+import numpy as np
+from PIL import Image
+from config import Config
+from src.utils.helpers import is_pdf, extract_first_page_as_image, compute_file_hash, save_image
+from src.utils.logger import get_logger
+from src.utils.metrics import stage
+
+logger = get_logger(__name__)
+
+class IngestionPipeline:
+    def __init__(self, pdf_processor, text_embedder, image_embedder, vector_store, vector_store_path: str,
+                 registry=None):
+        """
+        Run uploaded files through parsing, captioning, embedding and indexing
+        
+        Args:
+            pdf_processor: Initialized PDF processor instance
+            text_embedder: Initialized text embedder instance
+            image_embedder: Initialized image embedder instance
+            vector_store: Vector store the results are added to
+            vector_store_path: Base path the vector store is saved under
+            registry: Optional DocumentRegistry used to skip or replace known documents
+        """
+        self._pdf_processor = pdf_processor
+        self._text_embedder = text_embedder
+        self._image_embedder = image_embedder
+        self._vector_store = vector_store
+        self._vector_store_path = vector_store_path
+        self._registry = registry
+        # Several ingestion workers may finish at once; only one may write the store
+        self._write_lock = threading.Lock()
+    
+    def ingest(self, file_path: str, progress_callback: Optional[Callable[[int, int], None]] = None,
+               content_hash: Optional[str] = None, filename: Optional[str] = None) -> Dict:
+        """Ingest a PDF or image file and return a summary of what was indexed
+        
+        filename is the name the document is registered under; uploads are stored
+        under their content hash, so it defaults to the file's name only for other callers.
+        """
+        filename = filename or os.path.basename(file_path)
+        content_hash = content_hash or compute_file_hash(file_path)
+        
+        if self._registry is not None:
+            self._registry.reload()
+            known = self._registry.find_by_hash(content_hash)
+            if known is not None:
+                logger.info(f"Skipping {filename}: identical to already ingested {known['filename']}")
+                return self.duplicate_result(known)
+        
+        if is_pdf(file_path):
+            text_chunks, images, image_embeddings, summary = self._prepare_pdf(file_path, progress_callback)
+        else:
+            text_chunks, images, image_embeddings, summary = self._prepare_image(file_path, progress_callback)
+        
+        self._tag_document(text_chunks, content_hash, filename)
+        self._tag_document(images, content_hash, filename)
+        
+        # Other worker processes write the same store and registry; the store lock
+        # serializes them and brings this process up to date before it writes
+        with ExitStack() as held:
+            with stage("upload", "store_lock"):
+                held.enter_context(self._write_lock)
+                held.enter_context(self._vector_store.exclusive(self._vector_store_path))
+            if self._registry is not None:
+                self._registry.reload()
+            # Another job may have ingested the same bytes while this one was embedding
+            known = self._registry.find_by_hash(content_hash) if self._registry is not None else None
+            if known is not None:
+                return self.duplicate_result(known)
+            
+            replaced = self._registry.get(filename) if self._registry is not None else None
+            # Chats see the old version or the new one, never a mix or neither
+            with stage("upload", "index"), self._vector_store.transaction():
+                if replaced is not None:
+                    removed = self._vector_store.remove_document(replaced["sha256"])
+                    logger.info(f"Replacing earlier version of {filename} ({removed} vectors removed)")
+                
+                self._vector_store.add_texts(text_chunks)
+                self._vector_store.add_images(images, embeddings=image_embeddings)
+            with stage("upload", "save"):
+                self._vector_store.save(self._vector_store_path)
+            
+            if self._registry is not None:
+                self._registry.register(filename, content_hash, {
+                    "text_chunks": summary["text_chunks"],
+                    "images": summary["images"],
+                    "preview": summary["preview"]
+                })
+        
+        if replaced is not None:
+            self._remove_stored_upload(os.path.dirname(file_path), replaced["sha256"])
+        summary["doc_id"] = content_hash
+        summary["replaced"] = replaced is not None
+        return summary
+    
+    @staticmethod
+    def duplicate_result(entry: Dict) -> Dict:
+        """Summary returned when a document's bytes are already indexed"""
+        return {
+            "message": "Document already processed",
+            "duplicate": True,
+            "doc_id": entry["sha256"],
+            "filename": entry["filename"],
+            "text_chunks": entry.get("text_chunks", 0),
+            "images": entry.get("images", 0),
+            "preview": entry.get("preview")
+        }
+    
+    @staticmethod
+    def _remove_stored_upload(upload_dir: str, content_hash: str):
+        """Delete a replaced version's upload and preview, stored as <sha256>.<ext> and preview_<sha256>.<ext>.jpg"""
+        for path in glob.glob(os.path.join(upload_dir, f"{content_hash}.*")) + \
+                glob.glob(os.path.join(upload_dir, f"preview_{content_hash}.*")):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not remove replaced upload {path}: {str(e)}")
+    
+    @staticmethod
+    def _tag_document(items: List[Dict], doc_id: str, filename: str):
+        """Record which document each chunk or image came from"""
+        for item in items:
+            item["metadata"]["doc_id"] = doc_id
+            item["metadata"]["filename"] = filename
+    
+    @staticmethod
+    def _store_image_files(images: List[Dict]):
+        """Write extracted images to the image store; the vector store only keeps their paths"""
+        for img_data in images:
+            img_data["image_path"] = save_image(img_data["image"], Config.IMAGE_STORE_DIR)
+    
+    def _prepare_pdf(self, file_path: str, progress_callback: Optional[Callable[[int, int], None]]):
+        """Parse, caption and embed a PDF one window of pages at a time
+        
+        Decoded images are written to the image store and dropped after each
+        window, so only embeddings and metadata are kept for the whole document.
+        """
+        text_chunks, images, image_embeddings = [], [], []
+        for window_chunks, window_images in self._pdf_processor.process_pdf_windows(
+                file_path, progress_callback=progress_callback):
+            with stage("upload", "embed_text"):
+                text_chunks.extend(self._text_embedder.embed_documents(window_chunks))
+            with stage("upload", "embed_images"):
+                window_images, window_embeddings = self._image_embedder.embed_images_batched(window_images)
+            with stage("upload", "store_images"):
+                self._store_image_files(window_images)
+            for img_data in window_images:
+                del img_data["image"]  # Only the caption, metadata and image_path are indexed
+            images.extend(window_images)
+            image_embeddings.append(window_embeddings)
+        image_embeddings = np.concatenate(image_embeddings) if image_embeddings else None
+        for i, img_data in enumerate(images):
+            img_data["embedding"] = image_embeddings[i]  # Row views again, so the per-window matrices can be freed
+        
+        # Extract preview image
+        filename = os.path.basename(file_path)
+        preview_path = None
+        with stage("upload", "preview"):
+            preview_image = extract_first_page_as_image(file_path)
+            if preview_image:
+                preview_path = os.path.join(os.path.dirname(file_path), f"preview_{filename}.jpg")
+                preview_image.save(preview_path)
+        
+        return text_chunks, images, image_embeddings, {
+            "message": "PDF processed successfully",
+            "text_chunks": len(text_chunks),
+            "images": len(images),
+            "preview": os.path.basename(preview_path) if preview_path else None
+        }
+    
+    def _prepare_image(self, file_path: str, progress_callback: Optional[Callable[[int, int], None]]):
+        """Embed a standalone image upload"""
+        image = Image.open(file_path)
+        image_data = {
+            "image": image,
+            "image_path": file_path,
+            "caption": "Uploaded image",
+            "metadata": {
+                "page_num": 0,
+                "img_index": 0,
+                "source": "upload",
+                "type": "image"
+            }
+        }
+        
+        with stage("upload", "embed_images"):
+            images, image_embeddings = self._image_embedder.embed_images_batched([image_data])
+        if not images:
+            raise ValueError("Could not embed image")
+        
+        if progress_callback:
+            progress_callback(1, 1)
+        
+        return [], images, image_embeddings, {
+            "message": "Image processed successfully",
+            "text_chunks": 0,
+            "images": len(images),
+            "preview": os.path.basename(file_path)
+        }
@@ -1,4 +1,15 @@
-from .vector_store import VectorStore
-from .rag_pipeline import RAGPipeline
+from src.utils.lazy import lazy_exports
 
-__all__ = ['VectorStore', 'RAGPipeline']
\ No newline at end of file
+# Imported on first use (PEP 562): RAGPipeline needs langchain, which the
+# vector store and its helpers do not
+_EXPORTS = {
+    'VectorStore': '.vector_store',
+    'RAGPipeline': '.rag_pipeline',
+    'ResponseCache': '.response_cache',
+    'MetadataStore': '.metadata_store',
+    'LexicalIndex': '.lexical_index'
+}
+
+__all__ = list(_EXPORTS)
+
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS)
@@ -0,0 +1,420 @@
+import math
+from typing import Optional, Tuple
+import faiss
+import numpy as np
+from config import Config
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+STORAGE_TYPES = ("float32", "fp16", "sq8", "pq")
+METRICS = {"l2": faiss.METRIC_L2, "ip": faiss.METRIC_INNER_PRODUCT}
+
+def build_index(index_type: str, dim: int, expected_size: int = 0, metric: str = "l2",
+                storage: str = "float32") -> faiss.Index:
+    """Create an empty FAISS index.
+    
+    Args:
+        index_type: Search structure, one of INDEX_TYPES
+        dim: Vector dimension
+        expected_size: Rough number of vectors, used to size IVF lists
+        metric: "l2", or "ip" for inner product over normalized vectors (cosine)
+        storage: How vectors are stored, one of STORAGE_TYPES; ivf_pq always uses PQ
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"Unknown vector storage '{storage}', expected one of {STORAGE_TYPES}")
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}', expected one of {tuple(METRICS)}")
+    
+    if index_type == "hnsw" and storage == "pq" and metric == "ip":
+        # FAISS' HNSW-PQ only supports L2
+        logger.warning("HNSW with PQ storage does not support inner product, using SQ8 storage")
+        storage = "sq8"
+    
+    codec = {"float32": "Flat", "fp16": "SQfp16", "sq8": "SQ8", "pq": f"PQ{_choose_pq_m(dim)}"}[storage]
+    if index_type == "flat":
+        description = codec
+    elif index_type == "ivf_flat":
+        description = f"IVF{_choose_nlist(expected_size)},{codec}"
+    elif index_type == "ivf_pq":
+        description = f"IVF{_choose_nlist(expected_size)},PQ{_choose_pq_m(dim)}"
+    else:
+        description = f"HNSW{Config.HNSW_M},{codec}"
+    
+    index = faiss.index_factory(dim, description, METRICS[metric])
+    if index_type == "hnsw":
+        index.hnsw.efConstruction = Config.HNSW_EF_CONSTRUCTION
+    return index
+
+def _choose_nlist(expected_size: int) -> int:
+    """Number of IVF lists: configured, or ~4*sqrt(n) with at least 39 training points per list"""
+    if Config.IVF_NLIST:
+        return Config.IVF_NLIST
+    nlist = int(4 * math.sqrt(max(expected_size, 1)))
+    return max(1, min(nlist, expected_size // 39 or 1))
+
+def _choose_pq_m(dim: int) -> int:
+    """Largest number of PQ sub-quantizers <= Config.PQ_M that divides the dimension"""
+    for m in range(min(Config.PQ_M, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+def _unwrap(index):
+    """The FAISS index a LayeredIndex appends to; any other index itself"""
+    return index.base if isinstance(index, LayeredIndex) else index
+
+def index_type_of(index: Optional[faiss.Index]) -> Optional[str]:
+    """Search structure of an index, as passed to build_index"""
+    if index is None:
+        return None
+    index = _unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return "ivf_pq" if isinstance(faiss.downcast_index(ivf), faiss.IndexIVFPQ) else "ivf_flat"
+    return "flat"
+
+def storage_of(index: Optional[faiss.Index]) -> Optional[str]:
+    """Vector storage of an index, as passed to build_index"""
+    if index is None:
+        return None
+    index = _unwrap(index)
+    codes = faiss.downcast_index(index.storage) if isinstance(index, faiss.IndexHNSW) else index
+    ivf = faiss.try_extract_index_ivf(codes)
+    codes = faiss.downcast_index(ivf) if ivf is not None else codes
+    if isinstance(codes, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "fp16" if codes.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    if isinstance(codes, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    return "float32"
+
+def metric_of(index: Optional[faiss.Index]) -> Optional[str]:
+    if index is None:
+        return None
+    return "ip" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+
+def layout_of(index: faiss.Index) -> Tuple[str, str, str]:
+    """(index_type, storage, metric) needed to rebuild an equivalent empty index"""
+    return index_type_of(index), storage_of(index), metric_of(index)
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Unit-normalized float32 copy, so inner product equals cosine similarity"""
+    vectors = np.array(vectors, dtype='float32', copy=True, ndmin=2)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def train_and_fill(index: faiss.Index, vectors: np.ndarray, sample_size: int) -> faiss.Index:
+    """Train index on a random sample of vectors if it needs training, then add all of them"""
+    if not index.is_trained:
+        if len(vectors) > sample_size:
+            rng = np.random.default_rng(0)
+            sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+        else:
+            sample = vectors
+        index.train(sample)
+    if len(vectors):
+        index.add(vectors)
+    return index
+
+def reconstruct_all(index: faiss.Index) -> np.ndarray:
+    """All stored vectors in row order (approximate for compressed indexes)"""
+    return reconstruct_range(index, 0, index.ntotal)
+
+def reconstruct_range(index: faiss.Index, start: int, n: int) -> np.ndarray:
+    """Stored vectors of rows [start, start + n)"""
+    if isinstance(index, LayeredIndex):
+        return index.reconstruct_n(start, n)
+    if n <= 0:
+        return np.zeros((0, index.d), dtype='float32')
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_n(start, n)
+
+def reconstruct_rows(index: faiss.Index, ids: np.ndarray) -> np.ndarray:
+    """Stored vectors of the given rows of a FAISS index"""
+    if len(ids) == 0:
+        return np.zeros((0, index.d), dtype='float32')
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_batch(np.ascontiguousarray(ids, dtype='int64'))
+
+def _keep_list_entries(source, target, live: np.ndarray, row_of: np.ndarray):
+    """Refill IVF index target, a copy of source, with only the live entries of source.
+    
+    The trained quantizers are kept and codes copied as they are; ids become row numbers.
+    """
+    target.reset()
+    target.set_direct_map_type(faiss.DirectMap.NoMap)
+    code_size = source.invlists.code_size
+    for list_no in range(source.nlist):
+        size = source.invlists.list_size(list_no)
+        if size == 0:
+            continue
+        ids = np.array(faiss.rev_swig_ptr(source.invlists.get_ids(list_no), size))
+        codes = np.array(faiss.rev_swig_ptr(source.invlists.get_codes(list_no), size * code_size))
+        keep = live[ids]
+        if keep.any():
+            new_ids = np.ascontiguousarray(row_of[ids[keep]])
+            new_codes = np.ascontiguousarray(codes.reshape(size, code_size)[keep])
+            target.invlists.add_entries(list_no, len(new_ids), faiss.swig_ptr(new_ids), faiss.swig_ptr(new_codes))
+    target.ntotal = int(np.count_nonzero(live))
+
+def apply_search_params(index: Optional[faiss.Index], nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """Set query-time recall/latency knobs on whichever index type this is"""
+    if index is None:
+        return
+    index = _unwrap(index)
+    index_type = index_type_of(index)
+    if index_type in ("ivf_flat", "ivf_pq") and nprobe:
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    elif index_type == "hnsw" and ef_search:
+        index.hnsw.efSearch = ef_search
+
+def measure_recall(index: faiss.Index, vectors: np.ndarray, n_queries: int = 200, k: int = 10) -> float:
+    """Recall@k of index against exact search over the original vectors.
+    
+    vectors must be the uncompressed vectors the index was filled with, in row
+    order; a sample of them is used as queries.
+    """
+    if len(vectors) == 0:
+        return 1.0
+    k = min(k, len(vectors))
+    exact = faiss.IndexFlat(vectors.shape[1], index.metric_type)
+    exact.add(vectors)
+    
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)]
+    _, truth = exact.search(queries, k)
+    _, found = index.search(queries, k)
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth.tolist(), found.tolist()))
+    return hits / float(truth.size)
+
+class LayeredIndex:
+    """A FAISS index that is never written, plus the rows appended after it was built.
+    
+    Published store states must not change, and copying a whole index for each
+    upload would make every upload cost as much as the corpus. An append instead
+    returns a new LayeredIndex sharing the base and the earlier blocks, with the
+    new rows in one more small flat block. Blocks are merged as they pile up, so
+    there are only logarithmically many, and are folded into a copy of the base
+    once they reach fold_ratio of it. Search covers the base and every block.
+    
+    Removing rows does not touch the base either: live masks out the removed
+    base rows at search time, and rows are numbered over the live ones only, so
+    they stay aligned with the metadata store. purged() drops them for good.
+    
+    mapped marks a base opened through a read-only memory map.
+    """
+    def __init__(self, base: faiss.Index, blocks: Tuple[faiss.Index, ...] = (), mapped: bool = False,
+                 fold_ratio: float = 0.1, min_fold: int = 50000, live: Optional[np.ndarray] = None):
+        self.base = base
+        self.blocks = tuple(blocks)
+        self.mapped = mapped
+        self.fold_ratio = fold_ratio
+        self.min_fold = min_fold
+        self.live = live  # Per base row, False once removed; None while no base row was removed
+        self.base_size = base.ntotal if live is None else int(np.count_nonzero(live))
+        self.ntotal = self.base_size + sum(block.ntotal for block in self.blocks)
+        self._row_of = None    # Row number of each base row, built on first use
+        self._selector = None  # (bitmap, IDSelectorBitmap) over live, built on first use
+    
+    @property
+    def d(self) -> int:
+        return self.base.d
+    
+    @property
+    def metric_type(self) -> int:
+        return self.base.metric_type
+    
+    @property
+    def delta_size(self) -> int:
+        """Rows appended since the base was built"""
+        return self.ntotal - self.base_size
+    
+    @property
+    def removed(self) -> int:
+        """Base rows masked out but still stored"""
+        return self.base.ntotal - self.base_size
+    
+    def _layered(self, base: faiss.Index, blocks, mapped: bool, live: Optional[np.ndarray]) -> "LayeredIndex":
+        return LayeredIndex(base, blocks, mapped, self.fold_ratio, self.min_fold, live)
+    
+    def added(self, vectors: np.ndarray, fold: bool = True) -> "LayeredIndex":
+        """Index with vectors appended as the next rows; this one is not changed.
+        
+        With fold, the blocks are folded into a copy of the base once they are
+        big enough. Without it the base is never copied, e.g. while it is a
+        memory map shared with other processes.
+        """
+        if len(vectors) == 0:
+            return self
+        block = faiss.IndexFlat(self.d, self.metric_type)
+        block.add(vectors)
+        blocks = list(self.blocks) + [block]
+        # Merge while the newest block is at least half the one before, so sizes halve from block to block
+        while len(blocks) > 1 and 2 * blocks[-1].ntotal >= blocks[-2].ntotal:
+            newest = blocks.pop()
+            merged = faiss.IndexFlat(self.d, self.metric_type)
+            merged.add(reconstruct_all(blocks[-1]))
+            merged.add(reconstruct_all(newest))
+            blocks[-1] = merged
+        
+        layered = self._layered(self.base, blocks, self.mapped, self.live)
+        if fold and layered.delta_size > max(self.min_fold, self.fold_ratio * self.base_size):
+            return layered.flattened()
+        return layered
+    
+    def without(self, positions: np.ndarray) -> "LayeredIndex":
+        """Index with the rows at positions removed and later rows shifted down; this one is not changed.
+        
+        Base rows are only masked out, so the base is neither copied nor retrained;
+        the small blocks are rebuilt without theirs.
+        """
+        positions = np.asarray(positions, dtype='int64')
+        in_base = positions[positions < self.base_size]
+        in_blocks = positions[positions >= self.base_size] - self.base_size
+        
+        live = self.live
+        if len(in_base):
+            live = np.ones(self.base.ntotal, dtype=bool) if self.live is None else np.array(self.live)
+            live[np.flatnonzero(live)[in_base]] = False
+        
+        blocks = self.blocks
+        if len(in_blocks):
+            vectors = np.concatenate([reconstruct_all(block) for block in self.blocks])
+            keep = np.ones(len(vectors), dtype=bool)
+            keep[in_blocks] = False
+            block = faiss.IndexFlat(self.d, self.metric_type)
+            block.add(vectors[keep])
+            blocks = (block,) if block.ntotal else ()
+        return self._layered(self.base, blocks, self.mapped, live)
+    
+    def _base_copy(self) -> faiss.Index:
+        """Owned copy of the base, removed rows included"""
+        if self.mapped:
+            # clone_index would keep viewing the pages of a memory-mapped base, which
+            # cannot grow; a serialization round trip always yields an owned copy
+            return faiss.deserialize_index(faiss.serialize_index(self.base))
+        return faiss.clone_index(self.base)
+    
+    def flattened(self) -> "LayeredIndex":
+        """Same rows with the blocks added to an owned copy of the base; removed rows stay masked"""
+        index = self._base_copy()
+        for block in self.blocks:
+            index.add(reconstruct_all(block))
+        live = self.live
+        if live is not None:
+            live = np.concatenate([live, np.ones(index.ntotal - len(live), dtype=bool)])
+        return self._layered(index, (), False, live)
+    
+    def purged(self) -> faiss.Index:
+        """Plain FAISS index holding only the live rows, in row order.
+        
+        Surviving rows keep their stored codes and the trained quantizers are reused,
+        so no vector is ever compressed a second time; appended rows are encoded from
+        their exact float32 blocks. Can cost as much as building the search structure,
+        so the store runs it in the background.
+        """
+        index = self._base_copy()
+        if self.live is not None:
+            live = np.asarray(self.live)
+            ivf = faiss.try_extract_index_ivf(index)
+            if isinstance(index, faiss.IndexHNSW):
+                # The graph cannot drop nodes, so it is rebuilt over the live rows; encoding
+                # decoded vectors with the same trained codec gives back the same codes
+                vectors = reconstruct_rows(self.base, np.flatnonzero(live))
+                index.reset()
+                index.add(vectors)
+            elif ivf is not None:
+                _keep_list_entries(faiss.extract_index_ivf(self.base), ivf, live, self._row_map())
+                index.ntotal = ivf.ntotal
+            else:
+                # Flat codes are compacted in place, in order
+                index.remove_ids(np.flatnonzero(~live).astype('int64'))
+        for block in self.blocks:
+            index.add(reconstruct_all(block))
+        return index
+    
+    def _row_map(self) -> np.ndarray:
+        """Row number of each base row (that of the next live row for removed ones)"""
+        if self._row_of is None:
+            self._row_of = np.cumsum(self.live, dtype='int64') - 1
+        return self._row_of
+    
+    def _search_base(self, x: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Search the base for its k nearest live rows, labelled with row numbers"""
+        if self.live is None:
+            return self.base.search(x, k)
+        if self._selector is None:
+            bitmap = np.packbits(self.live, bitorder="little")
+            self._selector = (bitmap, faiss.IDSelectorBitmap(len(self.live), faiss.swig_ptr(bitmap)))
+        selector = self._selector[1]
+        
+        # efSearch and nprobe are read now, as set_search_params may change them in place
+        ivf = faiss.try_extract_index_ivf(self.base)
+        if isinstance(self.base, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW(sel=selector, efSearch=self.base.hnsw.efSearch)
+        elif ivf is not None:
+            params = faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+        elif not isinstance(faiss.downcast_index(self.base), faiss.IndexPQ):
+            params = faiss.SearchParameters(sel=selector)
+        else:
+            params = None
+        
+        if params is not None:
+            distances, labels = self.base.search(x, k, params=params)
+        else:
+            # IndexPQ takes no search parameters: fetch enough to fill k after dropping removed rows
+            distances, labels = self.base.search(x, min(k + self.removed, self.base.ntotal))
+            dead = (labels < 0) | ~self.live[np.maximum(labels, 0)]
+            order = np.argsort(dead, axis=1, kind="stable")[:, :k]
+            distances, labels = np.take_along_axis(distances, order, axis=1), np.take_along_axis(labels, order, axis=1)
+            labels[np.take_along_axis(dead, order, axis=1)] = -1
+        return distances, np.where(labels >= 0, self._row_map()[np.maximum(labels, 0)], -1)
+    
+    def search(self, x: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(distances, rows) of the k nearest rows across the base and the blocks, as faiss.Index.search"""
+        if not self.blocks:
+            return self._search_base(x, k)
+        higher_is_better = self.metric_type == faiss.METRIC_INNER_PRODUCT
+        distances, labels = [], []
+        offset = 0
+        for i, index in enumerate((self.base,) + self.blocks):
+            size = self.base_size if i == 0 else index.ntotal
+            if size:
+                if i == 0:
+                    part_distances, part_labels = self._search_base(x, min(k, size))
+                else:
+                    part_distances, part_labels = index.search(x, min(k, size))
+                distances.append(part_distances)
+                labels.append(np.where(part_labels >= 0, part_labels + offset, -1))
+            offset += size
+        # Pad so there are k columns even when the layers hold fewer rows, as FAISS does
+        worst = np.finfo('float32').min if higher_is_better else np.finfo('float32').max
+        distances.append(np.full((len(x), k), worst, dtype='float32'))
+        labels.append(np.full((len(x), k), -1, dtype='int64'))
+        distances, labels = np.concatenate(distances, axis=1), np.concatenate(labels, axis=1)
+        order = np.argsort(-distances if higher_is_better else distances, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(labels, order, axis=1)
+    
+    def reconstruct_n(self, start: int, n: int) -> np.ndarray:
+        """Stored vectors of rows [start, start + n) (approximate for a compressed base)"""
+        parts = []
+        offset = 0
+        for i, index in enumerate((self.base,) + self.blocks):
+            size = self.base_size if i == 0 else index.ntotal
+            lo, hi = max(start, offset), min(start + n, offset + size)
+            if lo < hi:
+                if i == 0 and self.live is not None:
+                    parts.append(reconstruct_rows(index, np.flatnonzero(self.live)[lo:hi]))
+                else:
+                    parts.append(reconstruct_range(index, lo - offset, hi - lo))
+            offset += size
+        return np.concatenate(parts) if parts else np.zeros((0, self.d), dtype='float32')
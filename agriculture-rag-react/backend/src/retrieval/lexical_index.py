@@ -0,0 +1,262 @@
+import io
+import json
+import math
+import os
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter
+from itertools import chain
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from src.retrieval.persistence import atomic_write_bytes
+
+# Words, numbers and hyphenated or dotted codes such as "co-51", "2,4-d" or "v1.2";
+# compound tokens are indexed both whole and split into their parts
+_TOKEN_RE = re.compile(r"\w+(?:[-./,]\w+)*")
+_SPLIT_RE = re.compile(r"[-./,]")
+_STOPWORDS = frozenset("""
+a an and are as at be but by for from has have in is it its of on or that the this to was were will with
+""".split())
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms of a text, stopwords removed"""
+    terms = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        terms.append(token)
+        if _SPLIT_RE.search(token):
+            terms.extend(part for part in _SPLIT_RE.split(token) if part and part not in _STOPWORDS)
+    return terms
+
+class _Delta:
+    """Postings added since the last merge, term -> (rows, tfs), appended in row order.
+    
+    Shared by an index and its snapshots; end is the row count the newest of them appended up to.
+    """
+    __slots__ = ("postings", "end")
+    
+    def __init__(self, end: int):
+        self.postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        self.end = end
+
+class LexicalIndex:
+    """BM25 inverted index over the text chunks, row-aligned with the text FAISS index.
+    
+    Postings live in CSR form: for term id t, rows ``doc_ids[indptr[t]:indptr[t+1]]``
+    with term frequencies ``tfs[...]``. New chunks go into a small dict-based delta
+    that is folded into the CSR arrays once it grows past a fraction of them, so
+    ingestion never rewrites the whole index. Removal compacts row numbers the same
+    way a flat FAISS index and the MetadataStore do.
+    
+    Snapshots share everything: the CSR arrays and vocabulary are replaced, never
+    written, and the delta lists and document lengths are only appended to, with
+    each index reading no further than its own row count.
+    """
+    ARRAYS = ("indptr", "doc_ids", "tfs", "doc_len")
+    FILE_SUFFIXES = [f".{name}.npy" for name in ARRAYS] + [".vocab.json"]
+    
+    def __init__(self, k1: float = 1.2, b: float = 0.75, delta_ratio: float = 0.1,
+                 min_delta_postings: int = 50000):
+        self.k1 = k1
+        self.b = b
+        self.delta_ratio = delta_ratio
+        self.min_delta_postings = min_delta_postings
+        self._vocab: Dict[str, int] = {}
+        self._indptr = np.zeros(1, dtype='int64')
+        self._doc_ids = np.zeros(0, dtype='int32')
+        self._tfs = np.zeros(0, dtype='float32')
+        self._doc_len = np.zeros(0, dtype='float32')  # Per row, with spare capacity past _n_docs
+        self._n_docs = 0
+        self._delta = _Delta(0)
+        self._delta_postings = 0  # Delta postings within this index's rows
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return self._n_docs
+    
+    @property
+    def num_terms(self) -> int:
+        return len(set(self._vocab) | {term for term, _, _ in self._delta_items()})
+    
+    def add(self, texts: List[str], merge: bool = True):
+        """Index texts as the next rows
+        
+        Without merge the delta is left to grow, so memory-mapped postings are not copied.
+        """
+        with self._lock:
+            start = self._n_docs
+            if self._delta.end != start:
+                self._detach()
+            self._delta.end = start + len(texts)
+            if self._delta.end > len(self._doc_len):
+                doc_len = np.empty(max(2 * len(self._doc_len), self._delta.end, 1024), dtype='float32')
+                doc_len[:start] = self._doc_len[:start]
+                self._doc_len = doc_len
+            
+            postings = self._delta.postings
+            for i, text in enumerate(texts):
+                counts = Counter(tokenize(text))
+                self._doc_len[start + i] = sum(counts.values())
+                for term, tf in counts.items():
+                    rows, tfs = postings.setdefault(term, ([], []))
+                    rows.append(start + i)
+                    tfs.append(tf)
+                self._delta_postings += len(counts)
+            self._n_docs = self._delta.end
+            if merge and self._delta_postings > max(self.min_delta_postings, self.delta_ratio * len(self._doc_ids)):
+                self._merge()
+    
+    def _detach(self):
+        """Stop sharing the delta and document lengths, keeping only this index's rows (caller holds the lock)
+        
+        Needed when another index sharing them appended past this one's rows, e.g. a discarded draft.
+        """
+        delta = _Delta(self._n_docs)
+        for term, rows, tfs in self._delta_items():
+            delta.postings[term] = (rows, tfs)
+        self._delta = delta
+        self._doc_len = np.array(self._doc_len[:self._n_docs])
+    
+    def remove(self, positions: np.ndarray):
+        """Drop rows; later rows shift down"""
+        with self._lock:
+            self._merge()
+            keep = np.ones(self._n_docs, dtype=bool)
+            keep[np.asarray(positions, dtype='int64')] = False
+            new_row = (np.cumsum(keep) - 1).astype('int32')
+            term_ids = self._term_ids()
+            mask = keep[self._doc_ids]
+            self._doc_ids = new_row[self._doc_ids[mask]]
+            self._tfs = self._tfs[mask]
+            self._indptr = self._indptr_for(term_ids[mask], len(self._vocab))
+            self._doc_len = self._doc_len[:self._n_docs][keep]
+            self._n_docs = len(self._doc_len)
+            self._delta = _Delta(self._n_docs)
+    
+    def _term_ids(self) -> np.ndarray:
+        """Term id of every posting"""
+        return np.repeat(np.arange(len(self._vocab), dtype='int32'), np.diff(self._indptr))
+    
+    @staticmethod
+    def _indptr_for(term_ids: np.ndarray, num_terms: int) -> np.ndarray:
+        indptr = np.zeros(num_terms + 1, dtype='int64')
+        np.cumsum(np.bincount(term_ids, minlength=num_terms), out=indptr[1:])
+        return indptr
+    
+    def _delta_items(self) -> List[Tuple[str, List[int], List[int]]]:
+        """(term, rows, tfs) of every delta postings list, cut to this index's rows"""
+        items = []
+        for term, (rows, tfs) in list(self._delta.postings.items()):
+            end = bisect_left(rows, self._n_docs)
+            if end:
+                items.append((term, rows[:end], tfs[:end]))
+        return items
+    
+    def _merged(self) -> Tuple[Dict[str, int], np.ndarray, np.ndarray, np.ndarray]:
+        """Vocabulary, indptr, doc_ids and tfs with the delta folded in; this index is not changed"""
+        items = self._delta_items()
+        if not items:
+            return self._vocab, self._indptr, self._doc_ids, self._tfs
+        old_term_ids = self._term_ids()
+        vocab = dict(self._vocab)  # Snapshots share the old one
+        delta_ids = np.array([vocab.setdefault(term, len(vocab)) for term, _, _ in items], dtype='int32')
+        n_postings = sum(len(rows) for _, rows, _ in items)
+        delta_rows = np.fromiter(chain.from_iterable(rows for _, rows, _ in items), dtype='int32', count=n_postings)
+        delta_tfs = np.fromiter(chain.from_iterable(tfs for _, _, tfs in items), dtype='float32', count=n_postings)
+        delta_terms = np.repeat(delta_ids, [len(rows) for _, rows, _ in items])
+        
+        # Delta rows are all newer than existing ones, so a stable sort by term
+        # keeps every postings list sorted by row
+        term_ids = np.concatenate([old_term_ids, delta_terms])
+        order = np.argsort(term_ids, kind="stable")
+        doc_ids = np.concatenate([self._doc_ids, delta_rows])[order]
+        tfs = np.concatenate([self._tfs, delta_tfs])[order]
+        return vocab, self._indptr_for(term_ids, len(vocab)), doc_ids, tfs
+    
+    def _merge(self):
+        """Fold the delta into the CSR arrays (caller holds the lock)"""
+        self._vocab, self._indptr, self._doc_ids, self._tfs = self._merged()
+        self._delta = _Delta(self._n_docs)
+        self._delta_postings = 0
+    
+    def _postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows and term frequencies of a term, including the delta (caller holds the lock)"""
+        rows = np.zeros(0, dtype='int32')
+        tfs = np.zeros(0, dtype='float32')
+        term_id = self._vocab.get(term)
+        if term_id is not None:
+            start, end = self._indptr[term_id], self._indptr[term_id + 1]
+            rows, tfs = self._doc_ids[start:end], self._tfs[start:end]
+        delta = self._delta.postings.get(term)
+        end = bisect_left(delta[0], self._n_docs) if delta else 0
+        if end:
+            rows = np.concatenate([rows, np.asarray(delta[0][:end], dtype='int32')])
+            tfs = np.concatenate([tfs, np.asarray(delta[1][:end], dtype='float32')])
+        return rows, tfs
+    
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """Top-k (row, BM25 score) pairs for a query, best first"""
+        terms = set(tokenize(query))
+        with self._lock:
+            postings = [self._postings(term) for term in terms]
+            doc_len = self._doc_len[:self._n_docs]
+        n_docs = len(doc_len)
+        postings = [(rows, tfs) for rows, tfs in postings if len(rows)]
+        if not postings or n_docs == 0:
+            return []
+        
+        avg_len = max(float(doc_len.mean()), 1.0)
+        scores = np.zeros(n_docs, dtype='float32')
+        for rows, tfs in postings:
+            idf = math.log(1.0 + (n_docs - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * doc_len[rows] / avg_len)
+            # Rows are unique within a postings list, so fancy-index += is safe
+            scores[rows] += idf * tfs * (self.k1 + 1.0) / (tfs + norm)
+        
+        candidates = np.unique(np.concatenate([rows for rows, _ in postings]))
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(row), float(scores[row])) for row in candidates]
+    
+    def snapshot(self) -> "LexicalIndex":
+        """Index that later changes to this one do not affect, sharing all of its rows"""
+        with self._lock:
+            copy = LexicalIndex(self.k1, self.b, self.delta_ratio, self.min_delta_postings)
+            # Merges and removals replace the vocabulary and arrays rather than writing into them
+            copy._vocab, copy._indptr, copy._doc_ids, copy._tfs = self._vocab, self._indptr, self._doc_ids, self._tfs
+            copy._doc_len, copy._n_docs = self._doc_len, self._n_docs
+            copy._delta, copy._delta_postings = self._delta, self._delta_postings
+            return copy
+    
+    def save(self, prefix: str):
+        """Write postings arrays and vocabulary, each via fsynced temp file and rename"""
+        with self._lock:
+            vocab, indptr, doc_ids, tfs = self._merged()
+            arrays = {"indptr": indptr, "doc_ids": doc_ids, "tfs": tfs, "doc_len": self._doc_len[:self._n_docs]}
+            vocab = sorted(vocab, key=vocab.get)
+        for name, array in arrays.items():
+            buffer = io.BytesIO()
+            np.save(buffer, np.ascontiguousarray(array))
+            atomic_write_bytes(f"{prefix}.{name}.npy", buffer.getvalue())
+        atomic_write_bytes(f"{prefix}.vocab.json", json.dumps(vocab, ensure_ascii=False).encode("utf-8"))
+    
+    @classmethod
+    def load(cls, prefix: str, mmap: bool = True, **kwargs) -> Optional["LexicalIndex"]:
+        """Load a saved index, or None if it was never written.
+        
+        Postings are memory-mapped read-only by default, so worker processes
+        share one copy; merges and removals build new arrays and never write to them.
+        """
+        if not all(os.path.exists(f"{prefix}{suffix}") for suffix in cls.FILE_SUFFIXES):
+            return None
+        index = cls(**kwargs)
+        for name in cls.ARRAYS:
+            setattr(index, f"_{name}", np.load(f"{prefix}.{name}.npy", mmap_mode="r" if mmap else None))
+        index._n_docs = len(index._doc_len)
+        index._delta = _Delta(index._n_docs)
+        with open(f"{prefix}.vocab.json", "r", encoding="utf-8") as f:
+            index._vocab = {term: term_id for term_id, term in enumerate(json.load(f))}
+        return index
@@ -0,0 +1,196 @@
+import json
+import mmap
+import os
+from typing import Dict, Iterator, List, Optional
+import numpy as np
+from src.retrieval.persistence import fsync_dir
+
+# Keys that never belong in the metadata store: FAISS already holds the vectors
+# and images live on disk, referenced by image_path
+_HEAVY_KEYS = ("embedding", "image")
+
+class MetadataStore:
+    """Append-only store of per-vector metadata records.
+    
+    Records are compact JSON blobs kept in one data file with an offsets array
+    beside it. A loaded store memory-maps both and decodes a record only when
+    it is looked up. The doc_id of every row is also kept as a separate
+    dictionary-encoded column, so removing a document never decodes records.
+    
+    Snapshots share the appended records too: lists and doc_id codes are only
+    ever appended to, and each store reads no further than its own length.
+    Removing rows keeps referencing the persisted records through a row map.
+    """
+    FILE_SUFFIXES = [".data", ".offsets.npy", ".docs.npy", ".docs.json"]
+    
+    def __init__(self):
+        self._data = b""                          # mmap of the persisted records, or bytes
+        self._offsets = np.zeros(1, dtype='int64')  # Start of each persisted record, plus end
+        self._codes = np.zeros(0, dtype='int32')    # doc_id code per persisted row
+        self._rows = None                           # Persisted record of each persisted row, None if all in order
+        self._tail = []                           # Encoded records appended since load, possibly shared
+        self._tail_codes = []
+        self._tail_count = 0                      # Entries of _tail that belong to this store
+        self._doc_ids = []                        # doc_id per code
+        self._doc_codes = {}                      # doc_id -> code
+    
+    @staticmethod
+    def to_record(item: Dict) -> Dict:
+        """Strip embeddings and live images from an item before it is stored"""
+        return {key: value for key, value in item.items() if key not in _HEAVY_KEYS}
+    
+    @staticmethod
+    def _encode(record: Dict) -> bytes:
+        return json.dumps(record, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+    
+    def _code_for(self, doc_id: Optional[str]) -> int:
+        if doc_id is None:
+            return -1
+        code = self._doc_codes.get(doc_id)
+        if code is None:
+            code = len(self._doc_ids)
+            self._doc_ids.append(doc_id)
+            self._doc_codes[doc_id] = code
+        return code
+    
+    @property
+    def _base_count(self) -> int:
+        return len(self._offsets) - 1 if self._rows is None else len(self._rows)
+    
+    def __len__(self) -> int:
+        return self._base_count + self._tail_count
+    
+    def encoded(self, i: int) -> bytes:
+        """Raw encoded record at row i"""
+        if i < 0:
+            i += len(self)
+        if i < self._base_count:
+            if self._rows is not None:
+                i = self._rows[i]
+            return self._data[self._offsets[i]:self._offsets[i + 1]]
+        if i >= len(self):
+            raise IndexError(i)
+        return self._tail[i - self._base_count]
+    
+    def __getitem__(self, i: int) -> Dict:
+        return json.loads(self.encoded(i))
+    
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self)):
+            yield self[i]
+    
+    def extend(self, records: List[Dict]):
+        """Append records (already stripped with to_record)"""
+        if len(self._tail) != self._tail_count:
+            # A store sharing the lists appended past this one (e.g. a discarded draft); stop sharing
+            self._tail = self._tail[:self._tail_count]
+            self._tail_codes = self._tail_codes[:self._tail_count]
+        for record in records:
+            self._tail.append(self._encode(record))
+            self._tail_codes.append(self._code_for(record.get("metadata", {}).get("doc_id")))
+            self._tail_count += 1
+    
+    def positions_for(self, doc_id: str) -> np.ndarray:
+        """Row numbers belonging to doc_id"""
+        code = self._doc_codes.get(doc_id)
+        if code is None:
+            return np.zeros(0, dtype='int64')
+        base = np.flatnonzero(np.asarray(self._codes) == code)
+        tail = [self._base_count + i for i, c in enumerate(self._tail_codes[:self._tail_count]) if c == code]
+        return np.concatenate([base, np.array(tail, dtype='int64')])
+    
+    def without(self, positions: np.ndarray) -> "MetadataStore":
+        """New store with the given rows removed; later rows shift down like a flat FAISS index
+        
+        Persisted records stay where they are, memory-mapped and shared; only the
+        row map and doc_id column of the persisted rows are rebuilt.
+        """
+        keep = np.ones(len(self), dtype=bool)
+        keep[np.asarray(positions, dtype='int64')] = False
+        keep_base = keep[:self._base_count]
+        store = self.snapshot()
+        rows = np.arange(self._base_count, dtype='int64') if self._rows is None else self._rows
+        store._rows = rows[keep_base]
+        store._codes = np.asarray(self._codes)[keep_base]
+        keep_tail = keep[self._base_count:].tolist()
+        store._tail = [blob for blob, kept in zip(self._tail, keep_tail) if kept]
+        store._tail_codes = [code for code, kept in zip(self._tail_codes, keep_tail) if kept]
+        store._tail_count = len(store._tail)
+        return store
+    
+    def snapshot(self) -> "MetadataStore":
+        """Store that later appends to this one do not affect, sharing all of its records"""
+        store = MetadataStore()
+        store._data = self._data
+        store._offsets = self._offsets
+        store._codes = self._codes
+        store._rows = self._rows
+        store._tail = self._tail
+        store._tail_codes = self._tail_codes
+        store._tail_count = self._tail_count
+        # Codes of doc_ids only this store's rows use are harmless to the other
+        store._doc_ids = self._doc_ids
+        store._doc_codes = self._doc_codes
+        return store
+    
+    def save(self, prefix: str):
+        """Write data, offsets and doc_id column files, each via fsynced temp file and rename"""
+        offsets = np.empty(len(self) + 1, dtype='int64')
+        if self._rows is None:
+            offsets[:self._base_count + 1] = self._offsets
+            runs = [(0, self._base_count)]
+        else:
+            lengths = self._offsets[self._rows + 1] - self._offsets[self._rows]
+            offsets[0] = 0
+            np.cumsum(lengths, out=offsets[1:self._base_count + 1])
+            # Kept records are written run by run of consecutive persisted records
+            breaks = np.flatnonzero(np.diff(self._rows) != 1) + 1
+            runs = [(int(run[0]), int(run[-1]) + 1) for run in np.split(self._rows, breaks) if len(run)]
+        position = int(offsets[self._base_count])
+        tail = self._tail[:self._tail_count]
+        for i, blob in enumerate(tail):
+            position += len(blob)
+            offsets[self._base_count + 1 + i] = position
+        codes = np.concatenate([np.asarray(self._codes),
+                                np.array(self._tail_codes[:self._tail_count], dtype='int32')]).astype('int32')
+        
+        def write(path, writer):
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                writer(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        
+        def write_data(f):
+            for start, end in runs:
+                f.write(self._data[int(self._offsets[start]):int(self._offsets[end])])
+            for blob in tail:
+                f.write(blob)
+        
+        write(f"{prefix}.data", write_data)
+        write(f"{prefix}.offsets.npy", lambda f: np.save(f, offsets))
+        write(f"{prefix}.docs.npy", lambda f: np.save(f, codes))
+        write(f"{prefix}.docs.json", lambda f: f.write(json.dumps(self._doc_ids).encode("utf-8")))
+        fsync_dir(os.path.dirname(prefix))
+    
+    @classmethod
+    def load(cls, prefix: str) -> "MetadataStore":
+        """Open a saved store read-only through memory maps"""
+        store = cls()
+        with open(f"{prefix}.data", "rb") as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                store._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        store._offsets = np.load(f"{prefix}.offsets.npy", mmap_mode="r")
+        store._codes = np.load(f"{prefix}.docs.npy", mmap_mode="r")
+        with open(f"{prefix}.docs.json", "r", encoding="utf-8") as f:
+            store._doc_ids = json.load(f)
+        store._doc_codes = {doc_id: code for code, doc_id in enumerate(store._doc_ids)}
+        return store
+    
+    @classmethod
+    def from_items(cls, items: List[Dict]) -> "MetadataStore":
+        """Build a store from full items, as found in older pickled metadata"""
+        store = cls()
+        store.extend([cls.to_record(item) for item in items])
+        return store
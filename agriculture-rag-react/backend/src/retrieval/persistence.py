@@ -0,0 +1,152 @@
+"""On-disk layout helpers for the vector store.
+
+A store saved under ``base_path`` consists of
+
+* ``{base_path}_manifest.json`` - which base snapshot is current and the last
+  journal sequence number folded into it,
+* ``{base_path}_g{generation}_*`` - the base snapshot files,
+* ``{base_path}_journal/{seq}.seg`` - append-only segments of changes made
+  after the snapshot, replayed in order on load,
+* ``{base_path}.lock`` - advisory lock shared by every process using the store.
+
+Every file is written to a temporary name, fsynced and renamed into place, so
+readers only ever see complete files.
+"""
+import json
+import os
+import pickle
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+from src.utils.logger import get_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process serving only
+    fcntl = None
+
+logger = get_logger(__name__)
+
+SEGMENT_SUFFIX = ".seg"
+
+def fsync_dir(path: str):
+    """Flush a directory entry so a rename inside it survives a crash"""
+    try:
+        fd = os.open(path or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def atomic_write_bytes(path: str, data: bytes):
+    """Write data to path via fsynced temp file and rename"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_dir(os.path.dirname(path))
+
+@contextmanager
+def store_lock(base_path: str, shared: bool = False, blocking: bool = True):
+    """Hold the store's file lock: exclusive for writers, shared for readers catching up.
+    
+    Yields whether the lock was acquired, which is always True when blocking.
+    The lock is per open file, so it also excludes other threads of this process.
+    """
+    if fcntl is None:
+        yield True
+        return
+    
+    os.makedirs(os.path.dirname(base_path) or ".", exist_ok=True)
+    fd = os.open(f"{base_path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(fd, flags)
+            acquired = True
+        except BlockingIOError:
+            acquired = False
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+def manifest_path(base_path: str) -> str:
+    return f"{base_path}_manifest.json"
+
+def base_file(base_path: str, generation: int, name: str) -> str:
+    """Path of one file of a base snapshot, e.g. name='text.faiss'"""
+    return f"{base_path}_g{generation}_{name}"
+
+def journal_dir(base_path: str) -> str:
+    return f"{base_path}_journal"
+
+def read_manifest(base_path: str) -> Optional[Dict]:
+    """Current manifest, or None for a store that has never been saved in this format"""
+    path = manifest_path(base_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def write_manifest(base_path: str, manifest: Dict):
+    atomic_write_bytes(manifest_path(base_path), json.dumps(manifest, indent=2).encode("utf-8"))
+
+def list_segments(base_path: str, after_seq: int = 0) -> List[Tuple[int, str]]:
+    """Journal segments with a sequence number above after_seq, oldest first"""
+    directory = journal_dir(base_path)
+    if not os.path.isdir(directory):
+        return []
+    segments = []
+    for name in os.listdir(directory):
+        if not name.endswith(SEGMENT_SUFFIX):
+            continue  # Ignores half-written .tmp files
+        try:
+            seq = int(name[:-len(SEGMENT_SUFFIX)])
+        except ValueError:
+            continue
+        if seq > after_seq:
+            segments.append((seq, os.path.join(directory, name)))
+    return sorted(segments)
+
+def append_segment(base_path: str, seq: int, ops: List[Dict]) -> str:
+    """Durably write one journal segment holding a list of operations"""
+    directory = journal_dir(base_path)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{seq:010d}{SEGMENT_SUFFIX}")
+    atomic_write_bytes(path, pickle.dumps(ops, protocol=pickle.HIGHEST_PROTOCOL))
+    return path
+
+def read_segment(path: str) -> List[Dict]:
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+def remove_segments_through(base_path: str, seq: int):
+    """Delete segments already folded into a base snapshot"""
+    for segment_seq, path in list_segments(base_path):
+        if segment_seq > seq:
+            break
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"Could not remove journal segment {path}: {str(e)}")
+
+def remove_generation(base_path: str, generation: int, names: List[str]):
+    """Delete the files of a superseded base snapshot"""
+    for name in names:
+        path = base_file(base_path, generation, name)
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not remove old snapshot file {path}: {str(e)}")
@@ -1,17 +1,42 @@
-from typing import Dict, List, Optional, Any
-from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
-from langchain_openai import OpenAI  # Updated import
+import asyncio
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Any, Iterator
+from langchain_core.prompts import PromptTemplate
 from src.utils.logger import get_logger
-import numpy as np
-from langchain_community.vectorstores import FAISS
+from src.utils.event_loop import BackgroundEventLoop
+from src.utils.startup import timed
+from src.utils.metrics import REGISTRY, observe_stage, stage
 from langchain_core.retrievers import BaseRetriever
 from langchain_core.documents import Document
-from langchain_core.callbacks import CallbackManagerForRetrieverRun
-from typing import Any
+from langchain_core.callbacks import BaseCallbackHandler, CallbackManagerForRetrieverRun
 
 logger = get_logger(__name__)
 
+CHAT_RESPONSES = REGISTRY.counter("chat_responses_total", "Chat answers by where they came from", ["source"])
+LLM_IN_FLIGHT = REGISTRY.gauge("llm_requests_in_flight", "LLM calls currently waiting for a completion")
+
+class _ChainStageTimer(BaseCallbackHandler):
+    """Splits a RetrievalQA call into prompt assembly and the LLM call (retrieval times itself)"""
+    run_inline = True  # Timestamps must be taken as the events happen, not from a thread pool
+    
+    def __init__(self):
+        self._retrieved_at = None
+        self._llm_started_at = None
+    
+    def on_retriever_end(self, documents, **kwargs):
+        self._retrieved_at = time.perf_counter()
+    
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._llm_started_at = time.perf_counter()
+        if self._retrieved_at is not None:
+            observe_stage("chat", "prompt", self._llm_started_at - self._retrieved_at)
+    
+    def on_llm_end(self, response, **kwargs):
+        if self._llm_started_at is not None:
+            observe_stage("chat", "llm", time.perf_counter() - self._llm_started_at)
+
 class VectorStoreRetriever(BaseRetriever):
     """Fixed retriever implementation with proper attribute access"""
     def __init__(self, vector_store, text_embedder):
@@ -21,8 +46,15 @@ class VectorStoreRetriever(BaseRetriever):
         
     def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
         try:
-            query_embedding = self._text_embedder.embed_text(query)
-            results = self._vector_store.search_texts(query_embedding, k=3)
+            from config import Config
+            with stage("chat", "embed_query"):
+                query_embedding = self._text_embedder.embed_text(query)
+            with stage("chat", "search"):
+                if Config.HYBRID_SEARCH_ENABLED:
+                    # BM25 catches exact terms (pesticide, scheme and variety names) MiniLM misses
+                    results = self._vector_store.search_texts_hybrid(query, query_embedding, k=3)
+                else:
+                    results = self._vector_store.search_texts(query_embedding, k=3)
             
             return [
                 Document(
@@ -36,7 +68,7 @@ class VectorStoreRetriever(BaseRetriever):
             return []
 
 class RAGPipeline:
-    def __init__(self, vector_store, text_embedder, llm=None):
+    def __init__(self, vector_store, text_embedder, llm=None, response_cache=None, image_embedder=None):
         """
         Initialize the RAG pipeline
         
@@ -44,22 +76,69 @@ class RAGPipeline:
             vector_store: Initialized vector store instance
             text_embedder: Initialized text embedder instance
             llm: Optional pre-initialized LLM instance
+            response_cache: Optional ResponseCache for repeated and near-duplicate questions
+            image_embedder: Optional CLIP embedder, enables figure retrieval alongside text
         """
         self._vector_store = vector_store
         self._text_embedder = text_embedder
-        self._llm = llm or self._initialize_llm()
+        self._response_cache = response_cache
+        self._image_embedder = image_embedder
+        self._llm = llm
         self._prompt = self._create_prompt()
+        self._retriever = VectorStoreRetriever(
+            vector_store=self._vector_store,
+            text_embedder=self._text_embedder
+        )
+        self._qa_chain = None  # Built on first use or by load()
+        self._load_lock = threading.Lock()
+        
+        # All LLM calls run on one background loop so they share the pooled
+        # async client; the semaphore caps requests in flight per process
+        from config import Config
+        self._event_loop = BackgroundEventLoop(name="rag-llm")
+        self._max_concurrency = Config.LLM_MAX_CONCURRENCY
+        self._llm_slots = None
+    
+    def load(self) -> "RAGPipeline":
+        """Set up the LLM client and QA chain now instead of on first use.
+        
+        Built once: the retriever reads the vector store at call time, so the
+        chain stays valid as documents are added or removed.
+        """
+        with self._load_lock:
+            if self._qa_chain is None:
+                with timed("Built QA chain"):
+                    from langchain.chains import RetrievalQA
+                    if self._llm is None:
+                        self._llm = self._initialize_llm()
+                    self._qa_chain = RetrievalQA.from_chain_type(
+                        llm=self._llm,
+                        chain_type="stuff",
+                        retriever=self._retriever,
+                        chain_type_kwargs={"prompt": self._prompt},
+                        return_source_documents=True
+                    )
+        return self
     
     def _initialize_llm(self):
         """Initialize the LLM with configuration from config.py"""
+        import httpx
+        from langchain_openai import OpenAI
         from config import Config
+        limits = httpx.Limits(
+            max_connections=Config.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.LLM_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=Config.LLM_KEEPALIVE_EXPIRY
+        )
         return OpenAI(
             model=Config.LLM_MODEL,
             temperature=Config.LLM_TEMPERATURE,
             openai_api_base=Config.LLM_BASE_URL,
             openai_api_key=Config.LLM_API_KEY,
             max_retries=3,
-            timeout=30
+            timeout=Config.LLM_TIMEOUT,
+            http_client=httpx.Client(limits=limits, timeout=Config.LLM_TIMEOUT),
+            http_async_client=httpx.AsyncClient(limits=limits, timeout=Config.LLM_TIMEOUT)
         )
     
     def _create_prompt(self) -> PromptTemplate:
@@ -166,52 +245,194 @@ class RAGPipeline:
         """Retrieve relevant documents for a query"""
         try:
             query_embedding = text_embedder.embed_text(query)
-            results = self.vector_store.search_texts(query_embedding, k)
+            results = self._vector_store.search_texts(query_embedding, k)
             return results
         except Exception as e:
             logger.error(f"Error retrieving documents: {str(e)}")
             return []
     
-    def generate_response(self, query: str) -> Dict[str, Any]:
-        """Generate response with proper error handling"""
+    def generate_response(self, query: str, include_images: bool = False) -> Dict[str, Any]:
+        """Generate response, serving repeated questions from the response cache.
+        
+        With include_images, matching figures are retrieved concurrently and
+        returned under "images". Blocks the calling thread; the work itself runs
+        on the pipeline's event loop.
+        """
+        return self._event_loop.run(self._agenerate_response(query, include_images))
+    
+    async def agenerate_response(self, query: str, include_images: bool = False) -> Dict[str, Any]:
+        """Async version of generate_response, usable from any event loop"""
+        return await self._event_loop.run_async(self._agenerate_response(query, include_images))
+    
+    async def _agenerate_response(self, query: str, include_images: bool) -> Dict[str, Any]:
+        if not include_images or self._image_embedder is None:
+            return await self._agenerate_text_response(query)
+        
+        response, images = await asyncio.gather(
+            self._agenerate_text_response(query),
+            asyncio.to_thread(self.search_images, query)
+        )
+        return {**response, "images": images}
+    
+    async def _agenerate_text_response(self, query: str) -> Dict[str, Any]:
+        """Runs on the pipeline loop; embedding and cache work go to the default executor"""
+        if self._response_cache is None:
+            return await self._acall_chain(query)
+        
+        store_version = self._vector_store.version
         try:
-            retriever = VectorStoreRetriever(
-                vector_store=self._vector_store,
-                text_embedder=self._text_embedder
-            )
-            
-            qa_chain = RetrievalQA.from_chain_type(
-                llm=self._llm,
-                chain_type="stuff",
-                retriever=retriever,
-                chain_type_kwargs={"prompt": self._prompt},
-                return_source_documents=True
+            cached = await asyncio.to_thread(self._lookup_cached, query, store_version)
+        except Exception as e:
+            logger.error(f"Response cache lookup failed: {str(e)}")
+            cached = None
+        if cached is not None:
+            CHAT_RESPONSES.inc(source="cache")
+            return {**cached, "cached": True}
+        
+        response = await self._acall_chain(query)
+        if not response.get("error"):
+            # embed_text is memoized, so this reuses the retrieval embedding
+            await asyncio.to_thread(
+                lambda: self._response_cache.store(query, response, store_version, self._text_embedder.embed_text(query))
             )
+        return response
+    
+    def _llm_slot(self) -> asyncio.Semaphore:
+        """Semaphore capping LLM requests in flight, streamed or not, at LLM_MAX_CONCURRENCY"""
+        loop = asyncio.get_running_loop()
+        if self._llm_slots is None or self._llm_slots[0] is not loop:
+            # One semaphore per loop; a forked child starts a fresh loop
+            self._llm_slots = (loop, asyncio.Semaphore(self._max_concurrency))
+        return self._llm_slots[1]
+    
+    async def _acall_chain(self, query: str) -> Dict[str, Any]:
+        """Run the shared QA chain with proper error handling"""
+        try:
+            if self._qa_chain is None:
+                # First use: importing langchain must not stall other calls on the loop
+                await asyncio.to_thread(self.load)
+            async with self._llm_slot():
+                with LLM_IN_FLIGHT.track_inprogress():
+                    result = await self._qa_chain.ainvoke({"query": query}, config={"callbacks": [_ChainStageTimer()]})
             
-            result = qa_chain.invoke({"query": query})
-            
-            return {
-                "answer": result["result"],
-                "source_documents": result["source_documents"],
-                "context": "\n\n".join([
-                    f"Page {doc.metadata['page_num']+1}: {doc.page_content[:200]}..."
-                    for doc in result["source_documents"]
-                ]) if result["source_documents"] else ""
-            }
+            CHAT_RESPONSES.inc(source="llm")
+            return self._build_response(result["result"], result["source_documents"])
             
         except Exception as e:
             logger.error(f"Error generating response: {str(e)}")
+            CHAT_RESPONSES.inc(source="error")
             return {
                 "answer": "I encountered an error processing your request.",
                 "source_documents": [],
-                "context": ""
+                "context": "",
+                "error": True
             }
     
-    def search_images(self, query: str, image_embedder, k: int = 3) -> List[Dict]:
+    def stream_response(self, query: str) -> Iterator[Dict[str, Any]]:
+        """Generate a response incrementally.
+        
+        Yields a "sources" event with the retrieved documents first, then one
+        "token" event per LLM chunk as it arrives, and finally a "done" event
+        with the full answer (or an "error" event). The completion streams on
+        the background loop and counts against LLM_MAX_CONCURRENCY like any
+        other LLM call.
+        """
+        store_version = self._vector_store.version
+        if self._response_cache is not None:
+            try:
+                cached = self._lookup_cached(query, store_version)
+            except Exception as e:
+                logger.error(f"Response cache lookup failed: {str(e)}")
+                cached = None
+            if cached is not None:
+                CHAT_RESPONSES.inc(source="cache")
+                yield {"event": "sources", "source_documents": cached["source_documents"]}
+                yield {"event": "token", "text": cached["answer"]}
+                yield {"event": "done", "answer": cached["answer"], "cached": True}
+                return
+        
+        try:
+            self.load()
+            source_documents = self._retriever.invoke(query)
+            yield {"event": "sources", "source_documents": source_documents}
+            
+            # Same prompt the "stuff" chain builds: documents joined by blank lines
+            with stage("chat", "prompt"):
+                prompt_text = self._prompt.format(
+                    context="\n\n".join(doc.page_content for doc in source_documents),
+                    question=query
+                )
+            parts = []
+            llm_started = time.perf_counter()
+            chunks = queue.Queue()
+            producer = self._event_loop.submit(self._astream_llm(prompt_text, chunks))
+            try:
+                while True:
+                    chunk = chunks.get()
+                    if chunk is None:
+                        break
+                    if isinstance(chunk, Exception):
+                        raise chunk
+                    text = getattr(chunk, "content", chunk)
+                    if text:
+                        if not parts:
+                            observe_stage("chat", "llm_first_token", time.perf_counter() - llm_started)
+                        parts.append(text)
+                        yield {"event": "token", "text": text}
+            finally:
+                # The client may have gone away: stop generating and give the slot back
+                producer.cancel()
+            observe_stage("chat", "llm", time.perf_counter() - llm_started)
+            CHAT_RESPONSES.inc(source="llm")
+            
+            answer = "".join(parts)
+            if self._response_cache is not None:
+                self._response_cache.store(query, self._build_response(answer, source_documents),
+                                           store_version, self._text_embedder.embed_text(query))
+            yield {"event": "done", "answer": answer, "cached": False}
+        
+        except Exception as e:
+            logger.error(f"Error streaming response: {str(e)}")
+            CHAT_RESPONSES.inc(source="error")
+            yield {"event": "error", "message": "I encountered an error processing your request."}
+    
+    async def _astream_llm(self, prompt_text: str, chunks: queue.Queue):
+        """Feed completion chunks into chunks under an LLM slot; None marks the end, an exception a failure"""
+        try:
+            async with self._llm_slot():
+                with LLM_IN_FLIGHT.track_inprogress():
+                    async for chunk in self._llm.astream(prompt_text):
+                        chunks.put(chunk)
+        except Exception as e:
+            chunks.put(e)
+        else:
+            chunks.put(None)
+    
+    def _lookup_cached(self, query: str, store_version: int) -> Optional[Dict[str, Any]]:
+        with stage("chat", "cache_lookup"):
+            return self._response_cache.lookup(query, store_version, embed_fn=self._text_embedder.embed_text)
+    
+    @staticmethod
+    def _build_response(answer: str, source_documents: List[Document]) -> Dict[str, Any]:
+        return {
+            "answer": answer,
+            "source_documents": source_documents,
+            "context": "\n\n".join([
+                f"Page {doc.metadata['page_num']+1}: {doc.page_content[:200]}..."
+                for doc in source_documents
+            ]) if source_documents else ""
+        }
+    
+    def search_images(self, query: str, image_embedder=None, k: Optional[int] = None) -> List[Dict]:
         """Search for relevant images using text query"""
+        from config import Config
+        image_embedder = image_embedder or self._image_embedder
         try:
             query_embedding = image_embedder.embed_text(query)
-            results = self.vector_store.search_images(query_embedding, k)
+            results = self._vector_store.search_images(query_embedding, k or Config.CHAT_IMAGE_K)
+            if self._vector_store.metric == "ip":
+                # Cosine scores: drop figures that only rank because something has to
+                results = [hit for hit in results if hit["score"] >= Config.IMAGE_MATCH_MIN_SCORE]
             return results
         except Exception as e:
             logger.error(f"Error searching images: {str(e)}")
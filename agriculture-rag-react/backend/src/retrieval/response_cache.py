@@ -0,0 +1,141 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+import numpy as np
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 3600, similarity_threshold: float = 0.95):
+        """
+        Cache of chat answers matched by normalized query text or query-embedding similarity
+        
+        Args:
+            max_entries: Entries kept before the least recently used one is evicted
+            ttl_seconds: Age after which an entry is no longer served
+            similarity_threshold: Minimum cosine similarity for a near-duplicate hit
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()  # normalized query -> entry, least recently used first
+        self._matrix = None            # (max_entries, d) unit-norm query embeddings, one row per slot
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        self._slot_keys = [None] * max_entries
+        self._store_version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Case-fold, collapse whitespace and drop trailing punctuation"""
+        query = re.sub(r'\s+', ' ', query.lower()).strip()
+        return query.rstrip(' ?!.')
+    
+    def lookup(self, query: str, store_version: int,
+               embed_fn: Optional[Callable[[str], np.ndarray]] = None) -> Optional[Dict[str, Any]]:
+        """Return a cached response for the query, trying an exact match before embedding similarity"""
+        key = self.normalize_query(query)
+        with self._lock:
+            self._check_version(store_version)
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry["response"]
+            if entry is not None:
+                self._drop(key)
+            if embed_fn is None or not self._entries:
+                self.misses += 1
+                return None
+        
+        # Embed outside the lock; the embedder may take a few milliseconds
+        embedding = self._unit(embed_fn(query))
+        with self._lock:
+            if store_version != self._store_version or not self._entries:
+                self.misses += 1
+                return None
+            similarities = self._matrix @ embedding
+            slot = int(np.argmax(similarities))
+            match_key = self._slot_keys[slot]
+            if match_key is not None and similarities[slot] >= self.similarity_threshold:
+                entry = self._entries[match_key]
+                if not self._expired(entry):
+                    self._entries.move_to_end(match_key)
+                    self.hits += 1
+                    self.semantic_hits += 1
+                    logger.debug(f"Semantic cache hit ({similarities[slot]:.3f}): '{query}' ~ '{match_key}'")
+                    return entry["response"]
+                self._drop(match_key)
+            self.misses += 1
+            return None
+    
+    def store(self, query: str, response: Dict[str, Any], store_version: int, query_embedding: np.ndarray):
+        """Cache a response computed against the given vector store version"""
+        key = self.normalize_query(query)
+        embedding = self._unit(query_embedding)
+        with self._lock:
+            self._check_version(store_version)
+            if key in self._entries:
+                self._drop(key)
+            if not self._free_slots:
+                self._drop(next(iter(self._entries)))
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, embedding.shape[0]), dtype='float32')
+            slot = self._free_slots.pop()
+            self._matrix[slot] = embedding
+            self._slot_keys[slot] = key
+            self._entries[key] = {
+                "response": response,
+                "slot": slot,
+                "created_at": time.time()
+            }
+    
+    def clear(self):
+        with self._lock:
+            self._clear()
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses
+            }
+    
+    def _check_version(self, store_version: int):
+        """Invalidate everything once the vector store has changed"""
+        if store_version != self._store_version:
+            if self._entries:
+                logger.info(f"Vector store changed (version {store_version}), clearing {len(self._entries)} cached answers")
+            self._clear()
+            self._store_version = store_version
+    
+    def _clear(self):
+        self._entries.clear()
+        self._free_slots = list(range(self.max_entries - 1, -1, -1))
+        self._slot_keys = [None] * self.max_entries
+        if self._matrix is not None:
+            self._matrix.fill(0)
+    
+    def _drop(self, key: str):
+        entry = self._entries.pop(key)
+        slot = entry["slot"]
+        self._matrix[slot] = 0
+        self._slot_keys[slot] = None
+        self._free_slots.append(slot)
+    
+    def _expired(self, entry: Dict) -> bool:
+        return time.time() - entry["created_at"] > self.ttl_seconds
+    
+    @staticmethod
+    def _unit(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype='float32').reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
@@ -1,165 +1,968 @@
 import faiss
+import io
 import numpy as np
 import os
 import pickle
+import threading
+import time
+from contextlib import contextmanager
 from typing import List, Dict, Optional
+from config import Config
+from src.retrieval import persistence
+from src.retrieval.metadata_store import MetadataStore
+from src.retrieval.lexical_index import LexicalIndex
+from src.retrieval.index_factory import (
+    LayeredIndex, build_index, index_type_of, storage_of, metric_of, layout_of, normalize,
+    train_and_fill, reconstruct_all, apply_search_params, measure_recall
+)
 from src.utils.logger import get_logger
+from src.utils.metrics import stage
 
 logger = get_logger(__name__)
 
+SNAPSHOT_FILES = [f"{kind}{suffix}" for kind in ("text", "image") for suffix in (".faiss", ".live.npy")] + [
+    f"{kind}_meta{suffix}" for kind in ("text", "image") for suffix in MetadataStore.FILE_SUFFIXES
+] + [f"text_lexical{suffix}" for suffix in LexicalIndex.FILE_SUFFIXES]
+LEGACY_FILES = ["text.faiss", "text_meta.pkl", "image.faiss", "image_meta.pkl"]
+OBSOLETE_SNAPSHOT_FILES = ["text_lexical.npz"]  # Lexical index format before it was memory-mapped
+
+class StoreState:
+    """One consistent version of the indexes, their metadata and the lexical index.
+    
+    A published state is never modified. Searches read whichever state is current
+    without locking; writers work on a draft and publish it with a single reference
+    assignment. Indexes are LayeredIndex values that a write replaces, sharing the
+    published rows; metadata and the lexical index are snapshotted on first write,
+    which shares their published rows too.
+    """
+    FIELDS = ("text_index", "image_index", "text_metadata", "image_metadata", "text_lexical")
+    
+    def __init__(self, version: int = 0, **fields):
+        self.version = version
+        for field in self.FIELDS:
+            setattr(self, field, fields.get(field))
+        self._owned = set()
+    
+    def draft(self) -> "StoreState":
+        """Copy sharing every part with this state until it is written"""
+        return StoreState(self.version, **{field: getattr(self, field) for field in self.FIELDS})
+    
+    def writable(self, field: str):
+        """Part of this draft that may be modified in place, snapshotted from the published one on first use"""
+        if field not in self._owned:
+            value = getattr(self, field)
+            if value is not None:
+                setattr(self, field, value.snapshot())
+            self._owned.add(field)
+        return getattr(self, field)
+    
+    def replace(self, field: str, value):
+        """Swap in a newly built part"""
+        setattr(self, field, value)
+        self._owned.add(field)
+
 class VectorStore:
-    def __init__(self, text_dim: int = 384, image_dim: int = 512):
-        self.text_index = None
-        self.image_index = None
-        self.text_metadata = []
-        self.image_metadata = []
+    def __init__(self, text_dim: int = 384, image_dim: int = 512, index_type: Optional[str] = None,
+                 promote_threshold: Optional[int] = None, metric: Optional[str] = None,
+                 storage: Optional[str] = None):
         self.text_dim = text_dim
         self.image_dim = image_dim
+        # Published state searched by readers; version is bumped on every change
+        # so caches can tell when results may differ
+        self._state = StoreState(
+            text_metadata=MetadataStore(),
+            image_metadata=MetadataStore(),
+            text_lexical=self._new_lexical_index()  # BM25 over the same rows as text_index
+        )
+        self._draft = None       # State being built by the current writer
+        self._touched = set()    # Kinds added to by the current writer
+        
+        # Indexes start flat and are promoted to index_type in the background once they grow;
+        # with metric "ip" every vector is unit-normalized so scores are cosine similarities
+        # (higher is better), with "l2" scores are distances (lower is better)
+        self.index_type = index_type or Config.VECTOR_INDEX_TYPE
+        self.metric = metric or Config.VECTOR_METRIC
+        self.storage = storage or Config.VECTOR_STORAGE
+        self.promote_threshold = Config.VECTOR_INDEX_PROMOTE_THRESHOLD if promote_threshold is None else promote_threshold
+        self.nprobe = Config.IVF_NPROBE
+        self.ef_search = Config.HNSW_EF_SEARCH
+        self._promoting = set()
+        self._lineage = {"text": 0, "image": 0}  # Bumped whenever rows are renumbered or an index is replaced
+        
+        # Incremental persistence: a base snapshot plus journal segments written since
+        self._lock = threading.RLock()  # Serializes writers only; searches never take it
+        self._manifest_lock = threading.Lock()
+        self._base_path = None   # Store path the fields below describe
+        self._generation = 0     # Current base snapshot generation
+        self._base_seq = 0       # Last journal segment folded into the base snapshot
+        self._journal_seq = 0    # Last journal segment written
+        self._pending_ops = []   # Changes made since the last save
+        self._compacting = False
+        self._force_snapshot = False  # Set when the index type changed and replay would not rebuild it
+        
+        # Snapshots are opened through read-only memory maps, so worker processes share their pages
+        self._io_flags = getattr(faiss, "IO_FLAG_MMAP_IFC", 0) if Config.VECTOR_STORE_MMAP else 0
+        self._watch_lock = threading.Lock()
+        self._watching = None    # Store path a background thread checks for other workers' changes
+    
+    # Read-only views of the published state
+    @property
+    def version(self) -> int:
+        return self._state.version
+    
+    @property
+    def text_index(self):
+        return self._state.text_index
+    
+    @property
+    def image_index(self):
+        return self._state.image_index
+    
+    @property
+    def text_metadata(self) -> MetadataStore:
+        return self._state.text_metadata
+    
+    @property
+    def image_metadata(self) -> MetadataStore:
+        return self._state.image_metadata
+    
+    @property
+    def text_lexical(self) -> LexicalIndex:
+        return self._state.text_lexical
+    
+    @staticmethod
+    def _new_lexical_index(**kwargs) -> LexicalIndex:
+        return LexicalIndex(k1=Config.BM25_K1, b=Config.BM25_B, **kwargs)
+    
+    @contextmanager
+    def transaction(self, fresh: bool = False, promote: bool = True):
+        """Group writes so searches see all of them or none.
         
+        Writers are serialized; the draft is published when the outermost
+        transaction exits and discarded if it raises. With fresh, the draft
+        starts out empty instead of as a copy of the published state. Without
+        promote, indexes written to are not rebuilt or purged afterwards, as when
+        replaying what another process wrote: that process does it and publishes
+        the result as a new generation.
+        """
+        with self._lock:
+            if self._draft is not None:
+                yield self._draft
+                return
+            
+            if fresh:
+                self._draft = StoreState(
+                    self._state.version,
+                    text_metadata=MetadataStore(),
+                    image_metadata=MetadataStore(),
+                    text_lexical=self._new_lexical_index()
+                )
+                self._draft._owned.update(StoreState.FIELDS)
+            else:
+                self._draft = self._state.draft()
+            self._touched = set()
+            pending_mark = len(self._pending_ops)
+            try:
+                yield self._draft
+            except BaseException:
+                del self._pending_ops[pending_mark:]
+                raise
+            else:
+                self._draft.version = self._state.version + 1
+                self._state = self._draft
+            finally:
+                self._draft = None
+            
+            if promote:
+                for kind in self._touched:
+                    self._maybe_promote(kind)
+    
     def initialize_indexes(self):
         """Initialize empty FAISS indexes"""
-        self.text_index = faiss.IndexFlatL2(self.text_dim)
-        self.image_index = faiss.IndexFlatL2(self.image_dim)
+        with self.transaction() as draft:
+            for kind in ("text", "image"):
+                self._new_flat_index(draft, kind)
         logger.info("Initialized empty FAISS indexes")
     
-    def add_texts(self, documents: List[Dict]):
-        """Add text documents to vector store"""
+    def _new_flat_index(self, draft: StoreState, kind: str):
+        index = build_index("flat", getattr(self, f"{kind}_dim"), metric=self.metric)
+        draft.replace(f"{kind}_index", LayeredIndex(index))
+        self._lineage[kind] += 1
+    
+    def add_texts(self, documents: List[Dict], embeddings: Optional[np.ndarray] = None):
+        """Add text documents to vector store, optionally with a precomputed (n, d) embedding matrix"""
         if not documents:
             return
-            
-        if self.text_index is None:
-            self.initialize_indexes()
         
         try:
-            embeddings = np.array([doc["embedding"] for doc in documents]).astype('float32')
-            self.text_index.add(embeddings)
-            self.text_metadata.extend(documents)
+            with stage("vector_store", "add_texts"), self.transaction():
+                embeddings = self._as_matrix(documents, embeddings)
+                records = [MetadataStore.to_record(doc) for doc in documents]
+                self._add("text", records, embeddings)
+                self._pending_ops.append({"op": "add_texts", "records": records, "embeddings": embeddings})
             logger.info(f"Added {len(documents)} text documents to vector store")
         except Exception as e:
             logger.error(f"Error adding texts to vector store: {str(e)}")
             raise
     
-    def add_images(self, images: List[Dict]):
-        """Add images to vector store"""
+    def add_images(self, images: List[Dict], embeddings: Optional[np.ndarray] = None):
+        """Add images to vector store, optionally with a precomputed (n, d) embedding matrix
+        
+        Only caption, metadata and image_path are kept; the PIL image itself is never stored.
+        """
         if not images:
             return
-            
-        if self.image_index is None:
-            self.initialize_indexes()
         
         try:
-            embeddings = np.array([img["embedding"] for img in images]).astype('float32')
-            self.image_index.add(embeddings)
-            self.image_metadata.extend(images)
+            with stage("vector_store", "add_images"), self.transaction():
+                embeddings = self._as_matrix(images, embeddings)
+                records = [MetadataStore.to_record(img) for img in images]
+                self._add("image", records, embeddings)
+                self._pending_ops.append({"op": "add_images", "records": records, "embeddings": embeddings})
             logger.info(f"Added {len(images)} images to vector store")
         except Exception as e:
             logger.error(f"Error adding images to vector store: {str(e)}")
             raise
     
-    def search_texts(self, query_embedding: np.ndarray, k: int = 5) -> List[Dict]:
-        """Search for similar text documents"""
-        if self.text_index is None or len(self.text_metadata) == 0:
-            return []
+    def _as_matrix(self, items: List[Dict], embeddings: Optional[np.ndarray]) -> np.ndarray:
+        """Contiguous float32 (n, d) matrix, built from the items if none was given"""
+        if embeddings is None:
+            embeddings = np.array([item["embedding"] for item in items])
+        if self.metric == "ip":
+            return normalize(embeddings)
+        return np.ascontiguousarray(embeddings, dtype='float32')
+    
+    @staticmethod
+    def _as_query(index, query_embeddings: np.ndarray) -> np.ndarray:
+        """(n, d) float32 queries, normalized when the index ranks by inner product"""
+        query_embeddings = np.asarray(query_embeddings).reshape(-1, index.d)
+        if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            return normalize(query_embeddings)
+        return np.ascontiguousarray(query_embeddings, dtype='float32')
+    
+    def _add(self, kind: str, records: List[Dict], embeddings: np.ndarray, fold: bool = True):
+        """Add vectors and their records to the text or image side of the draft (inside a transaction)
+        
+        Without fold, appended rows are never folded or merged into the base index and
+        lexical postings, so a memory-mapped snapshot is not copied into this process.
+        """
+        draft = self._draft
+        if getattr(draft, f"{kind}_index") is None:
+            self._new_flat_index(draft, kind)
+        draft.replace(f"{kind}_index", getattr(draft, f"{kind}_index").added(embeddings, fold=fold))
+        draft.writable(f"{kind}_metadata").extend(records)
+        if kind == "text":
+            draft.writable("text_lexical").add([record["text"] for record in records], merge=fold)
+        self._touched.add(kind)
+    
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """Trade recall for latency at query time: IVF lists probed, HNSW candidates explored
+        
+        The parameters are plain fields read when a search starts, so they are
+        set on the published indexes in place rather than on copies.
+        """
+        with self.transaction() as draft:
+            if nprobe:
+                self.nprobe = nprobe
+            if ef_search:
+                self.ef_search = ef_search
+            for index in (draft.text_index, draft.image_index):
+                apply_search_params(index, self.nprobe, self.ef_search)
+    
+    def wait_for_background(self, timeout: Optional[float] = None) -> bool:
+        """Block until no index rebuild or compaction is running; False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._promoting or self._compacting:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+    
+    def _target_layout(self, index) -> tuple:
+        """Layout an index should have: configured once past the threshold, else its current structure"""
+        if index.ntotal >= self.promote_threshold:
+            return self.index_type, "pq" if self.index_type == "ivf_pq" else self.storage, self.metric
+        return index_type_of(index), storage_of(index), self.metric
+    
+    def _maybe_promote(self, kind: str):
+        """Rebuild an index in the background when it outgrows flat search, uses another metric or holds removed rows"""
+        index = getattr(self._state, f"{kind}_index")
+        if index is None or kind in self._promoting:
+            return
+        # Only exact float32 indexes are promoted: they can hand back their vectors losslessly.
+        # Any index is purged of removed rows
+        if not index.removed and (layout_of(index) == self._target_layout(index) or storage_of(index) != "float32"):
+            return
+        self._promoting.add(kind)
+        threading.Thread(
+            target=self._promote_worker, args=(kind, index, self._lineage[kind]),
+            name=f"vector-store-promote-{kind}", daemon=True
+        ).start()
+    
+    def _promote_worker(self, kind: str, old_index, lineage: int):
+        """Train and fill the new index from a published (immutable) one, then swap it in and catch up on recent adds
+        
+        Compressed indexes, and indexes already in their target layout, are only
+        purged of their removed rows.
+        """
+        retry = False
+        try:
+            index_type, storage, metric = self._target_layout(old_index)
+            if storage_of(old_index) != "float32" or layout_of(old_index) == (index_type, storage, metric):
+                index_type, storage, metric = layout_of(old_index)
+                logger.info(f"Purging {old_index.removed} removed rows from {kind} index")
+                new_index = old_index.purged()
+                apply_search_params(new_index, self.nprobe, self.ef_search)
+            else:
+                vectors = reconstruct_all(old_index)
+                if metric == "ip":
+                    vectors = normalize(vectors)
+                logger.info(f"Rebuilding {kind} index as {index_type}/{storage}/{metric} ({len(vectors)} vectors)")
+                new_index = build_index(index_type, old_index.d, len(vectors), metric=metric, storage=storage)
+                train_and_fill(new_index, vectors, Config.VECTOR_INDEX_TRAIN_SAMPLE)
+                apply_search_params(new_index, self.nprobe, self.ef_search)
+                if Config.RECALL_CHECK_QUERIES and (index_type != "flat" or storage != "float32"):
+                    recall = measure_recall(new_index, vectors, n_queries=Config.RECALL_CHECK_QUERIES)
+                    logger.info(f"{kind} index recall@10 after rebuild: {recall:.3f}")
             
+            with self._lock:
+                if self._lineage[kind] != lineage:
+                    logger.info(f"{kind} index changed during rebuild, retrying")
+                    retry = True
+                    return
+                self._swap_promoted(kind, new_index, old_index.ntotal, metric)
+            logger.info(f"Rebuilt {kind} index as {index_type}/{storage}/{metric}")
+        except Exception as e:
+            logger.error(f"Error rebuilding {kind} index: {str(e)}")
+        finally:
+            self._promoting.discard(kind)
+            if retry:
+                with self._lock:
+                    self._maybe_promote(kind)
+    
+    def _swap_promoted(self, kind: str, new_index, n_rebuilt: int, metric: str):
+        """Publish a rebuilt index once it has the rows added while it was built (caller holds the lock)"""
+        with self.transaction() as draft:
+            # Only appends happened since the rebuild started: copy the rows added after it
+            current = getattr(draft, f"{kind}_index")
+            recent = current.reconstruct_n(n_rebuilt, current.ntotal - n_rebuilt)
+            new_index = LayeredIndex(new_index).added(normalize(recent) if metric == "ip" else recent)
+            draft.replace(f"{kind}_index", new_index)
+            self._lineage[kind] += 1
+        
+        # Other processes replay the journal without rebuilding, so they need a new generation
+        if self._pending_ops or self._compacting or self._base_path is None:
+            self._force_snapshot = True  # Written by the next save
+        else:
+            self._compacting = True
+            threading.Thread(
+                target=self._compact_worker, args=(self._base_path, self._capture(), True),
+                name="vector-store-compaction", daemon=True
+            ).start()
+    
+    def check_recall(self, kind: str = "text", vectors: Optional[np.ndarray] = None,
+                     n_queries: int = 200, k: int = 10) -> float:
+        """Recall@k of the live index against exact search.
+        
+        Pass the original embeddings (in insertion order) to measure the full loss
+        from ANN search and compression; without them the index's own decoded
+        vectors are used, which only measures the loss from the search structure.
+        """
+        index = getattr(self._state, f"{kind}_index")
+        if index is None:
+            return 1.0
+        if vectors is None:
+            vectors = reconstruct_all(index)
+        elif index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            vectors = normalize(vectors)
+        return measure_recall(index, np.ascontiguousarray(vectors, dtype='float32'), n_queries=n_queries, k=k)
+    
+    def remove_document(self, doc_id: str) -> int:
+        """Remove every text chunk and image tagged with doc_id, returning how many were removed"""
         try:
-            distances, indices = self.text_index.search(query_embedding.reshape(1, -1).astype('float32'), k)
-            return [
-                {
-                    "document": self.text_metadata[idx],
-                    "score": float(distances[0][i])
-                }
-                for i, idx in enumerate(indices[0])
-                if idx != -1
-            ]
+            with self.transaction():
+                removed = self._remove_document(doc_id)
+                if removed:
+                    self._pending_ops.append({"op": "remove_document", "doc_id": doc_id})
+            if removed:
+                logger.info(f"Removed {removed} vectors for document {doc_id}")
+            return removed
         except Exception as e:
-            logger.error(f"Error searching texts: {str(e)}")
-            return []
+            logger.error(f"Error removing document {doc_id} from vector store: {str(e)}")
+            raise
+    
+    def _remove_document(self, doc_id: str) -> int:
+        return sum(self._remove_where(kind, doc_id) for kind in ("text", "image"))
+    
+    def _remove_where(self, kind: str, doc_id: str) -> int:
+        """Drop rows belonging to doc_id from one index and its metadata store (inside a transaction)"""
+        draft = self._draft
+        index = getattr(draft, f"{kind}_index")
+        metadata = getattr(draft, f"{kind}_metadata")
+        if index is None:
+            return 0
+        positions = metadata.positions_for(doc_id)
+        if len(positions) == 0:
+            return 0
+        
+        # Removed rows are masked out of searches, keeping row numbers aligned with the
+        # metadata store; the promotion worker purges them from the index in the background
+        draft.replace(f"{kind}_index", index.without(positions))
+        draft.replace(f"{kind}_metadata", metadata.without(positions))
+        if kind == "text":
+            draft.writable("text_lexical").remove(positions)
+        self._lineage[kind] += 1
+        self._touched.add(kind)
+        return len(positions)
+    
+    def _apply(self, op: Dict, fold: bool = True):
+        """Replay one journaled operation (inside a transaction); fold as for _add"""
+        if op["op"] == "add_texts":
+            self._add("text", self._op_records(op, "documents"), op["embeddings"], fold)
+        elif op["op"] == "add_images":
+            self._add("image", self._op_records(op, "images"), op["embeddings"], fold)
+        elif op["op"] == "remove_document":
+            self._remove_document(op["doc_id"])
+        else:
+            raise ValueError(f"Unknown journal operation: {op['op']}")
+    
+    @staticmethod
+    def _op_records(op: Dict, legacy_key: str) -> List[Dict]:
+        """Records of an add operation; early journal segments held full items instead"""
+        if "records" in op:
+            return op["records"]
+        return [MetadataStore.to_record(item) for item in op[legacy_key]]
+    
+    def search_texts(self, query_embedding: np.ndarray, k: int = 5) -> List[Dict]:
+        """Search for similar text documents"""
+        results = self.search_texts_batch(query_embedding.reshape(1, -1), k)
+        return results[0] if results else []
     
     def search_images(self, query_embedding: np.ndarray, k: int = 5) -> List[Dict]:
         """Search for similar images"""
-        if self.image_index is None or len(self.image_metadata) == 0:
-            return []
-            
+        results = self.search_images_batch(query_embedding.reshape(1, -1), k)
+        return results[0] if results else []
+    
+    def search_texts_batch(self, query_embeddings: np.ndarray, k: int = 5) -> List[List[Dict]]:
+        """Search an (n, d) matrix of queries with one FAISS call, returning one hit list per query"""
+        state = self._state
+        return self._search_batch(state.text_index, state.text_metadata, "document", query_embeddings, k, "texts")
+    
+    def search_images_batch(self, query_embeddings: np.ndarray, k: int = 5) -> List[List[Dict]]:
+        """Search an (n, d) matrix of image queries with one FAISS call"""
+        state = self._state
+        return self._search_batch(state.image_index, state.image_metadata, "image", query_embeddings, k, "images")
+    
+    def search_texts_hybrid(self, query_text: str, query_embedding: np.ndarray, k: int = 5) -> List[Dict]:
+        """Search text documents by BM25 and vector similarity, fused by reciprocal rank"""
+        results = self.search_texts_hybrid_batch([query_text], query_embedding.reshape(1, -1), k)
+        return results[0] if results else []
+    
+    def search_texts_hybrid_batch(self, query_texts: List[str], query_embeddings: np.ndarray,
+                                  k: int = 5) -> List[List[Dict]]:
+        """Hybrid search for many queries; dense hits still come from a single FAISS call.
+        
+        Each retriever contributes its top HYBRID_CANDIDATES rows; a row's score is
+        the sum of 1 / (RRF_K + rank) over the lists it appears in.
+        """
+        n_queries = len(query_texts)
+        n_candidates = max(k, Config.HYBRID_CANDIDATES)
+        state = self._state
+        index, metadata, lexical = state.text_index, state.text_metadata, state.text_lexical
+        if index is None or len(metadata) == 0:
+            return [[] for _ in range(n_queries)]
+        
+        try:
+            with stage("vector_store", "search_dense"):
+                distances, indices = index.search(self._as_query(index, query_embeddings), n_candidates)
+            results = []
+            for query_text, row_distances, row_indices in zip(query_texts, distances, indices):
+                fused = {}
+                for rank, (row, distance) in enumerate(zip(row_indices, row_distances)):
+                    if row == -1:
+                        continue
+                    entry = fused.setdefault(int(row), {"score": 0.0})
+                    entry["score"] += 1.0 / (Config.RRF_K + rank + 1)
+                    entry["dense_score"] = float(distance)
+                with stage("vector_store", "search_lexical"):
+                    lexical_hits = lexical.search(query_text, n_candidates)
+                for rank, (row, bm25) in enumerate(lexical_hits):
+                    entry = fused.setdefault(row, {"score": 0.0})
+                    entry["score"] += 1.0 / (Config.RRF_K + rank + 1)
+                    entry["lexical_score"] = bm25
+                top = sorted(fused.items(), key=lambda item: item[1]["score"], reverse=True)[:k]
+                results.append([{"document": metadata[row], **scores} for row, scores in top])
+            return results
+        except Exception as e:
+            logger.error(f"Error in hybrid text search: {str(e)}")
+            return [[] for _ in range(n_queries)]
+    
+    def _search_batch(self, index, metadata: MetadataStore, key: str, query_embeddings: np.ndarray,
+                      k: int, label: str) -> List[List[Dict]]:
+        n_queries = len(query_embeddings)
+        if index is None or len(metadata) == 0:
+            return [[] for _ in range(n_queries)]
+        
         try:
-            distances, indices = self.image_index.search(query_embedding.reshape(1, -1).astype('float32'), k)
+            with stage("vector_store", f"search_{label}"):
+                distances, indices = index.search(self._as_query(index, query_embeddings), k)
             return [
-                {
-                    "image": self.image_metadata[idx],
-                    "score": float(distances[0][i])
-                }
-                for i, idx in enumerate(indices[0])
-                if idx != -1
+                [
+                    {
+                        key: metadata[idx],
+                        "score": float(row_distances[i])
+                    }
+                    for i, idx in enumerate(row_indices)
+                    if idx != -1
+                ]
+                for row_distances, row_indices in zip(distances, indices)
             ]
         except Exception as e:
-            logger.error(f"Error searching images: {str(e)}")
-            return []
+            logger.error(f"Error searching {label}: {str(e)}")
+            return [[] for _ in range(n_queries)]
     
     def save(self, base_path: str):
-        """Save vector store to disk with path validation"""
+        """Persist changes since the last save.
+        
+        The first save to a path writes a full base snapshot; later saves only
+        append a journal segment with the new vectors and metadata. Once enough
+        segments pile up they are folded back into a new base in the background.
+        """
         try:
             # Convert property to string if needed
             if hasattr(base_path, '__class__') and isinstance(base_path, property):
                 base_path = base_path.fget()
-                
-            logger.info(f"Saving vector store to: {base_path}")
-            os.makedirs(os.path.dirname(base_path), exist_ok=True)
             
-            # Save text index and metadata
-            if self.text_index is not None:
-                faiss.write_index(self.text_index, f"{base_path}_text.faiss")
-                with open(f"{base_path}_text_meta.pkl", "wb") as f:
-                    pickle.dump(self.text_metadata, f)
-            
-            # Save image index and metadata
-            if self.image_index is not None:
-                faiss.write_index(self.image_index, f"{base_path}_image.faiss")
-                with open(f"{base_path}_image_meta.pkl", "wb") as f:
-                    pickle.dump(self.image_metadata, f)
+            os.makedirs(os.path.dirname(base_path), exist_ok=True)
             
-            logger.info(f"Successfully saved vector store to {base_path}")
+            with stage("vector_store", "save"), self._lock:
+                if self._flush(base_path):
+                    self._maybe_compact(base_path)
         except Exception as e:
             logger.error(f"Error saving vector store: {str(e)}")
             raise
     
+    def compact(self, base_path: str):
+        """Fold all journal segments into a new base snapshot now"""
+        with self._lock:
+            if not self._flush(base_path):
+                return
+            snapshot = self._capture()
+        self._write_snapshot(base_path, snapshot)
+    
+    def _flush(self, base_path: str) -> bool:
+        """Write pending changes (caller holds the lock).
+        
+        Returns False if a full snapshot had to be written instead of a journal segment.
+        """
+        if (base_path != self._base_path or self._force_snapshot
+                or persistence.read_manifest(base_path) is None):
+            logger.info(f"Saving full vector store snapshot to: {base_path}")
+            self._pending_ops = []
+            self._force_snapshot = False
+            self._journal_seq = max(self._journal_seq, self._last_segment_seq(base_path))
+            self._write_snapshot(base_path, self._capture())
+            return False
+        
+        if self._pending_ops:
+            seq = self._journal_seq + 1
+            persistence.append_segment(base_path, seq, self._pending_ops)
+            self._journal_seq = seq
+            self._pending_ops = []
+            with self._manifest_lock:
+                self._write_manifest(base_path)
+            logger.info(f"Appended journal segment {seq} to {base_path}")
+        return True
+    
+    def _maybe_compact(self, base_path: str):
+        """Start background compaction once enough segments have accumulated (caller holds the lock)"""
+        if self._compacting:
+            return
+        if len(persistence.list_segments(base_path, self._base_seq)) < Config.VECTOR_STORE_COMPACT_SEGMENTS:
+            return
+        snapshot = self._capture()
+        self._compacting = True
+        threading.Thread(
+            target=self._compact_worker, args=(base_path, snapshot),
+            name="vector-store-compaction", daemon=True
+        ).start()
+    
+    def _compact_worker(self, base_path: str, snapshot: Dict, rebuilt: bool = False):
+        """Write snapshot as the new base generation; rebuilt marks a snapshot publishing a rebuilt index"""
+        try:
+            with persistence.store_lock(base_path):
+                manifest = persistence.read_manifest(base_path)
+                if rebuilt:
+                    if manifest is None or manifest["generation"] != self._generation:
+                        # Another process wrote a newer base, which this one reloads before its next write
+                        return
+                elif manifest is not None and manifest["base_seq"] >= snapshot["seq"]:
+                    # Another process already compacted at least this far
+                    return
+                with stage("vector_store", "compact"):
+                    self._write_snapshot(base_path, snapshot)
+        except Exception as e:
+            logger.error(f"Vector store compaction failed: {str(e)}")
+            if rebuilt:
+                self._force_snapshot = True
+        finally:
+            self._compacting = False
+    
+    def _capture(self) -> Dict:
+        """The published state as of the last journal segment (caller holds the lock, nothing pending).
+        
+        Published states are immutable, so this is a reference, not a copy.
+        """
+        return {"seq": self._journal_seq, "state": self._state}
+    
+    def _write_snapshot(self, base_path: str, snapshot: Dict):
+        """Write a new base generation, switch the manifest to it and drop what it supersedes"""
+        with self._manifest_lock:
+            # Supersede both this process's generation and the one on disk, which
+            # another process may have written meanwhile
+            current = (persistence.read_manifest(base_path) or {}).get("generation", 0)
+            old_generations = {current, self._generation if self._base_path == base_path else 0} - {0}
+            generation = max(self._generation, current) + 1
+        
+        state = snapshot["state"]
+        written = {}
+        for kind in ("text", "image"):
+            index = getattr(state, f"{kind}_index")
+            if index is None:
+                continue
+            written[kind] = index.flattened() if index.blocks else index
+            persistence.atomic_write_bytes(persistence.base_file(base_path, generation, f"{kind}.faiss"),
+                                           faiss.serialize_index(written[kind].base))
+            if index.live is not None:
+                buffer = io.BytesIO()
+                np.save(buffer, written[kind].live)
+                persistence.atomic_write_bytes(persistence.base_file(base_path, generation, f"{kind}.live.npy"),
+                                               buffer.getvalue())
+            getattr(state, f"{kind}_metadata").save(persistence.base_file(base_path, generation, f"{kind}_meta"))
+        if state.text_index is not None:
+            state.text_lexical.save(persistence.base_file(base_path, generation, "text_lexical"))
+        
+        with self._manifest_lock:
+            self._generation = generation
+            self._base_seq = snapshot["seq"]
+            self._base_path = base_path
+            self._write_manifest(base_path)
+        self._adopt_snapshot(state, written, base_path, generation)
+        
+        for old_generation in old_generations:
+            # Other processes may still have these mapped; unlinking leaves their mappings valid
+            persistence.remove_generation(base_path, old_generation,
+                                          SNAPSHOT_FILES + LEGACY_FILES + OBSOLETE_SNAPSHOT_FILES)
+        persistence.remove_segments_through(base_path, snapshot["seq"])
+        self._remove_legacy_files(base_path)
+        logger.info(f"Wrote vector store snapshot generation {generation} to {base_path}")
+    
+    def _adopt_snapshot(self, state: StoreState, written: Dict, base_path: str, generation: int):
+        """Publish the indexes just written in place of their layered versions, if state is still current.
+        
+        Drops the appended blocks, so later snapshots need not fold them again; with
+        memory maps the new snapshot files are opened, sharing their pages with other
+        workers. Rows are unchanged, so the version is kept. Skipped while a writer is busy.
+        """
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if self._state is not state or self._draft is not None:
+                return
+            adopted = state.draft()
+            for kind, index in written.items():
+                if self._io_flags:
+                    index = self._read_base(base_path, generation, kind)
+                elif not getattr(state, f"{kind}_index").blocks:
+                    continue
+                adopted.replace(f"{kind}_index", index)
+            self._state = adopted
+        finally:
+            self._lock.release()
+    
+    def _write_manifest(self, base_path: str):
+        persistence.write_manifest(base_path, {
+            "format": 2,
+            "generation": self._generation,
+            "base_seq": self._base_seq,
+            "journal_seq": max(self._journal_seq, self._base_seq)
+        })
+    
+    @staticmethod
+    def _last_segment_seq(base_path: str) -> int:
+        segments = persistence.list_segments(base_path)
+        return segments[-1][0] if segments else 0
+    
+    @staticmethod
+    def _remove_legacy_files(base_path: str):
+        """Delete single-file snapshots from before the journal format once a base exists"""
+        for name in LEGACY_FILES:
+            path = f"{base_path}_{name}"
+            if os.path.exists(path):
+                os.remove(path)
+    
     def load(self, base_path: str) -> bool:
-        """Load vector store from disk with error handling"""
+        """Load the base snapshot and replay the journal, with error handling
+        
+        The loaded state replaces the current one in a single step; searches
+        keep using the old state until then.
+        """
         try:
-            # Clear existing data
-            self.text_index = None
-            self.image_index = None
-            self.text_metadata = []
-            self.image_metadata = []
-            
-            # Load text index if exists
-            text_index_path = f"{base_path}_text.faiss"
-            if os.path.exists(text_index_path):
-                self.text_index = faiss.read_index(text_index_path)
-                with open(f"{base_path}_text_meta.pkl", "rb") as f:
-                    self.text_metadata = pickle.load(f)
-            
-            # Load image index if exists
-            image_index_path = f"{base_path}_image.faiss"
-            if os.path.exists(image_index_path):
-                self.image_index = faiss.read_index(image_index_path)
-                with open(f"{base_path}_image_meta.pkl", "rb") as f:
-                    self.image_metadata = pickle.load(f)
+            with stage("vector_store", "load"), persistence.store_lock(base_path, shared=True):
+                self._load(base_path)
             
             if self.text_index or self.image_index:
                 logger.info(f"Loaded vector store from {base_path}")
                 return True
             return False
-            
+        
         except Exception as e:
             logger.error(f"Error loading vector store: {str(e)}")
             # If loading fails, reinitialize empty indexes
             self.initialize_indexes()
             return False
     
+    def _load(self, base_path: str):
+        """Replace the whole state with what is on disk (caller holds the store lock)"""
+        with self.transaction(fresh=True, promote=False) as draft:
+            self._pending_ops = []
+            for kind in ("text", "image"):
+                self._lineage[kind] += 1
+            
+            manifest = persistence.read_manifest(base_path)
+            if manifest is None:
+                self._load_legacy(base_path)
+            else:
+                self._load_snapshot(base_path, manifest)
+            
+            for kind in ("text", "image"):
+                apply_search_params(getattr(draft, f"{kind}_index"), self.nprobe, self.ef_search)
+    
+    def refresh(self, base_path: str, force: bool = False) -> bool:
+        """Pick up changes other worker processes publish under base_path.
+        
+        Cheap enough to call on every request: it only makes sure a background
+        thread is watching base_path. Every VECTOR_STORE_REFRESH_INTERVAL that
+        thread reads the manifest, and only if its generation or journal sequence
+        moved does it replay the new segments on top of the shared base or open
+        the new generation through memory maps; searches use the current state
+        meanwhile. With force, checks now in the calling thread and returns
+        whether anything changed.
+        """
+        if force:
+            return self._refresh_once(base_path)
+        if self._watching != base_path:
+            with self._watch_lock:
+                started = self._watching is not None
+                self._watching = base_path
+            if not started:
+                threading.Thread(target=self._watch_worker, name="vector-store-refresh", daemon=True).start()
+        return False
+    
+    def _watch_worker(self):
+        while self._watching is not None:
+            time.sleep(Config.VECTOR_STORE_REFRESH_INTERVAL)
+            base_path = self._watching
+            if base_path is not None:
+                self._refresh_once(base_path)
+    
+    def _refresh_once(self, base_path: str) -> bool:
+        """Catch up with base_path if its manifest moved past this process's state"""
+        try:
+            manifest = persistence.read_manifest(base_path)
+            if manifest is None or (base_path == self._base_path and manifest["generation"] == self._generation
+                                    and manifest["journal_seq"] <= self._journal_seq):
+                return False
+            with persistence.store_lock(base_path, shared=True):
+                return self._catch_up(base_path)
+        except Exception as e:
+            logger.error(f"Error refreshing vector store from {base_path}: {str(e)}")
+            return False
+    
+    @contextmanager
+    def exclusive(self, base_path: str):
+        """Hold the store's write lock across processes, starting from the latest state on disk.
+        
+        Writers in a multi-process deployment wrap their changes and the save
+        that follows in this, so they never overwrite each other's segments.
+        """
+        with persistence.store_lock(base_path):
+            with self._lock:
+                self._catch_up(base_path, rebase=True)
+                yield self
+    
+    def _catch_up(self, base_path: str, rebase: bool = False) -> bool:
+        """Apply whatever is on disk past this process's state (caller holds the store lock)
+        
+        Local changes a failed save left unsaved are kept: with rebase they are applied
+        again on top of the state on disk, otherwise nothing is caught up.
+        """
+        manifest = persistence.read_manifest(base_path)
+        if manifest is None:
+            return False  # Nothing published yet
+        
+        with self._lock:
+            if self._pending_ops:
+                if not rebase:
+                    return False
+                self._rebase(base_path)
+                return True
+            
+            if base_path != self._base_path or manifest["generation"] != self._generation:
+                self._load(base_path)
+                logger.info(f"Reloaded vector store generation {self._generation} from {base_path}")
+                return True
+            
+            segments = persistence.list_segments(base_path, self._journal_seq)
+            if not segments:
+                return False
+            with self.transaction(promote=False):
+                for seq, path in segments:
+                    for op in persistence.read_segment(path):
+                        self._apply(op, fold=False)
+                    self._journal_seq = seq
+            logger.info(f"Caught up with journal of {base_path} to segment {self._journal_seq}")
+            return True
+    
+    def _rebase(self, base_path: str):
+        """Reload from disk and apply the unsaved local operations again (caller holds both locks).
+        
+        Other processes may have written journal segments since these operations were
+        published, so saving them as they are could overwrite one of those segments.
+        """
+        pending = self._pending_ops
+        logger.warning(f"Reapplying {len(pending)} unsaved operations on top of {base_path}")
+        try:
+            self._load(base_path)
+            with self.transaction():
+                for op in pending:
+                    self._apply(op)
+        finally:
+            # Still unsaved either way; a failed rebase is retried by the next writer
+            self._pending_ops = pending
+    
+    def after_fork(self):
+        """Reset per-process state in a forked worker.
+        
+        Locks a parent thread held at fork time would stay locked forever, and
+        background promotion, compaction or refresh threads do not survive the fork.
+        """
+        self._lock = threading.RLock()
+        self._manifest_lock = threading.Lock()
+        self._watch_lock = threading.Lock()
+        self._promoting = set()
+        self._compacting = False
+        self._draft = None
+        self._watching = None
+    
+    def _load_snapshot(self, base_path: str, manifest: Dict):
+        """Load the manifest's base generation and replay newer journal segments (inside a transaction)"""
+        draft = self._draft
+        generation = manifest["generation"]
+        for kind in ("text", "image"):
+            index_path = persistence.base_file(base_path, generation, f"{kind}.faiss")
+            if not os.path.exists(index_path):
+                continue
+            draft.replace(f"{kind}_index", self._read_base(base_path, generation, kind))
+            meta_prefix = persistence.base_file(base_path, generation, f"{kind}_meta")
+            if os.path.exists(f"{meta_prefix}.pkl"):
+                # Snapshot written before the compact metadata store
+                with open(f"{meta_prefix}.pkl", "rb") as f:
+                    draft.replace(f"{kind}_metadata", self._from_legacy_items(pickle.load(f)))
+            else:
+                draft.replace(f"{kind}_metadata", MetadataStore.load(meta_prefix))
+        
+        if draft.text_index is not None:
+            lexical = LexicalIndex.load(persistence.base_file(base_path, generation, "text_lexical"),
+                                        mmap=Config.VECTOR_STORE_MMAP, k1=Config.BM25_K1, b=Config.BM25_B)
+            if lexical is None or len(lexical) != len(draft.text_metadata):
+                # Snapshot written before the lexical index existed; the next snapshot persists it
+                self._rebuild_lexical_index()
+                self._force_snapshot = True
+            else:
+                draft.replace("text_lexical", lexical)
+        
+        self._generation = generation
+        self._base_seq = manifest["base_seq"]
+        self._journal_seq = self._base_seq
+        self._base_path = base_path
+        
+        for seq, path in persistence.list_segments(base_path, self._base_seq):
+            try:
+                ops = persistence.read_segment(path)
+            except Exception as e:
+                # Only complete segments are ever renamed into place, so this means disk damage;
+                # stop here and have the next save write a fresh snapshot past it
+                logger.error(f"Unreadable journal segment {path}, ignoring it and later segments: {str(e)}")
+                self._base_path = None
+                break
+            for op in ops:
+                self._apply(op, fold=False)
+            self._journal_seq = seq
+        
+        logger.info(f"Replayed journal of {base_path} up to segment {self._journal_seq}")
+    
+    def _read_base(self, base_path: str, generation: int, kind: str) -> LayeredIndex:
+        """Base index of a generation with its removed-row mask, memory-mapped if configured"""
+        # Appends go to blocks on top and removals to a copy of the mask, so a memory-mapped
+        # base is shared, never copied
+        index = faiss.read_index(persistence.base_file(base_path, generation, f"{kind}.faiss"), self._io_flags)
+        apply_search_params(index, self.nprobe, self.ef_search)
+        live_path = persistence.base_file(base_path, generation, f"{kind}.live.npy")
+        live = np.load(live_path, mmap_mode="r" if self._io_flags else None) if os.path.exists(live_path) else None
+        return LayeredIndex(index, mapped=bool(self._io_flags), live=live)
+    
+    def _load_legacy(self, base_path: str):
+        """Load the single-file format written before the journal existed (inside a transaction)"""
+        draft = self._draft
+        # Load text index if exists
+        text_index_path = f"{base_path}_text.faiss"
+        if os.path.exists(text_index_path):
+            draft.replace("text_index", LayeredIndex(faiss.read_index(text_index_path)))
+            with open(f"{base_path}_text_meta.pkl", "rb") as f:
+                draft.replace("text_metadata", self._from_legacy_items(pickle.load(f)))
+        
+        # Load image index if exists
+        image_index_path = f"{base_path}_image.faiss"
+        if os.path.exists(image_index_path):
+            draft.replace("image_index", LayeredIndex(faiss.read_index(image_index_path)))
+            with open(f"{base_path}_image_meta.pkl", "rb") as f:
+                draft.replace("image_metadata", self._from_legacy_items(pickle.load(f)))
+        
+        self._rebuild_lexical_index()
+        # The first save converts the store to the snapshot + journal format
+        self._base_path = None
+    
+    def _rebuild_lexical_index(self):
+        """Index every stored text chunk of the draft from scratch"""
+        lexical = self._new_lexical_index()
+        lexical.add([record["text"] for record in self._draft.text_metadata])
+        self._draft.replace("text_lexical", lexical)
+        logger.info(f"Built lexical index over {len(lexical)} text chunks")
+    
+    @staticmethod
+    def _from_legacy_items(items: List[Dict]) -> MetadataStore:
+        """Convert pickled items, moving any embedded PIL images out to image files"""
+        from src.utils.helpers import save_image
+        for item in items:
+            if item.get("image") is not None and "image_path" not in item:
+                item["image_path"] = save_image(item["image"], Config.IMAGE_STORE_DIR)
+        return MetadataStore.from_items(items)
+    
     def get_stats(self) -> Dict:
         """Get statistics about the vector store"""
+        state = self._state
         return {
-            "text_documents": len(self.text_metadata),
-            "images": len(self.image_metadata),
-            "text_index_exists": self.text_index is not None,
-            "image_index_exists": self.image_index is not None
-        }
\ No newline at end of file
+            "text_documents": len(state.text_metadata),
+            "images": len(state.image_metadata),
+            "text_index_exists": state.text_index is not None,
+            "image_index_exists": state.image_index is not None,
+            "text_index_type": index_type_of(state.text_index),
+            "image_index_type": index_type_of(state.image_index),
+            "text_storage": storage_of(state.text_index),
+            "image_storage": storage_of(state.image_index),
+            "metric": metric_of(state.text_index) or self.metric,
+            "lexical_terms": state.text_lexical.num_terms,
+            "snapshot_generation": self._generation,
+            "journal_segments": max(self._journal_seq - self._base_seq, 0)
+        }
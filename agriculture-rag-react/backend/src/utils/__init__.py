@@ -1,9 +1,22 @@
-from .helpers import save_uploaded_file, is_pdf, extract_first_page_as_image
-from .logger import get_logger
+from .lazy import lazy_exports
 
-__all__ = [
-    'save_uploaded_file',
-    'is_pdf',
-    'extract_first_page_as_image',
-    'get_logger'
-]
\ No newline at end of file
+# Submodules are imported on first attribute access (PEP 562) so that importing
+# one utility does not pull in the others' dependencies
+_EXPORTS = {
+    'save_uploaded_file': '.helpers',
+    'is_pdf': '.helpers',
+    'extract_first_page_as_image': '.helpers',
+    'compute_file_hash': '.helpers',
+    'save_image': '.helpers',
+    'get_logger': '.logger',
+    'log_context': '.logger',
+    'BackgroundEventLoop': '.event_loop',
+    'timed': '.startup',
+    'startup_timings': '.startup',
+    'WarmUp': '.startup',
+    'stage': '.metrics'
+}
+
+__all__ = list(_EXPORTS)
+
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS)
@@ -0,0 +1,76 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import threading
+from typing import Any, Awaitable, Optional
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+async def _in_context(coro: Awaitable, context: contextvars.Context) -> Any:
+    """Await coro with the caller's context variables (request ID, stage timings) set.
+    
+    run_coroutine_threadsafe() creates the task from the loop thread's own
+    context, so values bound by the calling thread would otherwise be lost.
+    """
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+class BackgroundEventLoop:
+    """An asyncio event loop running on its own daemon thread.
+    
+    Synchronous callers (Flask worker threads) hand coroutines to the loop and
+    wait on the result, so all in-flight network I/O is multiplexed on one loop
+    and can share loop-bound resources such as an httpx.AsyncClient.
+    """
+    def __init__(self, name: str = "event-loop"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._lock = threading.Lock()
+    
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The running loop, started on first use (and again in a forked child)"""
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._start()
+            return self._loop
+    
+    def _start(self):
+        ready = threading.Event()
+        
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.call_soon(ready.set)
+            self._loop.run_forever()
+        
+        self._loop = asyncio.new_event_loop()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=run, name=self.name, daemon=True)
+        self._thread.start()
+        ready.wait()
+        logger.info(f"Started background event loop '{self.name}'")
+    
+    def in_loop(self) -> bool:
+        """True when called from the loop's own thread"""
+        return self._thread is not None and threading.current_thread() is self._thread
+    
+    def run(self, coro: Awaitable, timeout: Optional[float] = None) -> Any:
+        """Run a coroutine on the loop and block until it finishes"""
+        if self.in_loop():
+            raise RuntimeError("BackgroundEventLoop.run() would deadlock when called from the loop thread")
+        return self.submit(coro).result(timeout)
+    
+    def submit(self, coro: Awaitable) -> concurrent.futures.Future:
+        """Schedule a coroutine on the loop without waiting; cancel() the future to stop it"""
+        return asyncio.run_coroutine_threadsafe(_in_context(coro, contextvars.copy_context()), self.loop)
+    
+    async def run_async(self, coro: Awaitable) -> Any:
+        """Await a coroutine on the loop from any other event loop"""
+        if self.in_loop():
+            return await coro
+        return await asyncio.wrap_future(self.submit(coro))
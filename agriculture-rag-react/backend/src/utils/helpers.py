@@ -1,4 +1,5 @@
 import os
+import hashlib
 import tempfile
 from typing import Union
 from PIL import Image
@@ -25,6 +26,28 @@ def is_pdf(file_path: str) -> bool:
     """Check if file is PDF"""
     return file_path.lower().endswith('.pdf')
 
+def compute_file_hash(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Stream a file through SHA-256 without loading it into memory"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def save_image(image: Image.Image, save_dir: str) -> str:
+    """Save image under a content-derived name and return its path; identical images share a file"""
+    os.makedirs(save_dir, exist_ok=True)
+    if image.mode not in ("RGB", "RGBA", "L"):
+        image = image.convert("RGB")
+    digest = hashlib.sha1(f"{image.mode}:{image.size}".encode("utf-8"))
+    digest.update(image.tobytes())
+    file_path = os.path.join(save_dir, f"{digest.hexdigest()}.png")
+    if not os.path.exists(file_path):
+        tmp_path = f"{file_path}.tmp"
+        image.save(tmp_path, format="PNG")
+        os.replace(tmp_path, file_path)
+    return file_path
+
 def extract_first_page_as_image(pdf_path: str) -> Union[Image.Image, None]:
     """Extract first page of PDF as PIL Image"""
     try:
@@ -0,0 +1,23 @@
+import importlib
+from typing import Callable, Dict, Tuple
+
+def lazy_exports(package: str, exports: Dict[str, str], modules: bool = False) -> Tuple[Callable, Callable]:
+    """Module __getattr__ and __dir__ (PEP 562) that import exports on first access.
+    
+    exports maps each public name to the module defining it, relative to
+    package. With modules=True the names are the modules themselves.
+    """
+    namespace = importlib.import_module(package).__dict__
+    
+    def __getattr__(name):
+        if name not in exports:
+            raise AttributeError(f"module {package!r} has no attribute {name!r}")
+        module = importlib.import_module(exports[name], package)
+        value = module if modules else getattr(module, name)
+        namespace[name] = value  # Later lookups skip __getattr__
+        return value
+    
+    def __dir__():
+        return sorted(set(namespace) | set(exports))
+    
+    return __getattr__, __dir__
@@ -1,35 +1,244 @@
+"""Process-wide logging set up once and written off the request path.
+
+Every module logger propagates to a single queue handler on the root logger.
+Calling threads only merge the message, render tracebacks and attach context
+fields; formatting and disk/console writes happen on a background listener
+thread. When the queue is full, records are dropped (and counted) instead of
+blocking the caller.
+
+Context fields bound with log_context() (request ID, job ID, ...) and stage
+durations recorded with record_stage() are attached to every record logged
+inside the block, including from coroutines run on a BackgroundEventLoop and
+work handed to asyncio.to_thread. Extra per-record fields go in
+extra={"fields": {...}}.
+
+Levels: LOG_LEVEL for everything, LOG_LEVELS for overrides per logger
+subtree, e.g. "src.retrieval=DEBUG,src.ingestion=WARNING,httpx=WARNING".
+"""
+import atexit
+import json
 import logging
 import os
+import queue
+import re
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional
 from config import Config
 
-def get_logger(name: str) -> logging.Logger:
-    """Configure and return logger instance"""
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
-    
-    # Create logs directory if it doesn't exist
-    os.makedirs("logs", exist_ok=True)
+_context: ContextVar[Optional[Dict]] = ContextVar("log_context", default=None)
+
+_setup_lock = threading.Lock()
+_queue_handler = None
+_listener = None
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+def _parse_levels(spec: str) -> Dict[str, int]:
+    """'src.retrieval=DEBUG, httpx=warning' -> {logger name: level}"""
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return levels
+
+class _ContextFilter(logging.Filter):
+    """Attach the bound context fields; runs in the logging thread, before the record is queued"""
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _context.get()
+        extra = getattr(record, "fields", None)
+        if context is None:
+            record.fields = dict(extra) if extra else {}
+        else:
+            record.fields = {**context["fields"], **extra} if extra else dict(context["fields"])
+        return True
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Queue handler that never blocks the caller and defers formatting to the listener"""
+    def __init__(self, log_queue: queue.Queue, targets: List[logging.Handler]):
+        super().__init__(log_queue)
+        self.targets = targets  # Written to by the listener thread
+        self.dropped = 0
+        self._traceback_formatter = logging.Formatter()
     
-    # File handler
-    log_file = f"logs/{name}_{datetime.now().strftime('%Y%m%d')}.log"
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setLevel(logging.DEBUG)
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only what cannot wait: arguments may change and tracebacks reference live frames
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
     
-    # Console handler
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
+    def enqueue(self, record: logging.LogRecord):
+        if _listener is None:
+            _start_listener()  # First record in a forked child
+        try:
+            if self.dropped and self.queue.qsize() < self.queue.maxsize // 2:
+                # Report the loss once the writer has caught up
+                dropped, self.dropped = self.dropped, 0
+                self.queue.put_nowait(logging.makeLogRecord({
+                    "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                    "msg": f"Dropped {dropped} log records: logging queue was full", "fields": {}
+                }))
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class _TextFormatter(logging.Formatter):
+    """The classic one-line format, followed by key=value context fields"""
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if not fields:
+            return line
+        rendered = " ".join(f"{key}={json.dumps(value) if isinstance(value, (dict, list)) else value}"
+                            for key, value in fields.items())
+        head, newline, rest = line.partition("\n")  # Keep fields on the message line, above any traceback
+        return f"{head} [{rendered}]{newline}{rest}"
+
+class _JsonFormatter(logging.Formatter):
+    """One JSON object per line for log shippers"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "fields", {})
+        }
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class _DailyFileHandler(logging.FileHandler):
+    """Appends to <directory>/<prefix>_YYYYMMDD.log, moving to a new file at midnight.
     
-    # Formatter
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
+    Files are never renamed, so several worker processes can share them.
+    """
+    def __init__(self, directory: str, prefix: str):
+        self._directory = directory
+        self._prefix = prefix
+        self._rollover_at = 0.0
+        os.makedirs(directory, exist_ok=True)
+        super().__init__(self._current_path(), delay=True)
     
-    # Add handlers if not already added
-    if not logger.handlers:
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
+    def _current_path(self) -> str:
+        now = datetime.now()
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        self._rollover_at = midnight.timestamp() + 86400
+        return os.path.join(self._directory, f"{self._prefix}_{now.strftime('%Y%m%d')}.log")
     
-    return logger
\ No newline at end of file
+    def emit(self, record: logging.LogRecord):
+        if record.created >= self._rollover_at:
+            self.close()
+            self.baseFilename = os.path.abspath(self._current_path())
+        super().emit(record)
+
+def _build_handlers() -> List[logging.Handler]:
+    formatter = _JsonFormatter() if Config.LOG_FORMAT == "json" else _TextFormatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler(), _DailyFileHandler(Config.LOG_DIR, Config.LOG_FILE_PREFIX)]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+def _start_listener():
+    global _listener
+    with _setup_lock:
+        if _listener is None and _queue_handler is not None:
+            _listener = QueueListener(_queue_handler.queue, *_queue_handler.targets, respect_handler_level=True)
+            _listener.start()
+
+def _after_fork_in_child():
+    """The listener thread and queue lock do not survive a fork; the next record starts new ones"""
+    global _listener, _setup_lock
+    _setup_lock = threading.Lock()
+    if _queue_handler is not None:
+        _queue_handler.queue = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+        _listener = None
+
+def _stop_listener():
+    """Flush what is still queued at interpreter exit"""
+    if _listener is not None:
+        _listener.stop()
+
+def configure_logging():
+    """Install the queue handler, writers and levels; later calls are no-ops"""
+    global _queue_handler
+    with _setup_lock:
+        if _queue_handler is not None:
+            return
+        handler = _NonBlockingQueueHandler(queue.Queue(maxsize=Config.LOG_QUEUE_SIZE), _build_handlers())
+        handler.addFilter(_ContextFilter())
+        root = logging.getLogger()
+        root.addHandler(handler)
+        root.setLevel(logging.getLevelName(Config.LOG_LEVEL.upper()))
+        for name, level in _parse_levels(Config.LOG_LEVELS).items():
+            logging.getLogger(name).setLevel(level)
+        _queue_handler = handler
+    _start_listener()
+    atexit.register(_stop_listener)
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_after_fork_in_child)
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger for a module; handlers live on the root logger and are set up once"""
+    configure_logging()
+    return logging.getLogger(name)
+
+def push_context(**fields) -> Token:
+    """Bind fields to every record logged in this context until pop_context(token)"""
+    outer = _context.get()
+    merged = {**outer["fields"], **fields} if outer else fields
+    return _context.set({"fields": merged, "stages": {}})
+
+def pop_context(token: Token):
+    try:
+        _context.reset(token)
+    except ValueError:
+        # Reset from another context (e.g. a teardown hook); just drop the binding
+        _context.set(None)
+
+@contextmanager
+def log_context(**fields):
+    """Bind fields (request_id, job_id, ...) to every record logged inside the block"""
+    token = push_context(**fields)
+    try:
+        yield
+    finally:
+        pop_context(token)
+
+def bind_fields(**fields):
+    """Add fields to the innermost active context, if any"""
+    context = _context.get()
+    if context is not None:
+        context["fields"].update(fields)
+
+def current_fields() -> Dict:
+    """Copy of the fields bound in this context, e.g. to carry a request ID over to a worker thread"""
+    context = _context.get()
+    return dict(context["fields"]) if context else {}
+
+def record_stage(name: str, seconds: float):
+    """Add a stage's duration to the innermost active context (repeated stages add up)"""
+    context = _context.get()
+    if context is not None:
+        stages = context["stages"]
+        stages[name] = stages.get(name, 0.0) + seconds
+
+def stage_durations() -> Dict[str, float]:
+    """Milliseconds spent per stage in the innermost active context so far"""
+    context = _context.get()
+    if context is None:
+        return {}
+    return {name: round(seconds * 1000, 2) for name, seconds in context["stages"].items()}
+
+_REQUEST_ID_RE = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+def valid_request_id(value: Optional[str]) -> Optional[str]:
+    """A caller-supplied request ID if it is safe to log and echo, else None"""
+    return value if value and _REQUEST_ID_RE.fullmatch(value) else None
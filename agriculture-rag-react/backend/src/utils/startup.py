@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Optional
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+_timings: Dict[str, float] = {}
+
+@contextmanager
+def timed(label: str):
+    """Log how long the block took as '<label> in <seconds>s' and remember it"""
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    _timings[label] = elapsed
+    logger.info(f"{label} in {elapsed:.2f}s")
+
+def startup_timings() -> Dict[str, float]:
+    """Seconds spent in every timed() block so far, by label"""
+    return dict(_timings)
+
+class WarmUp:
+    """Named loading steps that run at most once, either on demand or up front.
+    
+    Components load themselves lazily on first use; warming up just makes that
+    first use happen before traffic arrives, and ready() tells a readiness
+    probe whether it has.
+    """
+    def __init__(self):
+        self._steps: Dict[str, Callable[[], None]] = OrderedDict()
+        self._seconds: Dict[str, float] = {}
+        self._errors: Dict[str, str] = {}
+        self._locks: Dict[str, threading.Lock] = {}  # Per step, so a slow model never holds up the store
+    
+    def register(self, name: str, step: Callable[[], None]):
+        self._steps[name] = step
+        self._locks[name] = threading.Lock()
+    
+    def run(self, name: str):
+        """Run one step unless it already succeeded"""
+        if name in self._seconds:
+            return
+        with self._locks[name]:
+            if name in self._seconds:
+                return
+            start = time.perf_counter()
+            try:
+                self._steps[name]()
+            except Exception as e:
+                self._errors[name] = str(e)
+                logger.error(f"Warm-up step {name} failed: {str(e)}")
+                raise
+            self._errors.pop(name, None)
+            self._seconds[name] = time.perf_counter() - start
+        logger.info(f"Warmed up {name} in {self._seconds[name]:.2f}s")
+    
+    def warm_up(self, names: Optional[Iterable[str]] = None) -> bool:
+        """Run the given steps (default: all), carrying on past failures; True if all succeeded"""
+        ok = True
+        for name in (self._steps if names is None else names):
+            if name not in self._steps:
+                logger.warning(f"Unknown warm-up step: {name}")
+                continue
+            try:
+                self.run(name)
+            except Exception:
+                ok = False
+        return ok
+    
+    def ready(self, names: Iterable[str]) -> bool:
+        return all(name in self._seconds for name in names if name in self._steps)
+    
+    def status(self) -> Dict[str, Dict]:
+        """Per step: whether it has run, how long it took and the last error"""
+        return {
+            name: {
+                "loaded": name in self._seconds,
+                "seconds": self._seconds.get(name),
+                "error": self._errors.get(name)
+            }
+            for name in self._steps
+        }
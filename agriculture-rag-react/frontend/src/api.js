@@ -25,9 +25,33 @@ export const uploadDocument = async (file) => {
   if (!response.ok) {
     throw new Error(await response.text());
   }
+  const data = await response.json();
+  // Already-ingested documents come back immediately without a job
+  return data.job_id ? await waitForJob(data.job_id) : data;
+};
+
+export const getJob = async (jobId) => {
+  const response = await fetch(`${API_URL}/api/jobs/${jobId}`);
+  if (!response.ok) {
+    throw new Error(await response.text());
+  }
   return await response.json();
 };
 
+// Poll an ingestion job until it finishes, resolving to the old upload response shape
+export const waitForJob = async (jobId, intervalMs = 2000) => {
+  for (;;) {
+    const job = await getJob(jobId);
+    if (job.status === 'completed') {
+      return { success: true, ...job.result };
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.error || 'Document processing failed');
+    }
+    await new Promise(resolve => setTimeout(resolve, intervalMs));
+  }
+};
+
 export const getPreview = async (filename) => {
   const response = await fetch(`${API_URL}/api/preview/${filename}`, {
     credentials: 'include'